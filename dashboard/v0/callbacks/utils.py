@@ -1,13 +1,29 @@
 from pathlib import Path
 from dash import html
 import base64
+import io
+import numpy as np
+from PIL import Image
 import dash_bootstrap_components as dbc
 import json
 from typing import List, Dict
 
+from src.streetTransformer.modalities.imagery.store import read_from_store_for_path
+
 # Images
 def encode_image(image_path: Path):
-    encoded = base64.b64encode(open(image_path, 'rb').read()).decode('utf-8')
+    image_path = Path(image_path)
+    if image_path.exists():
+        raw = image_path.read_bytes()
+    else:
+        # Fall back to the universe's imagery store (packed PNGs)
+        arr = read_from_store_for_path(image_path)
+        if arr is None:
+            raise FileNotFoundError(image_path)
+        buf = io.BytesIO()
+        Image.fromarray(np.asarray(arr)).save(buf, format='PNG')
+        raw = buf.getvalue()
+    encoded = base64.b64encode(raw).decode('utf-8')
     return 'data:image/png;base64,' + encoded
 
 def serve_image(image_path: Path):
@@ -1,8 +1,9 @@
 # TODO: break this out
 from dash import Output, Input, State, no_update, html
-from setup import YEARS, PROJECTS_GDF, FEATURES_GDF
+from setup import YEARS, PROJECTS_GDF, FEATURES_GDF, FEATURE_INTERVALS, LOCATIONS_GCS
 import pandas as pd
 import numpy as np
+from shapely.geometry import Point
 
 # Imagery Card
 # def imagery_card(grid_data, year):
@@ -15,8 +16,18 @@ import numpy as np
 
 
 # Features Card
+def _nearest_location_id(lat, lng):
+    idx = LOCATIONS_GCS.sindex.nearest(Point(lng, lat), return_all=False)[1][0]
+    return int(LOCATIONS_GCS.iloc[idx]['location_id'])
+
 def get_feature_data(lat, lng):
-    
+    if FEATURE_INTERVALS is not None:
+        # Point-in-time lookups for the nearest location: Y if any feature row is active on Jan 1
+        location_id = _nearest_location_id(lat, lng)
+        counts = FEATURE_INTERVALS.active_matrix(location_id, [f'{y}-01-01' for y in YEARS])
+        counts.columns = YEARS
+        return counts.gt(0).replace({True: 'Y', False: 'N'})
+
     full = len(YEARS)
     half = np.floor(full/2)
 
@@ -3,20 +3,17 @@ from dash import Output, Input, State, callback_context, no_update
 import requests
 import dash_leaflet as dl
 import mercantile
-import pandas as pd
 import numpy as np
 
-from setup import YEARS, ZLEVEL, TILE_URL_TEMPLATE, GEOCODE_API, LOCATIONS_GDF
+from setup import YEARS, ZLEVEL, TILE_URL_TEMPLATE, GEOCODE_API, LOCATIONS_GDF, UNIVERSE_PATH
+from src.streetTransformer.locations.street_index import StreetIndex, STREET_INDEX_FILENAME
 
-locations_gdf = LOCATIONS_GDF['crossstreets'].tolist()
-df = LOCATIONS_GDF.copy()
-df[['street1','street2']] = pd.DataFrame(df['crossstreets'].tolist(), df.index)
-all_streets = np.sort(pd.concat([df['street1'], df['street2']]).unique())
-
-adjacency = {}
-for a, b in locations_gdf:
-    adjacency.setdefault(a, set()).add(b)
-    adjacency.setdefault(b, set()).add(a)
+# Street adjacency (int ids + CSR), persisted next to the locations and only rebuilt when they change
+street_index = StreetIndex.load_or_build(
+    UNIVERSE_PATH / 'locations' / STREET_INDEX_FILENAME, LOCATIONS_GDF,
+    source_path=UNIVERSE_PATH / 'locations.feather'
+)
+all_street_options = [{"label": s, "value": s} for s in street_index.names]
 
 
 # Helper: compute grid of tiles around a lat/lon
@@ -100,19 +97,14 @@ def register_input_callbacks(app):
     )
     def filter_options(selected):
         if not selected:
-            return [{"label": s, "value": s} for s in all_streets], []
-
-        # Start with streets connected to the first selected
-        valid = adjacency[selected[0]].copy()
-
-        # Intersect for every other selected street
-        for s in selected[1:]:
-            valid &= adjacency.get(s, set())
+            return all_street_options, []
 
-        # Remove already selected streets from suggestions
-        valid -= set(selected)
+        # Streets crossing every selected street (sorted int-array intersections), plus the selection;
+        # ids are numbered in name order, so sorting ids sorts the names
+        selected_ids = street_index.ids(selected)
+        option_ids = np.union1d(street_index.valid_ids_with(selected_ids), selected_ids)
 
-        new_data = [{"label": s, "value": s} for s in sorted(valid.union(selected))]
+        new_data = [{"label": s, "value": s} for s in street_index.names[option_ids]]
         return new_data, selected
 
 
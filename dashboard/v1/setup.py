@@ -18,12 +18,18 @@ import preprocessing.st_preprocessing
 from preprocessing.data_load.load_lion import load_lion_default
 from preprocessing.citydata.features_pipeline import count_features_for_locations
 from preprocessing.citydata.cap_recon_pipeline import gather_capital_projects_for_locations
+from src.streetTransformer.modalities.citydata.temporal import TemporalFeatureStore
 
 #UNIVERSE = 'dt_bk'
 #LION_DB = gpd.read_file(project_dir / 'src/streetTransformer/data/universes/' / UNIVERSE / 'locations/lion.geojson')
 #LION_DB_temp = load_lion_default('nyc')
-LION_DB_temp = gpd.read_feather(project_dir / 'src/streetTransformer/data/universes/caprecon3/locations.feather')
+UNIVERSE_PATH = project_dir / 'src/streetTransformer/data/universes/caprecon3'
+LION_DB_temp = gpd.read_feather(UNIVERSE_PATH / 'locations.feather')
 LOCATIONS_GDF = LION_DB_temp[LION_DB_temp['crossstreets'].apply(len) == 2] # TODO: fix this
+LOCATIONS_GCS = LOCATIONS_GDF.to_crs('4326')
+
+# Feature validity intervals (features/intervals.parquet from features_pipeline), if built
+FEATURE_INTERVALS = TemporalFeatureStore.for_universe(UNIVERSE_PATH)
 
 FEATURES_GDF = count_features_for_locations(LOCATIONS_GDF, buffer_width=100).to_crs('4326')
 PROJECTS_GDF = gather_capital_projects_for_locations(LOCATIONS_GDF).to_crs('4326')
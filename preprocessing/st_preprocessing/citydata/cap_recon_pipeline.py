@@ -13,6 +13,7 @@ import geopandas as gpd
 
 from .features.load import load_standard
 from .geoprocessing import buffer_locations # This is awkward
+from .nearest import NearestFeatureIndex
 from ..data_load.load_lion import load_lion_default
 
 from streettransformer.config.constants import DATA_PATH
@@ -50,38 +51,32 @@ def gather_capital_projects_for_locations(locations_gdf:gpd.GeoDataFrame, outfil
     projects_gdf_p = projects_gdf.copy().to_crs('2263') # TODO: store crs in config somewhere
     
     locations_p = locations_gdf.copy().to_crs('2263')
-    
-    # Buffer
-    locations_buffer = locations_p.copy()
-    locations_buffer['point_geom'] = locations_p.geometry
-    locations_buffer = locations_buffer.set_geometry(locations_buffer.geometry.buffer(100))
-
-    hits = gpd.sjoin(locations_buffer, projects_gdf_p, how="inner", predicate="intersects") # gets all projects within 100 feet of location
-
-    joined = hits[['location_id', 'geometry', 'point_geom','index_right','ProjectID', 'ProjTitle']].merge(
-        projects_gdf_p[['geometry', 'ProjTitle']],
-        left_on = 'index_right', right_index=True,
-        suffixes = ['', '_project'],
-        how='inner', indicator=True # Basically all works. Only 1 is right_only, 0 left_only
-    )
 
-    distance_to_project = joined['point_geom'].distance(joined['geometry_project']) # pairwise distances
+    # All projects within `buffer_width` feet of each location, with exact point-to-project distances
+    pairs = NearestFeatureIndex(projects_gdf_p).within(locations_p.geometry, radius=buffer_width)
 
-    # summarize
-    location_projects_gdf = hits.rename(columns = {'index_right': 'city_project_id',})
-    location_projects_gdf['distance'] = distance_to_project
-    export_cols = locations_gdf.columns.tolist() + [
-        'ProjectID','city_project_id','ProjTitle','ProjectType', 'ProjectStatus', 'ConstructionFY',
+    # summarize: one row per (location, project), indexed like `locations_gdf`
+    location_rows = locations_p.iloc[pairs['location_id'].to_numpy()]
+    location_projects_gdf = location_rows.set_geometry(location_rows.geometry.buffer(buffer_width))
+    location_projects_gdf['city_project_id'] = pairs['feature_index'].to_numpy()
+    location_projects_gdf['distance'] = pairs['distance'].to_numpy()
+
+    project_cols = ['ProjectID','ProjTitle','ProjectType', 'ProjectStatus', 'ConstructionFY',
          'DesignStartDate', 'ConstructionEndDate', 'CurrentFunding',
          'ProjectCost', 'OversallScope', 'SafetyScope', 'OtherScope',
          'ProjectJustification', 'OnStreetName', 'FromStreetName']
+    # One positional gather for all project columns
+    project_rows = projects_gdf_p.iloc[pairs['feature_pos'].to_numpy(), projects_gdf_p.columns.get_indexer(project_cols)]
+    for col in project_cols:
+        location_projects_gdf[col] = project_rows[col].to_numpy()
+
+    export_cols = locations_gdf.columns.tolist() + ['ProjectID','city_project_id'] + project_cols[1:] + ['distance']
     # Clean up a bit
     
     # location_projects_gdf['DesignStartDate'] = pd.to_datetime(location_projects_gdf['DesignStartDate'])
     # location_projects_gdf['ConstructionEndDate'] = pd.to_datetime(location_projects_gdf['ConstructionEndDate'])
 
     location_projects_gdf = location_projects_gdf[export_cols] 
-    location_projects_gdf = location_projects_gdf.set_geometry('geometry') # TODO: Refactor this or just clean up
     
     # If outfile:
     if outfile:
@@ -90,6 +85,18 @@ def gather_capital_projects_for_locations(locations_gdf:gpd.GeoDataFrame, outfil
     # So this is load, need to then do the summarize.
     return location_projects_gdf
 
+
+def nearest_capital_projects(locations_gdf:gpd.GeoDataFrame, k:int=5, max_distance:Optional[float]=None) -> pd.DataFrame:
+    """The `k` nearest capital reconstruction projects per location (location_id, city_project_id, distance, rank)."""
+    projects_gdf_p = load_caprecon_file(data_path=OPENNYC_DATA_PATH, source_file_name=CORE_FILE_NAME).to_crs('2263')
+    locations_p = locations_gdf.to_crs('2263')
+
+    pairs = NearestFeatureIndex(projects_gdf_p).knn(
+        locations_p.geometry, k=k, max_distance=max_distance, location_ids=locations_p['location_id']
+    )
+    pairs = pairs.rename(columns={'feature_index': 'city_project_id'})
+    return pairs.merge(projects_gdf_p[['ProjectID', 'ProjTitle']], left_on='city_project_id', right_index=True, how='left')
+
 if __name__ == '__main__':
     # This is kinda gonna just copy the `features_pipeline`. TOOD: Refactor into a factory?
 
@@ -0,0 +1,90 @@
+"""
+GeoParquet cache for loaded-and-cleaned OpenNYC feature layers.
+
+Parsing the CSVs and their WKT geometries is the slow part of the features
+pipeline, and the result only changes when the source CSV or the code that
+loads/cleans it changes. Each cleaned layer is therefore stored as
+`{cache_dir}/{feature}-{key}.parquet`, where `key` hashes the CSV contents and
+the source of its load and clean functions. A warm run just reads GeoParquet.
+"""
+import os
+import inspect
+import hashlib
+import logging
+from pathlib import Path
+from typing import Callable, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+
+from .load import load_standard
+
+logger = logging.getLogger(__name__)
+
+def _file_digest(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _func_digest(func: Callable) -> str:
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = f'{func.__module__}.{func.__qualname__}'
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def _resolve_load_method(feat_data: Dict) -> Callable:
+    return load_standard if feat_data['load_method'] == 'standard' else feat_data['load_method']
+
+
+def cache_key(source_path: Path, load_method: Callable, clean_method: Callable) -> str:
+    h = hashlib.sha256()
+    for part in (_file_digest(source_path), _func_digest(load_method), _func_digest(clean_method)):
+        h.update(part.encode())
+    return h.hexdigest()[:16]
+
+
+def load_clean_cached(feat: str, feat_data: Dict, root_data_path: Path, cache_dir: Path) -> gpd.GeoDataFrame:
+    """Load + clean one feature layer (EPSG:4326), from the cache when the key matches."""
+    source_path = root_data_path / Path(feat_data['file_path'])
+    load_method, clean_method = _resolve_load_method(feat_data), feat_data['clean_method']
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cache_path = cache_dir / f'{feat}-{cache_key(source_path, load_method, clean_method)}.parquet'
+    if cache_path.exists():
+        return gpd.read_parquet(cache_path)
+
+    cleaned = clean_method(load_method(source_path)).set_crs('4326', allow_override=True)
+
+    tmp_path = cache_path.with_suffix('.tmp')
+    cleaned.to_parquet(tmp_path)
+    os.replace(tmp_path, cache_path)
+    for stale in cache_dir.glob(f'{feat}-*.parquet'): # older versions of this layer
+        if stale != cache_path:
+            stale.unlink()
+    return cleaned
+
+
+def load_and_clean_all_cached(feat_metadata: Dict[str, Dict], root_data_path: Path, cache_dir: Path,
+                              max_workers: Optional[int] = None, silent: bool = False) -> Dict[str, gpd.GeoDataFrame]:
+    """Load + clean every layer concurrently (CSV parsing and WKT decoding release the GIL)."""
+    if not silent:
+        print('\nLoading and Cleaning Feature Files..')
+
+    cleaned_gdfs = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(feat_metadata)) as ex:
+        futures = {feat: ex.submit(load_clean_cached, feat, feat_data, root_data_path, cache_dir)
+                   for feat, feat_data in feat_metadata.items()}
+        for feat, fut in futures.items():
+            try:
+                cleaned_gdfs[feat] = fut.result()
+                if not silent:
+                    print(f'\t{feat}: Success!')
+            except Exception as e:
+                print(f'\t{feat}: Fail! {e}')
+
+    return cleaned_gdfs
@@ -15,31 +15,38 @@ from shapely.geometry import Point
 
 
 from .features.load import load_standard
+from .features.cache import load_and_clean_all_cached
 from .features.clean import clean_bike_rtes, clean_bus_lanes, clean_ped_plaza, clean_traffic_calming # Note: used in 
-from .features.summarize import count_features_by_location
+from .features.summarize import count_features_batched
 #from preprocessing.data_load.load_intersections import load_location
 from .geoprocessing import buffer_locations
 from ..data_load.load_lion import load_lion_default
-from ..config import YEARS, OPENNYC_PATH, UNIVERSES_PATH
+from ..config import YEARS, OPENNYC_PATH, UNIVERSES_PATH, FEATURE_CACHE_PATH
 
 from streettransformer.locations.location_geometry import LocationGeometry
 from streettransformer.locations.location import Location
+from streettransformer.modalities.citydata.feature_store import write_feature_partition
+from streettransformer.modalities.citydata.temporal import build_intervals_table, INTERVALS_FILENAME
 import tqdm
 
 
 FEATURE_METADATA = {
     'bike_rtes': {'file_path': 'New_York_City_Bike_Routes_20250722.csv', 
                   'load_method': 'standard', 'clean_method': clean_bike_rtes, 
-                  'shorthand': 'bike', 'date_col': 'installdate'},
+                  'shorthand': 'bike', 'date_col': 'installdate',
+                  'valid_from_col': 'installdate', 'valid_to_col': 'removedate'},
     'bus_lanes': {'file_path': 'Bus_Lanes_-_Local_Streets_20250721.csv', 
                   'load_method': 'standard', 'clean_method': clean_bus_lanes, 
-                  'shorthand': 'bus', 'date_col': 'lastupdate'},
+                  'shorthand': 'bus', 'date_col': 'lastupdate',
+                  'valid_from_col': None, 'valid_to_col': None}, # `lastupdate` isn't an install date
     'ped_plaza': {'file_path': 'NYC_DOT_Pedestrian_Plazas__Point_Feature__20250721.csv', 
                   'load_method': 'standard', 'clean_method': clean_ped_plaza, 
-                  'shorthand': 'plaza', 'date_col': ''},
+                  'shorthand': 'plaza', 'date_col': '',
+                  'valid_from_col': None, 'valid_to_col': None},
     'traffic_calming': {'file_path': 'VZV_Turn_Traffic_Calming_20250721.csv', 
                         'load_method': 'standard', 'clean_method': clean_traffic_calming, 
-                        'shorthand': 'calm', 'date_col': 'installdate'}
+                        'shorthand': 'calm', 'date_col': 'installdate',
+                        'valid_from_col': 'install_date', 'valid_to_col': None}
 }
 
 # TODO the `[load|clean|summarize]_all_files` functions are extemely duplicative and can be 
@@ -94,60 +101,81 @@ def clean_all_feature_files(feature_gdfs:Dict[str, gpd.GeoDataFrame], feat_metad
     return cleaned_gdfs
 
 def summarize_all_features(location_buffers:gpd.GeoDataFrame, cleaned_gdfs_p:Dict[str, gpd.GeoDataFrame], 
-                       features_to_summarize:List[str], silent:bool=False) -> gpd.GeoDataFrame:
+                       features_to_summarize:List[str], silent:bool=False,
+                       buffer_widths:Optional[List[float]]=None) -> gpd.GeoDataFrame:
+    """Add `n_{shorthand}` counts (or `n_{shorthand}_{width}` for several `buffer_widths`) to `location_buffers`.
+    All feature types are counted in one batched spatial query (see `count_features_batched`). If that
+    fails, layers are counted one at a time and a layer that fails gets NaN counts."""
     summarized_gdf = location_buffers
 
     if not silent:
         print('\nSummarizing Feature Files..')
 
+    layers = {}
     for feat in features_to_summarize:
         if feat not in FEATURE_METADATA.keys():
             raise Exception(f"Feature '{feat}' not found in FEATURE_METADATA")
-        
-        # Load metadata
-        metadata = FEATURE_METADATA[feat]
-        
-        try:
-            counts = count_features_by_location(location_buffers, cleaned_gdfs_p[feat], feature_shorthand = metadata['shorthand'])
-            if not silent:
-                print(f"\t{feat}: Success!")
-        except Exception as e:
-            counts = np.nan
-            print(f'\t{feat}: {e}')
-            
-        summarized_gdf[f"n_{metadata['shorthand']}"] = counts
+        if feat not in cleaned_gdfs_p:
+            print(f'\t{feat}: not loaded')
+            continue
+        layers[FEATURE_METADATA[feat]['shorthand']] = cleaned_gdfs_p[feat]
+
+    try:
+        counts = count_features_batched(location_buffers, layers, buffer_widths=buffer_widths)
+        failed = {}
+    except Exception as e:
+        # Isolate the broken layer(s): count one at a time, NaN for the ones that fail
+        print(f'\tBatched count failed ({e}); counting layers separately')
+        counts, failed = [], {}
+        for shorthand, layer in layers.items():
+            try:
+                counts.append(count_features_batched(location_buffers, {shorthand: layer}, buffer_widths=buffer_widths))
+            except Exception as layer_e:
+                failed[shorthand] = layer_e
+                cols = [f'n_{shorthand}'] if buffer_widths is None else [f'n_{shorthand}_{w}' for w in buffer_widths]
+                counts.append(pd.DataFrame(np.nan, index=location_buffers.index, columns=cols))
+        counts = pd.concat(counts, axis=1)
+
+    for col in counts.columns:
+        summarized_gdf[col] = counts[col]
+
+    for feat in features_to_summarize:
+        shorthand = FEATURE_METADATA[feat]['shorthand']
+        if shorthand in failed:
+            print(f'\t{feat}: {failed[shorthand]}')
+        elif shorthand in layers and not silent:
+            print(f"\t{feat}: Success!")
 
     return summarized_gdf 
 
-def count_features_for_locations(locations_gdf:gpd.GeoDataFrame, buffer_width:int=100, silent:bool=False, outfile:Optional[Path|str]=None):
+def count_features_for_locations(locations_gdf:gpd.GeoDataFrame, buffer_width:int=100, silent:bool=False, outfile:Optional[Path|str]=None,
+                                 buffer_widths:Optional[List[float]]=None):
     """Count the feautres of given type within a certain buffer-zone of given locations
 
     Args:
         universe (str): A set of locations (usually intersections) as defined by streetTransformer
         buffer_width (int, optional): _description_. Defaults to 100.
+        buffer_widths (List[float], optional): count within several widths at once (`n_{shorthand}_{width}`). Defaults to None.
         silent (bool, optional): _description_. Defaults to False.
         outfile (Optional[Path | str], optional): _description_. Defaults to None.
 
     Returns:
         _type_: _description_
     """
-    # Load and clean features
-    loaded_feature_gdfs = load_all_feature_files(FEATURE_METADATA, OPENNYC_PATH, silent=silent)
-    cleaned_feature_gdfs = clean_all_feature_files(loaded_feature_gdfs, FEATURE_METADATA, silent=silent)
+    # Load and clean features (cached as GeoParquet, loaded concurrently)
+    cleaned_feature_gdfs = load_and_clean_all_cached(FEATURE_METADATA, OPENNYC_PATH, FEATURE_CACHE_PATH, silent=silent)
     
     # Project features 
-    cleaned_feature_gdfs = {k: v.set_crs('4326') for k, v in cleaned_feature_gdfs.items()}
     cleaned_feature_gdfs_p = {k: v.to_crs('2263') for k, v in cleaned_feature_gdfs.items()}
 
-    return cleaned_feature_gdfs_p
-    
     # Create buffers with width `buffer_width`
     location_buffers = buffer_locations(locations_gdf, buffer_width=buffer_width)
 
     # summarize
     summarized_gdf = summarize_all_features(
         location_buffers, cleaned_feature_gdfs_p, 
-        features_to_summarize=['bike_rtes','bus_lanes','ped_plaza','traffic_calming']
+        features_to_summarize=['bike_rtes','bus_lanes','ped_plaza','traffic_calming'],
+        buffer_widths=buffer_widths
     )
 
     # If outfile:
@@ -157,34 +185,49 @@ def count_features_for_locations(locations_gdf:gpd.GeoDataFrame, buffer_width:in
     return summarized_gdf
 
 # Load and Clean
-def load_and_clean_feature_data(feature_metadata:Dict=FEATURE_METADATA, root_path:Path=OPENNYC_PATH, silent:bool=False, proj_crs:str='2263'):
-    # Load and clean features
-    loaded_feature_gdfs = load_all_feature_files(feature_metadata, root_path, silent=silent)
-    cleaned_feature_gdfs = clean_all_feature_files(loaded_feature_gdfs, FEATURE_METADATA, silent=silent)
+def load_and_clean_feature_data(feature_metadata:Dict=FEATURE_METADATA, root_path:Path=OPENNYC_PATH, silent:bool=False, proj_crs:str='2263',
+                                cache_dir:Path=FEATURE_CACHE_PATH):
+    # Load and clean features (cached as GeoParquet, loaded concurrently)
+    cleaned_feature_gdfs = load_and_clean_all_cached(feature_metadata, root_path, cache_dir, silent=silent)
     
     # Project features 
-    cleaned_feature_gdfs = {k: v.set_crs('4326') for k, v in cleaned_feature_gdfs.items()}
     cleaned_feature_gdfs_p = {k: v.to_crs(proj_crs) for k, v in cleaned_feature_gdfs.items()}
 
     return cleaned_feature_gdfs_p
 
+# Validity intervals: each feature row is active strictly after valid_from and before valid_to; NaT = unbounded
+def add_validity_interval(feat_data:gpd.GeoDataFrame, featuretype:str) -> gpd.GeoDataFrame:
+    metadata = FEATURE_METADATA[featuretype]
+    ret_gdf = feat_data.copy()
+    from_col, to_col = metadata.get('valid_from_col'), metadata.get('valid_to_col')
+
+    ret_gdf['valid_from'] = pd.to_datetime(ret_gdf[from_col], errors='coerce') if from_col else pd.NaT
+    if from_col:
+        # A missing install date means we can't say when it was active: never, rather than always
+        ret_gdf['valid_from'] = ret_gdf['valid_from'].fillna(pd.Timestamp.max)
+    ret_gdf['valid_to'] = pd.to_datetime(ret_gdf[to_col], errors='coerce') if to_col else pd.NaT
+    return ret_gdf
+
+
+def active_mask(valid_from:pd.Series, valid_to:pd.Series, dates) -> np.ndarray:
+    """
+    Boolean (n_rows,) mask for one date, or (n_rows, n_dates) for many, computed in one
+    broadcast over the interval columns. A row installed on `date` itself is not active
+    yet (`valid_from < date`).
+    """
+    dates = pd.to_datetime(pd.Series(np.atleast_1d(dates))).to_numpy('datetime64[ns]')
+    start = valid_from.to_numpy('datetime64[ns]')[:, None]
+    end = valid_to.to_numpy('datetime64[ns]')[:, None]
+    mask = (np.isnat(start) | (start < dates)) & (np.isnat(end) | (dates < end))
+    return mask if mask.shape[1] > 1 else mask[:, 0]
+
+
 def timeshift_feature(feat_data:gpd.GeoDataFrame, featuretype:str, date: datetime) -> Optional[gpd.GeoDataFrame]:
-    if featuretype == 'bike_rtes':
-        date_mask = ((feat_data['installdate'] < date) & (feat_data['removedate'] > date))
-        return feat_data[date_mask]
-    
-    if featuretype == 'traffic_calming':
-        date_mask = (feat_data['install_date'] < date)
-        return feat_data[date_mask]
-    
-    if featuretype == 'bus_lanes':
-        date_mask = (feat_data['lastupdate'] < date) # TODO: fix
-        return feat_data
-    
-    if featuretype == 'ped_plaza':
-        raise Warning('ped_plaza not implemented')
-    
-    return None
+    if featuretype not in FEATURE_METADATA:
+        return None
+    if 'valid_from' not in feat_data.columns:
+        feat_data = add_validity_interval(feat_data, featuretype)
+    return feat_data[active_mask(feat_data['valid_from'], feat_data['valid_to'], date)]
 
 
 def timeshift_feature_data(cleaned_feature_dict:Dict[str, gpd.GeoDataFrame], date:Union[str, datetime, pd.Timestamp], features:Optional[List[str]]=['bike_rtes']):
@@ -282,14 +325,20 @@ if __name__ == '__main__':
 
     features_dict = load_and_clean_feature_data(FEATURE_METADATA, OPENNYC_PATH)
     
-    dicts = {}
-    for year in YEARS:
-        FEATURES = ['traffic_calming']
-        ts_feat_data = timeshift_feature_data(features_dict, f'{year}-01-01', features=FEATURES)
-        for feat in FEATURES:
-            joined = compare_locations_to_features(locations_gdf, ts_feat_data[feat])
-            out_path = UNIVERSES_PATH / args.universe_name / 'features' / str(year) / f'{feat}.parquet'
-            out_path.parent.mkdir(parents=True, exist_ok=True)
-            joined.to_parquet(out_path)
-    
-
+    # One spatial join per feature; the per-year snapshots are just interval masks over it
+    FEATURES = ['traffic_calming']
+    year_dates = [f'{year}-01-01' for year in YEARS]
+    features_root = UNIVERSES_PATH / args.universe_name / 'features'
+    joined_by_feature = {}
+    for feat in FEATURES:
+        joined = compare_locations_to_features(locations_gdf, add_validity_interval(features_dict[feat], feat))
+        joined_by_feature[feat] = joined
+        masks = active_mask(joined['valid_from'], joined['valid_to'], year_dates).reshape(len(joined), len(year_dates))
+        for i, year in tqdm.tqdm(list(enumerate(YEARS)), desc=feat, disable=args.silent):
+            # features/feature={feat}/year={year}/, sorted by location_id for pushdown reads
+            write_feature_partition(joined[masks[:, i]], features_root, year, feat)
+
+    # The same joins as validity intervals, for point-in-time / change queries (TemporalFeatureStore)
+    feature_attr_cols = sorted({c for feat in FEATURES for c in features_dict[feat].columns if c != 'geometry'})
+    intervals = build_intervals_table(joined_by_feature, keep_cols=feature_attr_cols)
+    intervals.to_parquet(features_root / INTERVALS_FILENAME, index=False)
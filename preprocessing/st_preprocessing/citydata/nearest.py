@@ -0,0 +1,106 @@
+"""
+Nearest-feature engine: exact distances from locations to the features around them.
+
+`NearestFeatureIndex` builds one STRtree over a projected layer (capital projects,
+bike routes, ...) and answers, for many locations at once:
+
+    pairs = index.within(location_points_p, radius=500)   # every feature within 500 ft
+    pairs = index.knn(location_points_p, k=5)              # the 5 nearest features
+
+Both return a long table (one row per location/feature pair, sorted by location
+then distance) with the exact geometry distance. Query once at the largest
+radius you care about; any smaller radius is then `pairs[pairs['distance'] <= r]`
+(or `counts_within`) with no further spatial work.
+"""
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+
+class NearestFeatureIndex:
+    """
+    Usage:
+        index = NearestFeatureIndex(projects_gdf_p)
+        pairs = index.within(locations_p.geometry, radius=200, location_ids=locations_p['location_id'])
+        counts = counts_within(pairs, [50, 100, 200])
+    """
+    def __init__(self, features_p: gpd.GeoDataFrame):
+        self.features = features_p
+        self.geoms = np.asarray(features_p.geometry.values)
+        self.tree = shapely.STRtree(self.geoms)
+
+    def __len__(self) -> int:
+        return len(self.geoms)
+
+    def _pairs(self, points: np.ndarray, loc_idx: np.ndarray, feat_idx: np.ndarray,
+               location_ids: Optional[Sequence]) -> pd.DataFrame:
+        dists = shapely.distance(points[loc_idx], self.geoms[feat_idx])
+        order = np.lexsort((dists, loc_idx))
+        loc_idx, feat_idx, dists = loc_idx[order], feat_idx[order], dists[order]
+
+        ids = np.arange(len(points)) if location_ids is None else np.asarray(location_ids)
+        pairs = pd.DataFrame({
+            'location_id': ids[loc_idx],
+            'feature_index': self.features.index.to_numpy()[feat_idx],
+            'feature_pos': feat_idx, # row position in `features`, for .iloc
+            'distance': dists,
+        })
+        pairs['rank'] = pairs.groupby('location_id', sort=False).cumcount()
+        return pairs
+
+    def within(self, points, radius: float, location_ids: Optional[Sequence] = None) -> pd.DataFrame:
+        """Every (location, feature) pair closer than `radius`, with its exact distance."""
+        points = np.asarray(getattr(points, 'values', points))
+        loc_idx, feat_idx = self.tree.query(points, predicate='dwithin', distance=radius)
+        return self._pairs(points, loc_idx, feat_idx, location_ids)
+
+    def knn(self, points, k: int = 1, max_distance: Optional[float] = None,
+            location_ids: Optional[Sequence] = None, start_radius: float = 100.0) -> pd.DataFrame:
+        """
+        The `k` nearest features per location (fewer if `max_distance` cuts them off).
+        The search radius starts at `start_radius` and doubles only for the
+        locations that do not have `k` hits yet.
+        """
+        points = np.asarray(getattr(points, 'values', points))
+        if k == 1:
+            loc_idx, feat_idx = self.tree.query_nearest(points, max_distance=max_distance, all_matches=False)
+            return self._pairs(points, loc_idx, feat_idx, location_ids)
+
+        n_features = len(self.geoms)
+        pending = np.arange(len(points))
+        radius = start_radius if max_distance is None else min(start_radius, max_distance)
+        found_loc, found_feat = [], []
+        while len(pending) and n_features:
+            loc_idx, feat_idx = self.tree.query(points[pending], predicate='dwithin', distance=radius)
+            counts = np.bincount(loc_idx, minlength=len(pending))
+            done = (counts >= min(k, n_features)) | (max_distance is not None and radius >= max_distance)
+            keep = done[loc_idx]
+            found_loc.append(pending[loc_idx[keep]])
+            found_feat.append(feat_idx[keep])
+            pending = pending[~done]
+            radius = radius * 2 if max_distance is None else min(radius * 2, max_distance)
+
+        loc_idx = np.concatenate(found_loc) if found_loc else np.empty(0, dtype=np.int64)
+        feat_idx = np.concatenate(found_feat) if found_feat else np.empty(0, dtype=np.int64)
+        pairs = self._pairs(points, loc_idx, feat_idx, location_ids)
+        return pairs[pairs['rank'] < k].reset_index(drop=True)
+
+
+def counts_within(pairs: pd.DataFrame, radii: Sequence[float]) -> pd.DataFrame:
+    """Features per location within each radius (`n_{radius}` columns), from a `within`/`knn` table."""
+    out = {f'n_{r}': pairs[pairs['distance'] <= r].groupby('location_id').size() for r in radii}
+    return pd.DataFrame(out).fillna(0).astype(int)
+
+
+def nearest_by_layer(points, layers_p: Dict[str, gpd.GeoDataFrame], k: int = 1,
+                     max_distance: Optional[float] = None, location_ids: Optional[Sequence] = None) -> pd.DataFrame:
+    """`knn` against several layers (e.g. cleaned feature layers), stacked with a `layer` column."""
+    frames = []
+    for name, layer in layers_p.items():
+        pairs = NearestFeatureIndex(layer).knn(points, k=k, max_distance=max_distance, location_ids=location_ids)
+        pairs.insert(1, 'layer', name)
+        frames.append(pairs)
+    return pd.concat(frames, ignore_index=True)
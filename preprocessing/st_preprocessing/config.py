@@ -9,6 +9,7 @@ DATA_PATH = Path(str(os.getenv('DATA_PATH')))
 OPENNYC_PATH = DATA_PATH / 'raw' / 'citydata' / 'openNYC'
 DOCUMENTS_PATH = DATA_PATH / 'raw' / 'documents'
 UNIVERSES_PATH = DATA_PATH / 'runtime' / 'universes'
+FEATURE_CACHE_PATH = DATA_PATH / 'runtime' / 'cache' / 'citydata' # cleaned feature layers (GeoParquet)
 
 # Env Variables
 YEARS = list(range(2006, 2025, 2))
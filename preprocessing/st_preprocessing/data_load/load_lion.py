@@ -1,13 +1,16 @@
 # TODO: see load_universe. This should be factored into a singular function that can load a universe from a few different source types
 # TODO: also clean up the errors to use the validator module?
 import os
+import hashlib
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 import osmnx as ox
 import argparse
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from shapely.geometry import Polygon
 
 from dotenv import load_dotenv
@@ -16,10 +19,47 @@ load_dotenv()
 DATA_PATH = Path(str(os.getenv('DATA_PATH')))
 
 LION_PATH = 'raw/locations/lion/lion.gdb'
+LION_CACHE_PATH = DATA_PATH / 'runtime' / 'cache' / 'lion' # GeoParquet copies of the .gdb layers
 
 LION_LAYERS = {'nodes': 'node', 'node_names': 'node_stname', 'altnames': 'altnames','master': 'lion'}
 
-def _load_lion_baselayers(root_path, lion_path, layers:Dict[str, str]|str='all') -> Dict[str, gpd.GeoDataFrame]:
+# Column projection per layer (None = all columns); `node` keeps everything since its columns end up in the locations
+LION_LAYER_COLUMNS = {'node': None, 'node_stname': ['NodeId', 'StreetName']}
+
+def _gdb_fingerprint(gdb_path:Path) -> str:
+    """Changes whenever any file in the .gdb directory is added, removed or rewritten."""
+    h = hashlib.sha256()
+    for f in sorted(Path(gdb_path).rglob('*')):
+        if f.is_file():
+            stat = f.stat()
+            h.update(f'{f.relative_to(gdb_path)}|{stat.st_size}|{stat.st_mtime_ns}'.encode())
+    return h.hexdigest()[:16]
+
+def load_lion_layer_cached(gdb_path:Path, layer:str, columns:Optional[List[str]]=None, cache_dir:Path=LION_CACHE_PATH) -> gpd.GeoDataFrame|pd.DataFrame:
+    """
+    One LION layer, read from a GeoParquet copy (`{cache_dir}/{layer}-{fingerprint}.parquet`).
+    The FileGDB is only read when the copy is missing or the .gdb has changed;
+    `columns` are projected at read time.
+    """
+    cache_path = Path(cache_dir) / f'{layer}-{_gdb_fingerprint(gdb_path)}.parquet'
+    if not cache_path.exists():
+        layer_gdf = gpd.read_file(gdb_path, layer=layer)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix('.tmp')
+        layer_gdf.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, cache_path)
+        for stale in Path(cache_dir).glob(f'{layer}-*.parquet'): # copies of an older .gdb
+            if stale != cache_path:
+                stale.unlink()
+
+    is_spatial = b'geo' in (pq.read_schema(cache_path).metadata or {}) # attribute-only layers (e.g. node_stname) are plain tables
+    if not is_spatial:
+        return pd.read_parquet(cache_path, columns=columns)
+    if columns is not None and 'geometry' not in columns:
+        columns = list(columns) + ['geometry']
+    return gpd.read_parquet(cache_path, columns=columns)
+
+def _load_lion_baselayers(root_path, lion_path, layers:Dict[str, str]|str='all', use_cache:bool=True) -> Dict[str, gpd.GeoDataFrame]:
     # TODO: call (and write) helper function that auto-converts a string to a path
     if layers == 'all':
         layers = LION_LAYERS
@@ -29,7 +69,10 @@ def _load_lion_baselayers(root_path, lion_path, layers:Dict[str, str]|str='all')
     layers_dict = {}
     for lyr_name, lyr_path in layers.items(): # layers is a dict
         try:
-            layers_dict[lyr_name] = gpd.read_file(root_path / LION_PATH, layer=lyr_path)
+            if use_cache:
+                layers_dict[lyr_name] = load_lion_layer_cached(root_path / lion_path, lyr_path, LION_LAYER_COLUMNS.get(lyr_path))
+            else:
+                layers_dict[lyr_name] = gpd.read_file(root_path / lion_path, layer=lyr_path)
         except Exception as e:
             print(Exception)
             raise ValueError(f'{lyr_path} not found! Only {", ".join(list(LION_LAYERS.values()))} exist as layers. {e}') # TODO: auto-generate this.
@@ -72,28 +115,57 @@ def clip_gdf_by_boundary(locations_gdf:gpd.GeoDataFrame, universe_boundary:str|P
 
     return locations_clipped
 
+# Street names, vectorized
+def clean_streetnames(street_names:pd.Series) -> pd.Series:
+    """Vectorized `_clean_streetnames`: stripped names, NA for boundaries, rail lines and shorelines."""
+    names = street_names.astype('string[pyarrow]')
+    invalid = (
+        names.str.endswith(' BOUNDARY')
+        | names.str.contains(' RAIL ', regex=False)
+        | names.str.contains('SHORELINE', regex=False)
+    ).fillna(True)
+    return names.str.strip().mask(invalid)
+
+def street_edges(node_names_gdf:pd.DataFrame, node_ids:Optional[pd.Series]=None) -> pd.DataFrame:
+    """
+    Flat (NODEID, street) table of cleaned street names, in node-name order.
+    Only `node_ids` are kept if given. This is the adjacency a street index is built from.
+    """
+    edges = pd.DataFrame({
+        'NODEID': node_names_gdf['NodeId'].to_numpy(),
+        'street': clean_streetnames(node_names_gdf['StreetName']).to_numpy(),
+    })
+    keep = edges['street'].notna()
+    if node_ids is not None:
+        keep &= edges['NODEID'].isin(node_ids)
+    return edges[keep].reset_index(drop=True)
+
+def streets_list_column(edges:pd.DataFrame) -> pd.Series:
+    """Streets per NODEID as one Arrow list<string> column (one offsets buffer, no per-node Python lists)."""
+    edges = edges.sort_values('NODEID', kind='stable')
+    node_ids, starts = np.unique(edges['NODEID'].to_numpy(), return_index=True)
+    offsets = pa.array(np.append(starts, len(edges)).astype(np.int32))
+    lists = pa.ListArray.from_arrays(offsets, pa.array(edges['street'].to_numpy(), type=pa.string()))
+    return pd.Series(lists, index=node_ids, name='StreetNames', dtype=pd.ArrowDtype(lists.type))
+
 # Load_lion_universe
-def load_lion_universe(nodes_gdf:gpd.GeoDataFrame, node_names_gdf:gpd.GeoDataFrame, universe:str='nyc', outfile:Optional[Path]=None) -> gpd.GeoDataFrame:
-    # 1) Merge the nodes and street names
-    node_streetnames = nodes_gdf.merge(
-            node_names_gdf,
-            how='left',
-            left_on = 'NODEID', right_on = 'NodeId',
-            #indicator=True
-        ).drop(['NodeId', 'VIntersect'], axis=1)
-
-    # 2) Clean the street names # TODO: Allow for different methods of cleaning
-    node_streetnames['StreetName_cleaned'] = node_streetnames['StreetName'].apply(_clean_streetnames)
-
-    # 3) Now remove the null street values (those that were removed by the cleaning process)
-    node_streetnames_noNull = node_streetnames[node_streetnames['StreetName_cleaned'].notna()]
-    nodes_with_streetnames = nodes_gdf.merge(
-        node_streetnames_noNull
-            .groupby('NODEID')['StreetName_cleaned']
-            .agg(list),
-        left_on = 'NODEID', right_index=True,
-        how = 'inner'
-    ).rename({'StreetName_cleaned': 'StreetNames'}, axis=1).drop(['VIntersect', 'GLOBALID'], axis=1)
+def load_lion_universe(nodes_gdf:gpd.GeoDataFrame, node_names_gdf:gpd.GeoDataFrame, universe:str='nyc', outfile:Optional[Path]=None,
+                       arrow_lists:bool=False) -> gpd.GeoDataFrame:
+    """`arrow_lists` keeps StreetNames as an Arrow list<string> column instead of Python lists
+    (note: a pandas ArrowDtype list column doesn't round-trip through every pandas/pyarrow pair's parquet metadata)."""
+    # 1-3) Clean the street names into a flat (NODEID, street) table, dropping the removed ones # TODO: Allow for different methods of cleaning
+    edges = street_edges(node_names_gdf, nodes_gdf['NODEID'])
+
+    # Then one list<string> per node; nodes without a valid street are dropped
+    streets = streets_list_column(edges)
+    nodes_with_streetnames = nodes_gdf.drop(['VIntersect', 'GLOBALID'], axis=1)
+    nodes_with_streetnames = nodes_with_streetnames[nodes_with_streetnames['NODEID'].isin(streets.index)].copy()
+    streets = streets.reindex(nodes_with_streetnames['NODEID'])
+    if arrow_lists:
+        nodes_with_streetnames['StreetNames'] = streets.to_numpy()
+        nodes_with_streetnames['StreetNames'] = nodes_with_streetnames['StreetNames'].astype(streets.dtype)
+    else: # plain lists, built from the Arrow column in one pass
+        nodes_with_streetnames['StreetNames'] = pd.Series(pa.array(streets).to_pylist(), index=nodes_with_streetnames.index, dtype=object)
 
     # 4) Now filter down to the specific boundary -- TODO: Skipping
     # locations_clipped = clip_gdf_by_boundary(nodes_with_streetnames, universe)
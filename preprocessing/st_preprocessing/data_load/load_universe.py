@@ -1,17 +1,405 @@
-# TODO: define load_universe 9?)
-# This module is the beginning of the process. 
-# It defines a `load_universe` function which takes in:
-    # `universe_name`
-    # `source` (LION, OSM, TIGER, etc)
-    # `boundaries` (either a boundary file or OSM place geocode, etc).
-    # File locations (somehow)
-    # `cache`: If true, doesn't re-run the whole transformation
-
-# It checks if the `universe_name` exists in src/streetTransformer/data/universes:
-    # If not it creates one, and processes the raw files from the `source` and puts them there
-    # If it does, it updates them from the location
-    #
-
-# Questions
-# - Should this be part of streetTransformer? I don't think it needs to be? But maybe?
-# - Should this be a class of some sort? a streetTransformer.universe? Maybe! This is getting out of hand
\ No newline at end of file
+"""
+Incremental universe builder.
+
+A universe records what has been built for each location in a manifest
+(`{universe}/manifest.parquet`): one row per (location_id, stage, key), e.g.
+('imagery', '2016'), with
+    - `input_hash`: hash of the location (geometry + crossstreets) and the stage params
+    - `path`: the artifact, relative to the universe
+    - `content_hash` / `size`: what was written
+
+Building a universe diffs the desired locations against the manifest and only runs
+the (location, stage, key) work that is missing or stale. Artifacts that another
+universe already built with the same inputs are adopted (hardlinked) instead of
+recomputed, so merging or extending universes (e.g. `control3k` + `caprecon_plus_control`
+-> `caprecon_control5k`) only does the new work.
+
+Universes without a manifest are bootstrapped from what they already hold: PNGs under
+`imagery/` and images packed into their `imagery_store/` (recorded under the canonical
+`imagery/{year}/{location_id}.png` path). Source universes are only read; their
+bootstrapped manifests are never written back.
+
+Usage:
+    stages = [imagery_stage(YEARS, zoom=20, radius=1)]
+    build_universe_incremental(UNIVERSES_PATH / 'caprecon_control5k', locations_gdf, stages,
+                               sources=[UNIVERSES_PATH / 'control3k', UNIVERSES_PATH / 'caprecon_plus_control'])
+"""
+import os
+import json
+import shutil
+import hashlib
+import argparse
+from pathlib import Path
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from streettransformer.locations.universe import Universe
+from streettransformer.modalities.imagery.store import ImageryStore
+
+MANIFEST_FILENAME = 'manifest.parquet'
+LOCATIONS_RELPATH = Path('locations') / 'locations_raw.parquet'
+MANIFEST_COLUMNS = ['location_id', 'stage', 'key', 'input_hash', 'path', 'content_hash', 'size', 'updated_at']
+
+# -----------------------------------------------------------------------------
+# Hashing
+# -----------------------------------------------------------------------------
+def file_hash(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def location_hashes(locations_gdf: gpd.GeoDataFrame) -> pd.Series:
+    """Hash of each location's geometry (EPSG:4326 WKB) and crossstreets, indexed by location_id."""
+    wkb = locations_gdf.to_crs('EPSG:4326').geometry.to_wkb()
+    def _streets(x) -> str: # lists come back from parquet as arrays
+        return ' | '.join(map(str, x)) if isinstance(x, (list, tuple, np.ndarray)) else str(x)
+    streets = locations_gdf['crossstreets'].map(_streets) if 'crossstreets' in locations_gdf else pd.Series('', index=locations_gdf.index)
+    hashes = [hashlib.sha1(g + s.encode()).hexdigest() for g, s in zip(wkb, streets)]
+    return pd.Series(hashes, index=locations_gdf['location_id'].astype('int64').to_numpy(), name='location_hash')
+
+
+def input_hashes(loc_hashes: pd.Series, stage: 'Stage', key: str) -> pd.Series:
+    """Per-location input hash for one (stage, key): the location plus the stage params."""
+    params = json.dumps({'stage': stage.name, 'key': key, **stage.params}, sort_keys=True, default=str)
+    return loc_hashes.map(lambda h: hashlib.sha1(f'{h}|{params}'.encode()).hexdigest())
+
+
+# -----------------------------------------------------------------------------
+# Manifest
+# -----------------------------------------------------------------------------
+class UniverseManifest:
+    """
+    Usage:
+        manifest = UniverseManifest(universe_path)
+        manifest.lookup('imagery', '2016')       # rows for that stage/key, indexed by location_id
+        manifest.record('imagery', '2016', {123: path}, input_hashes)
+        manifest.save()
+    """
+    def __init__(self, universe_path: Path):
+        self.universe_path = Path(universe_path)
+        self.path = self.universe_path / MANIFEST_FILENAME
+        if self.path.exists():
+            self.table = pd.read_parquet(self.path)
+        else:
+            self.table = pd.DataFrame({c: pd.Series(dtype='int64' if c in ('location_id', 'size') else 'object') for c in MANIFEST_COLUMNS})
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __repr__(self):
+        stages = self.table.groupby(['stage', 'key']).size().to_dict() if len(self.table) else {}
+        return f"UniverseManifest({self.universe_path.name}, {len(self)} artifacts, {stages})"
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    @cached_property
+    def imagery_store(self) -> Optional[ImageryStore]:
+        return ImageryStore.for_universe(self.universe_path)
+
+    def in_store(self, rel_path: Path | str) -> bool:
+        """Whether `imagery/{year}/{location_id}.png` is packed into this universe's imagery store."""
+        rel_path = Path(rel_path)
+        if self.imagery_store is None or rel_path.parts[:1] != ('imagery',) or not rel_path.stem.isdigit():
+            return False
+        return (rel_path.parent.name, int(rel_path.stem)) in self.imagery_store
+
+    def save(self) -> None:
+        self.universe_path.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        self.table.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
+
+    def lookup(self, stage: str, key: str) -> pd.DataFrame:
+        rows = self.table[(self.table['stage'] == stage) & (self.table['key'] == key)]
+        return rows.set_index('location_id')
+
+    def record(self, stage: str, key: str, artifacts: Dict[int, Path], in_hashes: pd.Series,
+               content_hashes: Optional[Dict[int, str]] = None) -> None:
+        """Upsert artifacts (absolute or universe-relative paths) for one stage/key."""
+        if not artifacts:
+            return
+        rows = []
+        for location_id, path in artifacts.items():
+            path = Path(path)
+            abs_path = path if path.is_absolute() else self.universe_path / path
+            rows.append({
+                'location_id': int(location_id),
+                'stage': stage,
+                'key': key,
+                'input_hash': in_hashes[location_id],
+                'path': str(abs_path.relative_to(self.universe_path)),
+                'content_hash': (content_hashes or {}).get(location_id) or (file_hash(abs_path) if abs_path.is_file() else ''),
+                'size': abs_path.stat().st_size if abs_path.is_file() else 0,
+                'updated_at': pd.Timestamp.now(),
+            })
+        new = pd.DataFrame(rows)
+        keep = ~(
+            (self.table['stage'] == stage) & (self.table['key'] == key)
+            & self.table['location_id'].isin(new['location_id'])
+        )
+        self.table = pd.concat([self.table[keep], new], ignore_index=True) if keep.any() else new
+
+    def scan_imagery(self, locations_gdf: gpd.GeoDataFrame, stage: 'Stage') -> int:
+        """Bootstrap manifest rows from existing `imagery/{year}/{location_id}.png` files and imagery store entries."""
+        loc_hashes = location_hashes(locations_gdf)
+        n = 0
+        for key in stage.keys:
+            year_dir = self.universe_path / 'imagery' / key
+            ids = {int(p.stem): p for p in year_dir.glob('*.png') if p.stem.isdigit()} if year_dir.is_dir() else {}
+            if self.imagery_store is not None:
+                for l_id in self.imagery_store.index(key):
+                    ids.setdefault(l_id, year_dir / f'{l_id}.png') # packed: no file, size 0
+            ids = {l_id: p for l_id, p in ids.items() if l_id in loc_hashes.index}
+            self.record(stage.name, key, ids, input_hashes(loc_hashes, stage, key))
+            n += len(ids)
+        return n
+
+
+# -----------------------------------------------------------------------------
+# Stages
+# -----------------------------------------------------------------------------
+@dataclass
+class Stage:
+    """
+    One unit of per-location work. `run(locations_subset, key, universe_path)` builds the
+    artifacts for those locations and returns {location_id: artifact path}. Everything in
+    `params` is part of the input hash, so changing it invalidates the stage.
+    """
+    name: str
+    keys: List[str]
+    run: Callable[[gpd.GeoDataFrame, str, Path], Dict[int, Path]]
+    params: Dict = field(default_factory=dict)
+    adoptable: bool = True # artifacts are standalone files that can be linked from another universe
+
+
+def imagery_stage(years: Sequence[int | str], zoom: int = 20, radius: int = 1, tile_cache=None,
+                  quiet: bool = False) -> Stage:
+    """Stitched imagery: `imagery/{year}/{location_id}.png`."""
+    from ..imagery.download_imagery2 import download_and_stitch_gdf, reproject_to_wgs84
+
+    def run(locations_gdf: gpd.GeoDataFrame, key: str, universe_path: Path) -> Dict[int, Path]:
+        save_dir = universe_path / 'imagery' / key
+        save_dir.mkdir(parents=True, exist_ok=True)
+        download_and_stitch_gdf(
+            reproject_to_wgs84(locations_gdf), year=int(key), zoom=zoom, save_dir=save_dir,
+            radius=radius, cache=tile_cache, skip_existing=False, quiet=quiet
+        )
+        paths = {int(l_id): save_dir / f'{l_id}.png' for l_id in locations_gdf['location_id']}
+        return {l_id: p for l_id, p in paths.items() if p.exists()}
+
+    return Stage('imagery', [str(y) for y in years], run, params={'zoom': zoom, 'radius': radius})
+
+
+def features_stage(features: Sequence[str], years: Sequence[int | str]) -> Stage:
+    """
+    Citydata features near each location, merged into the universe's `features/feature=/year=`
+    partitions: the new locations' rows replace theirs, the rest are kept.
+    """
+    from ..citydata.features_pipeline import (
+        FEATURE_METADATA, OPENNYC_PATH, load_and_clean_feature_data, add_validity_interval,
+        compare_locations_to_features, active_mask
+    )
+    from streettransformer.modalities.citydata.feature_store import partition_path, write_feature_partition
+
+    def run(locations_gdf: gpd.GeoDataFrame, key: str, universe_path: Path) -> Dict[int, Path]:
+        features_dict = load_and_clean_feature_data({f: FEATURE_METADATA[f] for f in features}, OPENNYC_PATH, silent=True)
+        features_root = universe_path / 'features'
+        locations_p = locations_gdf.to_crs('2263')
+        ids = locations_p['location_id'].to_numpy()
+        year_dates = [f'{y}-01-01' for y in years]
+        for feat in features:
+            joined = compare_locations_to_features(locations_p.copy(), add_validity_interval(features_dict[feat], feat))
+            masks = active_mask(joined['valid_from'], joined['valid_to'], year_dates).reshape(len(joined), len(year_dates))
+            for i, year in enumerate(years):
+                new_rows = joined[masks[:, i]]
+                existing_path = partition_path(features_root, year, feat)
+                if existing_path.exists():
+                    existing = gpd.read_parquet(existing_path)
+                    new_rows = pd.concat([existing[~existing['location_id'].isin(ids)], new_rows], ignore_index=True)
+                write_feature_partition(new_rows, features_root, year, feat)
+        return {int(l_id): features_root for l_id in ids}
+
+    return Stage('features', ['all'], run, params={'features': sorted(features), 'years': [str(y) for y in years]},
+                 adoptable=False)
+
+
+# -----------------------------------------------------------------------------
+# Diff + build
+# -----------------------------------------------------------------------------
+def stale_locations(manifest: UniverseManifest, stage: Stage, key: str, in_hashes: pd.Series,
+                    verify: bool = False) -> np.ndarray:
+    """
+    location_ids whose artifact is missing, built from other inputs, or changed on disk.
+    An image packed into the universe's imagery store counts as present.
+    """
+    existing = manifest.lookup(stage.name, key).reindex(in_hashes.index)
+    ok = existing['input_hash'].to_numpy() == in_hashes.to_numpy()
+    for i in np.flatnonzero(ok):
+        row = existing.iloc[i]
+        path = manifest.universe_path / row['path']
+        if not path.exists():
+            ok[i] = manifest.in_store(row['path'])
+        elif path.is_file() and row['size'] and path.stat().st_size != row['size']:
+            ok[i] = False
+        elif verify and path.is_file() and row['content_hash'] and file_hash(path) != row['content_hash']:
+            ok[i] = False
+    return in_hashes.index.to_numpy()[~ok]
+
+
+def _link_or_copy(src: Path, dest: Path) -> None:
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if dest.exists():
+        dest.unlink()
+    try:
+        os.link(src, dest)
+    except OSError: # cross-device, or no hardlink support
+        shutil.copy2(src, dest)
+
+
+def adopt_artifacts(manifest: UniverseManifest, source: UniverseManifest, stage: Stage, key: str,
+                    in_hashes: pd.Series, location_ids: np.ndarray) -> np.ndarray:
+    """
+    Link artifacts that `source` built from identical inputs; returns the ids still to build.
+    Images packed into the source's imagery store are written out as PNGs, unless this
+    universe's store already holds them (e.g. after `ImageryStore.merge_from`).
+    """
+    available = source.lookup(stage.name, key).reindex(location_ids)
+    match = available['input_hash'].to_numpy() == in_hashes.loc[location_ids].to_numpy()
+
+    adopted, content_hashes = {}, {}
+    for l_id, row in available[match].iterrows():
+        src = source.universe_path / row['path']
+        dest = manifest.universe_path / row['path']
+        if src.is_file():
+            _link_or_copy(src, dest)
+            content_hashes[int(l_id)] = row['content_hash']
+        elif manifest.in_store(row['path']):
+            pass
+        elif source.in_store(row['path']):
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            source.imagery_store.get_image(dest.parent.name, int(l_id)).save(dest)
+        else:
+            continue
+        adopted[int(l_id)] = dest
+    manifest.record(stage.name, key, adopted, in_hashes, content_hashes)
+    return np.setdiff1d(location_ids, list(adopted))
+
+
+def _read_locations(universe_path: Path) -> Optional[gpd.GeoDataFrame]:
+    """A universe's locations, from whichever of `universe.LOCATIONS_FILES` it has (None if none)."""
+    try:
+        return Universe(universe_path.name, universe_path).locations
+    except FileNotFoundError:
+        return None
+
+
+def _bootstrap(manifest: UniverseManifest, locations_gdf: gpd.GeoDataFrame, stages: Sequence[Stage]) -> int:
+    """Record the imagery a universe already has (PNGs and imagery store) in its manifest (not saved)."""
+    return sum(manifest.scan_imagery(locations_gdf, stage) for stage in stages if stage.name == 'imagery')
+
+
+def _open_source(source_path: Path, stages: Sequence[Stage]) -> Optional[UniverseManifest]:
+    """
+    A source universe's manifest, bootstrapped in memory if it has none yet.
+    Sources are only read: nothing is written into them.
+    """
+    source = UniverseManifest(source_path)
+    if source.exists():
+        return source
+    source_locations = _read_locations(source_path)
+    if source_locations is None:
+        return None
+    _bootstrap(source, source_locations, stages)
+    return source
+
+
+def build_universe_incremental(universe_path: Path, locations_gdf: gpd.GeoDataFrame, stages: Sequence[Stage],
+                               sources: Sequence[Path] = (), verify: bool = False, dry_run: bool = False,
+                               silent: bool = False) -> Dict[str, Dict[str, int]]:
+    """
+    Bring `universe_path` up to date for `locations_gdf`: adopt what `sources` already built,
+    then run each stage only for the locations that are missing or stale.
+    Returns {stage: {key: n_locations_built}} (the work that would run, with `dry_run`).
+    """
+    universe_path = Path(universe_path)
+
+    # A universe built before manifests existed: record what it already has, hashed against
+    # the locations it was built for, so unchanged locations are not rebuilt
+    manifest = UniverseManifest(universe_path)
+    if not manifest.exists():
+        built_for = _read_locations(universe_path)
+        _bootstrap(manifest, locations_gdf if built_for is None else built_for, stages)
+
+    locations_path = universe_path / LOCATIONS_RELPATH
+    if not dry_run:
+        locations_path.parent.mkdir(parents=True, exist_ok=True)
+        locations_gdf.to_parquet(locations_path)
+
+    source_manifests = [m for m in (_open_source(Path(s), stages) for s in sources) if m is not None]
+    loc_hashes = location_hashes(locations_gdf)
+    locations_by_id = locations_gdf.set_index(locations_gdf['location_id'].astype('int64').to_numpy())
+
+    summary = {}
+    for stage in stages:
+        summary[stage.name] = {}
+        for key in stage.keys:
+            in_hashes = input_hashes(loc_hashes, stage, key)
+            todo = stale_locations(manifest, stage, key, in_hashes, verify=verify)
+            n_stale = len(todo)
+            if stage.adoptable and not dry_run:
+                for source in source_manifests:
+                    todo = adopt_artifacts(manifest, source, stage, key, in_hashes, todo)
+
+            summary[stage.name][key] = len(todo)
+            if not silent:
+                print(f'[{stage.name}:{key}] {len(in_hashes) - n_stale} up to date, {n_stale - len(todo)} adopted, {len(todo)} to build')
+            if dry_run:
+                continue
+            if len(todo) == 0:
+                manifest.save()
+                continue
+
+            artifacts = stage.run(locations_by_id.loc[todo], key, universe_path)
+            manifest.record(stage.name, key, artifacts, in_hashes)
+            manifest.save() # per key, so an interrupted build resumes where it stopped
+
+    return summary
+
+
+# -----------------------------------------------------------------------------
+# CLI
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    from ..config import UNIVERSES_PATH, YEARS
+
+    parser = argparse.ArgumentParser(description='Build or extend a universe, only processing new or changed locations')
+    parser.add_argument('universe_name', type=str, help="Universe to build, e.g. 'caprecon_control5k'")
+    parser.add_argument('locations', type=Path, help='Locations file (parquet/feather) with location_id, crossstreets, geometry')
+    parser.add_argument('--from', dest='sources', nargs='*', default=[], help='Universes to adopt existing artifacts from')
+    parser.add_argument('--years', nargs='*', type=int, default=YEARS)
+    parser.add_argument('--zoom', type=int, default=20)
+    parser.add_argument('--radius', type=int, default=1)
+    parser.add_argument('--features', nargs='*', default=[], help="Also build citydata features, e.g. 'traffic_calming'")
+    parser.add_argument('--verify', action='store_true', help='Re-hash existing artifacts instead of trusting their size')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be built')
+
+    args = parser.parse_args()
+
+    locations_gdf = gpd.read_feather(args.locations) if args.locations.suffix == '.feather' else gpd.read_parquet(args.locations)
+    stages = [imagery_stage(args.years, zoom=args.zoom, radius=args.radius)]
+    if args.features:
+        stages.append(features_stage(args.features, args.years))
+
+    build_universe_incremental(
+        UNIVERSES_PATH / args.universe_name, locations_gdf, stages,
+        sources=[UNIVERSES_PATH / s for s in args.sources], verify=args.verify, dry_run=args.dry_run
+    )
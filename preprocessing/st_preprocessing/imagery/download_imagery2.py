@@ -1,8 +1,8 @@
 # TODO: Generate a reference dataframe
 
 # TODO: Improve speed:
-# [ ] Can calculate tile locations only once for each location (all years)
-# [ ] Can pull each tile-year only once (rather than multiple times per )
+# [X] Can calculate tile locations only once for each location (all years) -- see tile_plan.TilePlan
+# [X] Can pull each tile-year only once (rather than multiple times per ) -- see tile_plan.fetch_planned_tiles
 # [X] Remove iterrows (!important)n
 
 import io
@@ -11,15 +11,21 @@ import math
 import logging
 from pathlib import Path
 from typing import Tuple, Dict, Optional, List
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
 
+import numpy as np
 import requests
 import mercantile
 from PIL import Image
 import geopandas as gpd
 from shapely.geometry import Point
 
+from .tile_cache import TileCache, TileKey
+from .mosaic import MosaicStitcher, stitch_window, crop_center
+from .tile_plan import TilePlan, plan_tiles, fetch_planned_tiles, MAX_FETCH_WORKERS_DEFAULT
+
 # -----------------------------------------------------------------------------
 # Env variables
 # -----------------------------------------------------------------------------
@@ -28,6 +34,7 @@ TILE_URL_TEMPLATE = (
     "https://tiles.arcgis.com/tiles/yG5s3afENB5iO9fj/arcgis/rest/"
     "services/NYC_Orthos_{year}/MapServer"
 )
+SERVICE_NAME = 'NYC_Orthos' # Namespace for cached tiles
 
 # -----------------------------------------------------------------------------
 # Logger Setup
@@ -60,35 +67,23 @@ def get_center_tile(point: Point, zoom: int) -> Tuple[int, int]: # TODO: necessa
     tile = mercantile.tile(point.x, point.y, zoom)
     return tile.x, tile.y
 
-def _cache_tile_name(zoom: int, x: int, y: int) -> Path: # TODO: add year? Maybe not necessary
-    return f"{x}_{y}_{zoom}.png"
-
-def find_tile_in_cache(cache_path: Path, cache_tile_name: Path) -> Optional[Image.Image]:
-    # Handle cache
-    cache_tile_path = cache_path / cache_tile_name
-    try:
-        cached_tile_img = Image.open(cache_tile_path).convert("RGB")
-        #logger.info(f'{cache_tile_name} found in cache!')
-        return cached_tile_img
-    except:
-        #logger.info(f'{cache_tile_name} NOT found in cache!')
-        return None
-
 def download_tile(
     session: requests.Session,
     base_url: str,
     zoom: int,
     x: int,
     y: int,
+    year: int,
     check_cache: bool=True,
-    cache_path: Path=Path('.tile_cache/')
+    cache: Optional[TileCache]=None,
+    service: str=SERVICE_NAME
 ) -> Optional[Image.Image]:
     """
     Fetch a single tile as a PIL Image, or return None on failure.
     """
-    cache_tile_name = _cache_tile_name(zoom, x, y)
-    cached_tile_img = find_tile_in_cache(cache_path, cache_tile_name)
-    if check_cache:
+    key = TileKey(service, int(year), zoom, x, y)
+    if check_cache and cache is not None:
+        cached_tile_img = cache.get_image(key)
         if cached_tile_img is not None:
             return cached_tile_img
     
@@ -98,7 +93,8 @@ def download_tile(
         response.raise_for_status()
         downloaded_tile_img = Image.open(io.BytesIO(response.content)).convert("RGB")
 
-        downloaded_tile_img.save(cache_path / cache_tile_name) # Save to cache
+        if cache is not None:
+            cache.put(key, response.content, image=downloaded_tile_img) # Save raw bytes to cache
         
         return downloaded_tile_img
     except Exception as e:
@@ -122,6 +118,16 @@ def _generate_offset_grid(radius:int) -> List[Tuple[int, int]]:
     return offsets
 
 
+_TILE_EXECUTOR: Optional[ThreadPoolExecutor] = None
+
+def _get_tile_executor() -> ThreadPoolExecutor:
+    """One bounded pool shared by every `download_tiles` call, instead of a new pool per location."""
+    global _TILE_EXECUTOR
+    if _TILE_EXECUTOR is None:
+        _TILE_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS_DEFAULT, thread_name_prefix='tiles')
+    return _TILE_EXECUTOR
+
+
 def download_tiles(
     session: requests.Session,
     base_url: str,
@@ -129,8 +135,9 @@ def download_tiles(
     center_y: int,
     zoom: int,
     radius: int,
+    year: int,
     check_cache: bool=True,
-    cache_path: Path=Path('.tile_cache/')
+    cache: Optional[TileCache]=None
 ) -> Dict[Tuple[int, int], Optional[Image.Image]]:
     """
     Download a square block of tiles around (center_x, center_y).
@@ -141,13 +148,12 @@ def download_tiles(
     tiles = {}
     x0, y0 = center_x, center_y
 
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    with ThreadPoolExecutor(max_workers=len(offsets)) as executor:
-        futures = {executor.submit(download_tile, session, base_url, zoom, x0+dx, y0+dy, check_cache, cache_path): (dx, dy)
-                   for dx, dy in offsets}
-        for fut in as_completed(futures):
-            dx, dy = futures[fut]
-            tiles[(dx, dy)] = fut.result()
+    executor = _get_tile_executor()
+    futures = {executor.submit(download_tile, session, base_url, zoom, x0+dx, y0+dy, year, check_cache, cache): (dx, dy)
+               for dx, dy in offsets}
+    for fut in as_completed(futures):
+        dx, dy = futures[fut]
+        tiles[(dx, dy)] = fut.result()
     return tiles
 
 
@@ -158,22 +164,15 @@ def stitch_tiles(
     fill_color: Tuple[int, int, int] = (0, 0, 0)
 ) -> Image.Image:
     """
-    Stitch downloaded tiles into a single canvas.
+    Stitch downloaded tiles into a single (2*radius+1)-tile canvas.
     """
     tw, th = tile_size
     canvas_size = ((2 * radius + 1) * tw, (2 * radius + 1) * th)
-    canvas = Image.new("RGB", canvas_size, fill_color)
-
-    for (dx, dy), img in tile_map.items():
-        px = (dx + radius) * tw
-        py = (dy + radius) * th
-        patch = img or Image.new("RGB", (tw, th), fill_color)
-        canvas.paste(patch, (px, py))
-
-    return canvas
+    canvas = stitch_window(tile_map, tile_size, (tw / 2, th / 2), canvas_size, fill_color)
+    return Image.fromarray(canvas)
 
 
-def compute_fractional_pixel(
+def _pixel_in_center_tile(
     point: Point,
     center_x: int,
     center_y: int,
@@ -181,7 +180,7 @@ def compute_fractional_pixel(
     tile_size: Tuple[int, int]
 ) -> Tuple[float, float]:
     """
-    Compute the pixel coordinates of `point` within the stitched canvas.
+    Pixel coordinates of `point` measured from the top-left corner of its center tile.
     """
     west, south, east, north = mercantile.bounds(center_x, center_y, zoom)
     tw, th = tile_size
@@ -189,15 +188,27 @@ def compute_fractional_pixel(
     fx = (point.x - west) / (east - west)
     fy = (north - point.y) / (north - south)
 
-    px_in_tile = fx * tw
-    py_in_tile = fy * th
+    return fx * tw, fy * th
+
+
+def compute_fractional_pixel(
+    point: Point,
+    center_x: int,
+    center_y: int,
+    zoom: int,
+    tile_size: Tuple[int, int]
+) -> Tuple[float, float]:
+    """
+    Compute the pixel coordinates of `point` within the stitched (radius 1) canvas.
+    """
+    tw, th = tile_size
+    px_in_tile, py_in_tile = _pixel_in_center_tile(point, center_x, center_y, zoom, tile_size)
 
     cx = tw + px_in_tile
     cy = th + py_in_tile
     return cx, cy
 
 
-# TODO: Update this so that it then can be cropped back down
 def crop_to_center(
     canvas: Image.Image,
     center_px: float,
@@ -206,12 +217,12 @@ def crop_to_center(
     """
     Crop the stitched canvas so that (center_px, center_py) becomes the image center.
     """
-    w, h = canvas.size
-    left   = center_px - w / 2
-    top    = center_py - h / 2
-    right  = left   + w
-    bottom = top    + h
-    return canvas.crop((left, top, right, bottom))
+    return Image.fromarray(crop_center(np.asarray(canvas), (center_px, center_py)))
+
+
+def _mosaic_size(radius: int, tile_size: Tuple[int, int]) -> Tuple[int, int]:
+    tw, th = tile_size
+    return (2 * radius + 1) * tw, (2 * radius + 1) * th
 
 # -----------------------------------------------------------------------------
 # Main Processing Function
@@ -222,29 +233,85 @@ def process_point(
     point: Point,
     zoom: int,
     radius: int,
+    year: int,
     fill_color: Tuple[int, int, int] = (0, 0, 0),
     check_cache: bool=True,
-    cache_path: Path=Path('.tile_cache/')
+    cache: Optional[TileCache]=None
 ) -> Optional[Image.Image]:
     """
     Download, stitch, and crop a mosaic image centered on `point`.
     """
     x0, y0 = get_center_tile(point, zoom)
-    tile_map = download_tiles(session, base_url, x0, y0, zoom, radius, check_cache, cache_path)
+    tile_map = download_tiles(session, base_url, x0, y0, zoom, radius, year, check_cache, cache)
 
     if not all([x is None for x in tile_map.values()]):
         sample = next(img for img in tile_map.values() if img)
         tile_size = sample.size
 
-        canvas = stitch_tiles(tile_map, tile_size, radius, fill_color)
-
-        cx, cy = compute_fractional_pixel(point, x0, y0, zoom, tile_size)
-        return crop_to_center(canvas, cx, cy)
+        center = _pixel_in_center_tile(point, x0, y0, zoom, tile_size)
+        mosaic = stitch_window(tile_map, tile_size, center, _mosaic_size(radius, tile_size), fill_color)
+        return Image.fromarray(mosaic)
     
     else: 
         return None
 
 
+def mosaic_from_cache(
+    plan: TilePlan,
+    ident,
+    year: int,
+    cache: TileCache,
+    fill_color: Tuple[int, int, int] = (0, 0, 0),
+    service: str=SERVICE_NAME,
+    stitcher: Optional[MosaicStitcher]=None
+) -> Optional[np.ndarray]:
+    """
+    Stitch and crop the mosaic for a planned location from tiles already in `cache`.
+    Pass a shared `stitcher` so tiles shared by neighbouring locations are decoded once.
+    """
+    stitcher = stitcher or MosaicStitcher(load=cache.get)
+    tile_keys = {
+        offset: TileKey(service, int(year), plan.zoom, x, y)
+        for offset, (x, y) in plan.location_tiles(ident).items()
+    }
+
+    tiles = {offset: stitcher.tile(key) for offset, key in tile_keys.items()}
+    missing = [key for offset, key in tile_keys.items() if tiles[offset] is None]
+    if missing:
+        logger.warning(f"[{ident}] {len(missing)}/{len(tile_keys)} planned tiles not in the cache ({year}); "
+                       f"{'no mosaic' if len(missing) == len(tile_keys) else 'filled with ' + str(fill_color)}")
+    sample = next((t for t in tiles.values() if t is not None), None)
+    if sample is None:
+        return None
+    tile_size = (sample.shape[1], sample.shape[0])
+
+    x0, y0 = plan.centers[ident]
+    center = _pixel_in_center_tile(plan.points[ident], x0, y0, plan.zoom, tile_size)
+    return stitcher.stitch(tile_keys, tile_size, center, _mosaic_size(plan.radius, tile_size), fill_color)
+
+
+def is_valid_png(path: Path) -> bool:
+    """
+    Cheap completeness check for an output mosaic: PNG signature up front and an IEND
+    chunk at the end, so files truncated by an interrupted run are re-made.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read(8) != b'\x89PNG\r\n\x1a\n':
+                return False
+            f.seek(-12, os.SEEK_END)
+            return f.read(12)[4:8] == b'IEND'
+    except OSError:
+        return False
+
+
+def save_mosaic(mosaic: np.ndarray, out_path: Path) -> None:
+    """Write a mosaic PNG atomically so a killed run never leaves a half-written file behind."""
+    tmp_path = out_path.with_name(f'.{out_path.stem}.{os.getpid()}.tmp.png')
+    Image.fromarray(mosaic).save(tmp_path)
+    os.replace(tmp_path, out_path)
+
+
 def _format_base_url(url_template:str, year:int) -> str:
     year_string = year if year != 2020 else '-_2020'
     return url_template.format(year=year_string)
@@ -261,40 +328,75 @@ def download_and_stitch_gdf(
     fill_color: Tuple[int, int, int] = (0, 0, 0),
     check_cache: bool = True,
     cache_path: Optional[Path] = None,
+    cache: Optional[TileCache] = None,
+    plan: Optional[TilePlan] = None,
+    max_workers: int = MAX_FETCH_WORKERS_DEFAULT,
+    skip_existing: bool = False,
     track_progress=True,
     quiet = False
 ) -> None:
     """
     Process each point in `gdf` and save a pixel-accurate mosaic.
+
+    Tiles are cached in a `TileCache` keyed by year, so one cache can be shared by
+    every year of a universe. Pass `cache` to share an open instance across calls,
+    otherwise one is opened at `cache_path` (default: `{save_dir}/../.tile_cache`).
+
+    The tiles needed by all of `gdf` are planned up front and each unique tile is
+    fetched once. Pass a `plan` from `tile_plan.plan_tiles` to reuse it across years.
+    With `skip_existing`, locations that already have a valid `{ident}.png` are skipped.
     """
     # Handle the cache
-    if cache_path is None:
-        cache_path = save_dir / '.tile_cache'
-        cache_path.mkdir(parents=True, exist_ok=True)
+    owns_cache = cache is None
+    if cache is None:
+        if cache_path is None:
+            cache_path = save_dir.parent / '.tile_cache'
+        cache = TileCache(cache_path)
 
     save_dir.mkdir(parents=True, exist_ok=True)
-    gdf = reproject_to_wgs84(gdf) # Ensure its in WGS84
-
-    # Create the session and necessary session data
-    session = requests.Session()
-    base_url = _format_base_url(str(service_url_template), year)
-
-    # Just count the rows for progress keeping
-    total_rows = gdf.shape[0]
-
-    for row in tqdm(gdf.itertuples(index=True, name="Row"), total=total_rows, desc=f"Proecessing locations ({year})", disable=(not track_progress)):
-        ident = getattr(row, id_col) if (id_col and id_col in gdf.columns) else row.Index
-        pt = getattr(row, geom_col)
-        if not isinstance(pt, Point):
-            logger.error(f"[{ident}] geometry not Point – skipping")
-            continue
-
-        mosaic = process_point(session, base_url, pt, zoom, radius, fill_color, check_cache, cache_path)
-        out_path = save_dir / f"{ident}.png"
-        if out_path and mosaic:
-            mosaic.save(out_path)
-            if not quiet:
-                logger.info(f"[{ident}] saved → {out_path}")
+
+    # 1) Plan: the unique set of tiles needed by every location (reusable across years)
+    if plan is None:
+        gdf = reproject_to_wgs84(gdf) # Ensure its in WGS84
+        plan = plan_tiles(gdf, zoom, radius, _generate_offset_grid(radius), id_col, geom_col)
+    for ident in plan.skipped:
+        logger.error(f"[{ident}] geometry not Point – skipping")
+    if skip_existing:
+        plan = plan.subset([i for i in plan.centers if not is_valid_png(save_dir / f"{i}.png")])
+    if not quiet:
+        logger.info(f"Tile plan ({year}): {plan.summary()}")
+
+    # 2) Fetch: each missing tile exactly once. The plan's tiles stay pinned until they're
+    #    stitched, so a size-bounded cache can't evict them in between.
+    with cache.pinned(plan.keys([year], SERVICE_NAME)):
+        counts = fetch_planned_tiles(
+            plan, [year], cache,
+            base_url_for_year=lambda y: _format_base_url(str(service_url_template), y),
+            service=SERVICE_NAME,
+            max_workers=max_workers,
+            skip_cached=check_cache,
+            track_progress=track_progress
+        )
+        if not quiet:
+            logger.info(f"Tiles ({year}): {counts['cached']} cached, {counts['fetched']} fetched, {counts['failed']} failed")
+
+        # 3) Stitch: every mosaic from the cache, in tile order so neighbours reuse decoded tiles
+        stitcher = MosaicStitcher(load=cache.get)
+        stitch_order = plan.stitch_order()
+        for ident in tqdm(stitch_order, total=plan.n_locations, desc=f"Stitching locations ({year})", disable=(not track_progress)):
+            mosaic = mosaic_from_cache(plan, ident, year, cache, fill_color, stitcher=stitcher)
+            out_path = save_dir / f"{ident}.png"
+            if out_path and mosaic is not None:
+                save_mosaic(mosaic, out_path)
+                if not quiet:
+                    logger.info(f"[{ident}] saved → {out_path}")
+
+    stats = cache.stats()
+    logger.info(f"Tile cache ({year}): {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%})")
+    if owns_cache:
+        cache.close()
+    else:
+        cache.flush()
 
 # -----------------------------------------------------------------------------
 # Example Usage
@@ -0,0 +1,186 @@
+"""
+Async fetch engine for the ArcGIS tile endpoint.
+
+One `httpx.AsyncClient` (HTTP/2 where the server supports it) is shared by a fixed
+pool of worker coroutines, so the number of in-flight requests is capped globally
+for the whole run instead of per location. Requests are spaced by a per-host token
+bucket, 429/5xx responses are retried with jittered exponential backoff (honouring
+`Retry-After`), and results flow through a bounded queue into a consumer callback
+(e.g. `TileCache.put` or a stitch stage), so a slow consumer throttles fetching
+instead of letting downloaded tiles pile up in memory.
+"""
+import time
+import random
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+@dataclass
+class FetchConfig:
+    max_concurrency: int = 32           # global cap on in-flight requests
+    per_host_rps: float = 50.0          # request starts per second, per host
+    per_host_burst: int = 10
+    max_retries: int = 5
+    backoff_base: float = 0.5           # seconds
+    backoff_max: float = 30.0
+    timeout: float = 10.0
+    queue_size: int = 256               # fetched-but-unconsumed results held in memory
+    http2: bool = True
+
+
+# -----------------------------------------------------------------------------
+# Rate limiting
+# -----------------------------------------------------------------------------
+class HostRateLimiter:
+    """Async token bucket per host."""
+    def __init__(self, rps: float, burst: int = 1):
+        self.rps = max(1e-6, float(rps))
+        self.burst = max(1, int(burst))
+        self._buckets: Dict[str, Tuple[float, float]] = {}   # host -> (tokens, last refill)
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, host: str) -> None:
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                tokens, last = self._buckets.get(host, (float(self.burst), now))
+                tokens = min(float(self.burst), tokens + (now - last) * self.rps)
+                if tokens >= 1.0:
+                    self._buckets[host] = (tokens - 1.0, now)
+                    return
+                self._buckets[host] = (tokens, now)
+                wait = (1.0 - tokens) / self.rps
+            await asyncio.sleep(wait)
+
+
+def _retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    ra = response.headers.get('retry-after')
+    if not ra:
+        return None
+    try:
+        return max(0.0, float(ra))
+    except ValueError:
+        return None # HTTP-date form; fall back to backoff
+
+
+def _backoff(cfg: FetchConfig, attempt: int) -> float:
+    # "Full jitter": uniform over [0, capped exponential]
+    return random.uniform(0, min(cfg.backoff_max, cfg.backoff_base * (2 ** attempt)))
+
+
+def _run_blocking(coro):
+    """`asyncio.run`, or on a helper thread when this thread already runs a loop (Jupyter)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        return ex.submit(asyncio.run, coro).result()
+
+
+# -----------------------------------------------------------------------------
+# Fetcher
+# -----------------------------------------------------------------------------
+class AsyncTileFetcher:
+    """
+    Fetch many URLs through one connection pool.
+
+    Usage:
+        fetcher = AsyncTileFetcher(FetchConfig(max_concurrency=64))
+        counts = fetcher.fetch_all(((key, url) for key, url in ...), on_result=cache.put)
+    """
+    def __init__(self, config: Optional[FetchConfig] = None):
+        self.config = config or FetchConfig()
+        self.counts: Dict[str, int] = {}
+
+    async def _fetch_one(self, client: httpx.AsyncClient, limiter: HostRateLimiter, url: str) -> Optional[bytes]:
+        cfg = self.config
+        host = urlsplit(url).netloc
+        for attempt in range(cfg.max_retries + 1):
+            await limiter.acquire(host)
+            try:
+                response = await client.get(url)
+            except httpx.TransportError as e:
+                if attempt == cfg.max_retries:
+                    logger.warning(f'{url} failed: {e!r}')
+                    return None
+                self.counts['retries'] += 1
+                await asyncio.sleep(_backoff(cfg, attempt))
+                continue
+
+            if response.status_code == 200:
+                return response.content
+
+            if response.status_code in RETRY_STATUS and attempt < cfg.max_retries:
+                self.counts['retries'] += 1
+                if response.status_code == 429:
+                    self.counts['throttled'] += 1
+                wait = _retry_after_seconds(response)
+                await asyncio.sleep(wait if wait is not None else _backoff(cfg, attempt))
+                continue
+
+            logger.warning(f'{url} failed: HTTP {response.status_code}')
+            return None
+        return None
+
+    async def _run(self, jobs: Iterable[Tuple[Hashable, str]],
+                   on_result: Callable[[Hashable, bytes], None]) -> Dict[str, int]:
+        cfg = self.config
+        self.counts = {'requested': 0, 'fetched': 0, 'failed': 0, 'consumer_errors': 0, 'retries': 0, 'throttled': 0}
+        limiter = HostRateLimiter(cfg.per_host_rps, cfg.per_host_burst)
+        results: asyncio.Queue = asyncio.Queue(maxsize=cfg.queue_size)
+        jobs_iter = iter(jobs)
+        limits = httpx.Limits(max_connections=cfg.max_concurrency, max_keepalive_connections=cfg.max_concurrency)
+
+        async def worker(client: httpx.AsyncClient):
+            for key, url in jobs_iter: # shared iterator: each job is taken by exactly one worker
+                self.counts['requested'] += 1
+                data = await self._fetch_one(client, limiter, url)
+                await results.put((key, data)) # blocks when the consumer falls behind
+
+        async def consumer():
+            while True:
+                item = await results.get()
+                if item is None:
+                    return
+                key, data = item
+                if data is None:
+                    self.counts['failed'] += 1
+                    continue
+                try:
+                    await asyncio.to_thread(on_result, key, data)
+                except Exception:
+                    # keep draining: a dead consumer would leave the workers blocked on a full queue
+                    logger.exception(f'on_result failed for {key!r}')
+                    self.counts['consumer_errors'] += 1
+                    self.counts['failed'] += 1
+                else:
+                    self.counts['fetched'] += 1
+
+        async with httpx.AsyncClient(http2=cfg.http2, limits=limits, timeout=cfg.timeout) as client:
+            consumer_task = asyncio.create_task(consumer())
+            await asyncio.gather(*(worker(client) for _ in range(cfg.max_concurrency)))
+            await results.put(None)
+            await consumer_task
+
+        return dict(self.counts)
+
+    def fetch_all(self, jobs: Iterable[Tuple[Hashable, str]],
+                  on_result: Callable[[Hashable, bytes], None]) -> Dict[str, int]:
+        """
+        Fetch every (key, url) job, calling `on_result(key, bytes)` for each success. Blocking.
+        Errors raised by `on_result` are logged and counted as `failed` (and `consumer_errors`).
+        """
+        return _run_blocking(self._run(jobs, on_result))
@@ -5,6 +5,8 @@ from pathlib import Path
 from PIL import Image
 import matplotlib.pyplot as plt
 
+from .mosaic import stitch_grid
+
 def safe_stitch_tilegrid(tiles_df, verbose=True):
     """A wrapper to stitch images with a try/except statement"""
     try:
@@ -27,16 +29,8 @@ def stitch_tilegrid(tiles_df, show=False, verbose=False):
     dim = vals_Y.pop()
     #dimY = vals_X.pop() # Not necessary because its square but for completeness
 
-    # Get list an array of all images
-    tile_arrays = [np.array(Image.open(i)) for i in sorted_df['file_path']]
-
-    # Stitch the rows horizontally then vertically
-    rows = [
-        np.hstack(tile_arrays[i*dim:(i+1)*dim])
-        for i in range(dim)
-    ]
-    # Stack back together
-    final_image = np.vstack(rows)
+    # Decode each tile straight into one preallocated array (row-major, `dim` tiles per row)
+    final_image = stitch_grid(list(sorted_df['file_path']), n_cols=dim)
 
     if show:  
         plt.imshow(final_image)
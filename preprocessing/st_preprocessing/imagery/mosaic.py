@@ -0,0 +1,183 @@
+"""
+NumPy stitching engine shared by `download_imagery2` and `image.stitch_tilegrid`.
+
+Tiles are decoded once and copied straight into a single preallocated `uint8`
+array. For centred mosaics only the output window is allocated: each tile's
+overlap with the window is found with integer arithmetic and sliced into place,
+so there is no intermediate canvas, no row arrays and no float cropping.
+"""
+import io
+from pathlib import Path
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+TileSource = Union[np.ndarray, Image.Image, bytes, str, Path, None]
+
+DEFAULT_TILE_MEMORY = 1024  # decoded tiles kept by a MosaicStitcher (~192 KB each at 256px RGB)
+
+# -----------------------------------------------------------------------------
+# Decoding
+# -----------------------------------------------------------------------------
+def decode_tile(source: TileSource, mode: Optional[str] = 'RGB') -> Optional[np.ndarray]:
+    """Decode a tile (array, PIL image, encoded bytes or path) to an (h, w, c) uint8 array."""
+    if source is None:
+        return None
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = Image.open(io.BytesIO(source))
+    elif isinstance(source, (str, Path)):
+        source = Image.open(source)
+    if mode is not None and source.mode != mode:
+        source = source.convert(mode)
+    return np.asarray(source)
+
+
+# -----------------------------------------------------------------------------
+# Stitching
+# -----------------------------------------------------------------------------
+def stitch_window(
+    tiles: Dict[Tuple[int, int], TileSource],
+    tile_size: Tuple[int, int],
+    center_px: Tuple[float, float],
+    out_size: Tuple[int, int],
+    fill_color: Tuple[int, ...] = (0, 0, 0),
+    decode: Callable[[TileSource], Optional[np.ndarray]] = decode_tile,
+) -> np.ndarray:
+    """
+    Render an `out_size` (w, h) window centred on `center_px` from a grid of tiles.
+
+    `tiles` maps (dx, dy) grid offsets to tile sources; offset (0, 0) is the tile whose
+    top-left corner is the pixel origin, so `center_px` is measured from there and may
+    be fractional. Pixels not covered by any tile take `fill_color`.
+    """
+    tw, th = tile_size
+    out_w, out_h = out_size
+    left = int(round(center_px[0] - out_w / 2))
+    top = int(round(center_px[1] - out_h / 2))
+
+    out = np.empty((out_h, out_w, len(fill_color)), dtype=np.uint8)
+    out[...] = fill_color
+
+    for (dx, dy), source in tiles.items():
+        # Tile extent in window coordinates, clipped to the window
+        tx0, ty0 = dx * tw - left, dy * th - top
+        x0, y0 = max(tx0, 0), max(ty0, 0)
+        x1, y1 = min(tx0 + tw, out_w), min(ty0 + th, out_h)
+        if x0 >= x1 or y0 >= y1:
+            continue
+
+        arr = decode(source)
+        if arr is None:
+            continue
+        out[y0:y1, x0:x1] = arr[y0 - ty0:y1 - ty0, x0 - tx0:x1 - tx0, :out.shape[2]]
+
+    return out
+
+
+def stitch_grid(
+    sources: Sequence[TileSource],
+    n_cols: int,
+    decode: Callable[[TileSource], Optional[np.ndarray]] = lambda s: decode_tile(s, mode=None),
+) -> np.ndarray:
+    """
+    Stitch a row-major sequence of equally sized tiles into one array (tile `i` goes to
+    row `i // n_cols`, column `i % n_cols`). Shape and channels follow the first tile.
+    """
+    if len(sources) % n_cols != 0:
+        raise ValueError(f'{len(sources)} tiles do not fill a grid with {n_cols} columns')
+    n_rows = len(sources) // n_cols
+
+    first = decode(sources[0])
+    th, tw = first.shape[:2]
+    out = np.empty((n_rows * th, n_cols * tw) + first.shape[2:], dtype=first.dtype)
+
+    for i, source in enumerate(sources):
+        arr = first if i == 0 else decode(source)
+        r, c = divmod(i, n_cols)
+        out[r * th:(r + 1) * th, c * tw:(c + 1) * tw] = arr
+
+    return out
+
+
+def crop_center(
+    canvas: np.ndarray,
+    center_px: Tuple[float, float],
+    out_size: Optional[Tuple[int, int]] = None,
+    fill_value: int = 0,
+) -> np.ndarray:
+    """
+    Crop `canvas` so that `center_px` becomes the centre, using integer slicing.
+    Regions outside the canvas are padded with `fill_value`. Defaults to the canvas size.
+    """
+    h, w = canvas.shape[:2]
+    out_w, out_h = out_size or (w, h)
+    left = int(round(center_px[0] - out_w / 2))
+    top = int(round(center_px[1] - out_h / 2))
+
+    out = np.full((out_h, out_w) + canvas.shape[2:], fill_value, dtype=canvas.dtype)
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(left + out_w, w), min(top + out_h, h)
+    if x0 < x1 and y0 < y1:
+        out[y0 - top:y1 - top, x0 - left:x1 - left] = canvas[y0:y1, x0:x1]
+    return out
+
+
+# -----------------------------------------------------------------------------
+# Batches
+# -----------------------------------------------------------------------------
+class MosaicStitcher:
+    """
+    Stitches many mosaics that share tiles, decoding each tile once while it stays in
+    a bounded in-memory LRU. `load(key)` returns the encoded tile (or None if missing).
+
+    Usage:
+        stitcher = MosaicStitcher(load=cache.get)
+        arr = stitcher.stitch({(dx, dy): key, ...}, (256, 256), center_px, (768, 768))
+    """
+    def __init__(self, load: Callable[[Hashable], TileSource], max_tiles: int = DEFAULT_TILE_MEMORY):
+        self.load = load
+        self.max_tiles = max_tiles
+        self._arrays: OrderedDict = OrderedDict()
+        self.decoded = 0
+        self.reused = 0
+
+    def tile(self, key: Hashable) -> Optional[np.ndarray]:
+        arr = self._arrays.get(key)
+        if arr is not None:
+            self._arrays.move_to_end(key)
+            self.reused += 1
+            return arr
+
+        arr = decode_tile(self.load(key))
+        if arr is None:
+            return None
+        self.decoded += 1
+        self._arrays[key] = arr
+        while len(self._arrays) > self.max_tiles:
+            self._arrays.popitem(last=False)
+        return arr
+
+    def stitch(
+        self,
+        tile_keys: Dict[Tuple[int, int], Hashable],
+        tile_size: Tuple[int, int],
+        center_px: Tuple[float, float],
+        out_size: Tuple[int, int],
+        fill_color: Tuple[int, ...] = (0, 0, 0),
+    ) -> np.ndarray:
+        return stitch_window(tile_keys, tile_size, center_px, out_size, fill_color, decode=self.tile)
+
+    def stitch_many(
+        self,
+        jobs: Iterable[Tuple[Hashable, Dict[Tuple[int, int], Hashable], Tuple[float, float]]],
+        tile_size: Tuple[int, int],
+        out_size: Tuple[int, int],
+        fill_color: Tuple[int, ...] = (0, 0, 0),
+    ) -> Iterable[Tuple[Hashable, np.ndarray]]:
+        """Yield (ident, mosaic) for each (ident, tile_keys, center_px) job."""
+        for ident, tile_keys, center_px in jobs:
+            yield ident, self.stitch(tile_keys, tile_size, center_px, out_size, fill_color)
@@ -0,0 +1,170 @@
+"""
+Parallel imagery pipeline: one I/O stage and one CPU stage, overlapped across years.
+
+  - I/O: the planned tiles for each year are fetched by the async fetcher
+    (`io_workers` requests in flight) into the shared `TileCache`.
+  - CPU: as soon as a year's tiles are in the cache, its locations are split into
+    spatially contiguous chunks and stitched + PNG-encoded in a process pool
+    (`cpu_workers`). Each worker opens the cache by path and keeps its own
+    `MosaicStitcher`, so neighbouring mosaics in a chunk decode shared tiles once.
+
+While year N is being stitched, year N+1 is already downloading. A year's tiles
+are pinned in the cache from the start of its fetch until its last chunk is
+stitched, so a bounded cache cannot evict them in between. Runs are
+resumable: locations whose `{year}/{location_id}.png` already exists and is a
+complete PNG are left out of both stages.
+"""
+import os
+import logging
+import multiprocessing
+from pathlib import Path
+from contextlib import ExitStack
+from typing import Dict, Hashable, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+from .tile_cache import TileCache
+from .mosaic import MosaicStitcher
+from .tile_plan import TilePlan, fetch_planned_tiles
+from .download_imagery2 import (
+    SERVICE_NAME, TILE_URL_TEMPLATE, _format_base_url, is_valid_png, mosaic_from_cache, save_mosaic
+)
+
+logger = logging.getLogger(__name__)
+
+IO_WORKERS_DEFAULT = 32
+CHUNK_SIZE_DEFAULT = 64 # locations per process-pool task
+
+# -----------------------------------------------------------------------------
+# Worker side
+# -----------------------------------------------------------------------------
+_worker_cache: Optional[TileCache] = None
+_worker_stitcher: Optional[MosaicStitcher] = None
+
+
+def _init_worker(cache_root: str) -> None:
+    """Open one read-mostly cache handle and stitcher per worker process."""
+    global _worker_cache, _worker_stitcher
+    _worker_cache = TileCache(Path(cache_root), max_bytes=None, memory_items=0)
+    _worker_stitcher = MosaicStitcher(load=_worker_cache.get)
+
+
+def _stitch_chunk(chunk: TilePlan, year: int, save_dir: str,
+                  fill_color: Tuple[int, int, int], service: str) -> Tuple[int, List[Hashable]]:
+    """Stitch and save every location in `chunk`. Returns (n_saved, idents with no tiles)."""
+    saved, missing = 0, []
+    for ident in chunk.stitch_order():
+        mosaic = mosaic_from_cache(chunk, ident, year, _worker_cache, fill_color, service, stitcher=_worker_stitcher)
+        if mosaic is None:
+            missing.append(ident)
+            continue
+        save_mosaic(mosaic, Path(save_dir) / f"{ident}.png")
+        saved += 1
+    _worker_cache.flush()
+    return saved, missing
+
+
+# -----------------------------------------------------------------------------
+# Driver side
+# -----------------------------------------------------------------------------
+def pending_plan(plan: TilePlan, save_dir: Path) -> TilePlan:
+    """The part of `plan` whose output PNG is missing or incomplete in `save_dir`."""
+    return plan.subset([i for i in plan.centers if not is_valid_png(save_dir / f"{i}.png")])
+
+
+def chunk_plan(plan: TilePlan, chunk_size: int) -> List[TilePlan]:
+    """Split `plan` into chunks of neighbouring locations (in stitch order)."""
+    order = plan.stitch_order()
+    return [plan.subset(order[i:i + chunk_size]) for i in range(0, len(order), chunk_size)]
+
+
+def run_parallel_imagery(
+    plan: TilePlan,
+    years: List[int],
+    imagery_dir: Path,
+    cache: TileCache,
+    service_url_template: str = TILE_URL_TEMPLATE,
+    io_workers: int = IO_WORKERS_DEFAULT,
+    cpu_workers: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE_DEFAULT,
+    fill_color: Tuple[int, int, int] = (0, 0, 0),
+    service: str = SERVICE_NAME,
+    track_progress: bool = True,
+) -> Dict[int, Dict[str, int]]:
+    """
+    Fetch and stitch `plan` for every year into `imagery_dir/{year}/{ident}.png`.
+
+    `io_workers` caps in-flight tile requests; `cpu_workers` sizes the stitch/encode
+    process pool (default: `os.cpu_count()`). Locations with a valid PNG already on
+    disk are skipped. Returns per-year counts (skipped, fetched, failed, saved, missing).
+    """
+    cpu_workers = cpu_workers or os.cpu_count() or 1
+    base_url_for_year = lambda y: _format_base_url(str(service_url_template), y)
+
+    # Resume: only plan what is not on disk yet
+    pending: Dict[int, TilePlan] = {}
+    counts: Dict[int, Dict[str, int]] = {}
+    for year in years:
+        year_dir = Path(imagery_dir) / str(year)
+        year_dir.mkdir(parents=True, exist_ok=True)
+        pending[year] = pending_plan(plan, year_dir)
+        counts[year] = {'skipped': plan.n_locations - pending[year].n_locations,
+                        'fetched': 0, 'failed': 0, 'saved': 0, 'missing': 0}
+        logger.info(f"Imagery ({year}): {counts[year]['skipped']} done, {pending[year].n_locations} to go")
+
+    # One pin per year, taken when its fetch starts and released after its last stitch chunk
+    pins: Dict[int, ExitStack] = {year: ExitStack() for year in years}
+
+    def fetch_year(year: int) -> Dict[str, int]:
+        pins[year].enter_context(cache.pinned(pending[year].keys([year], service)))
+        return fetch_planned_tiles(pending[year], [year], cache, base_url_for_year, service,
+                                   max_workers=io_workers, track_progress=False)
+
+    todo = [y for y in years if pending[y].n_locations]
+    n_total = sum(pending[y].n_locations for y in todo)
+    cache.flush() # workers read the index from their own connections
+
+    # 'spawn': forking after the fetch thread (and its event loop / sqlite handles) exist is unsafe
+    mp_context = multiprocessing.get_context('spawn')
+    try:
+        with ProcessPoolExecutor(max_workers=cpu_workers, mp_context=mp_context,
+                                 initializer=_init_worker, initargs=(str(cache.root),)) as cpu_pool, \
+             ThreadPoolExecutor(max_workers=1) as io_pool, \
+             tqdm(total=n_total, desc='Stitching locations', disable=(not track_progress)) as pbar:
+
+            # Years are fetched one after another; each year's stitch chunks are queued as soon
+            # as its fetch finishes, so downloading year N+1 overlaps stitching year N.
+            fetches = {io_pool.submit(fetch_year, year): year for year in todo}
+            stitches, chunks_left = {}, {}
+            for fut in as_completed(fetches):
+                year = fetches[fut]
+                fetch_counts = fut.result()
+                counts[year]['fetched'], counts[year]['failed'] = fetch_counts['fetched'], fetch_counts['failed']
+                cache.flush()
+                save_dir = str(Path(imagery_dir) / str(year))
+                chunks = chunk_plan(pending[year], chunk_size)
+                chunks_left[year] = len(chunks)
+                for chunk in chunks:
+                    stitches[cpu_pool.submit(_stitch_chunk, chunk, year, save_dir, fill_color, service)] = (year, chunk.n_locations)
+
+            for fut in as_completed(stitches):
+                year, n = stitches[fut]
+                saved, missing = fut.result()
+                counts[year]['saved'] += saved
+                counts[year]['missing'] += len(missing)
+                for ident in missing:
+                    logger.error(f"[{ident}] no tiles for {year} – skipping")
+                pbar.update(n)
+                chunks_left[year] -= 1
+                if not chunks_left[year]:
+                    pins[year].close()
+    finally:
+        for stack in pins.values():
+            stack.close()
+
+    for year in years:
+        c = counts[year]
+        logger.info(f"Imagery ({year}): {c['saved']} saved, {c['skipped']} already done, "
+                    f"{c['fetched']} tiles fetched, {c['failed']} failed")
+    return counts
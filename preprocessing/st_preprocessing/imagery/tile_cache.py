@@ -0,0 +1,338 @@
+"""
+Shared, content-addressed store for downloaded map tiles.
+
+Tiles are keyed by (service, year, z, x, y) so every `NYC_Orthos_{year}` service
+can live in one cache. The raw bytes returned by the tile server are stored once
+per content hash under a sharded `objects/` directory, and a small sqlite index
+maps keys to hashes and tracks last access for LRU eviction. Tiles a run still
+needs can be pinned (`with cache.pinned(keys):`) so eviction skips them.
+
+Layout:
+    {root}/index.sqlite
+    {root}/objects/ab/cd/abcd...   (sha256 of the tile bytes)
+"""
+import io
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from collections import Counter, OrderedDict
+from typing import Iterable, NamedTuple, Optional, Dict
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = None           # unbounded unless configured (imagery.tile_cache_max_gb)
+DEFAULT_MEMORY_ITEMS = 512         # decoded tiles kept in memory
+_TOUCH_FLUSH_EVERY = 256           # batch last-access updates to the index
+_EVICT_LOW_WATER = 0.9             # evict down to this fraction of `max_bytes`
+
+# -----------------------------------------------------------------------------
+# Keys
+# -----------------------------------------------------------------------------
+class TileKey(NamedTuple):
+    service: str
+    year: int
+    z: int
+    x: int
+    y: int
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# -----------------------------------------------------------------------------
+# Cache
+# -----------------------------------------------------------------------------
+class TileCache:
+    """
+    Size-bounded, LRU-evicting tile store. Thread-safe, so a single instance can
+    be shared by the download threads of every year in a run.
+
+    Args:
+        root: directory holding the index and tile objects.
+        max_bytes: upper bound on stored tile bytes (None = unbounded).
+        memory_items: number of decoded RGB tiles to keep in memory (0 disables).
+    """
+    def __init__(self, root: Path, max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+                 memory_items: int = DEFAULT_MEMORY_ITEMS):
+        self.root = Path(root)
+        self.objects_path = self.root / 'objects'
+        self.objects_path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(self.root / 'index.sqlite', check_same_thread=False, isolation_level=None,
+                                   timeout=30) # other processes (e.g. stitch workers) may hold the write lock
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS tiles (
+                service TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                z INTEGER NOT NULL,
+                x INTEGER NOT NULL,
+                y INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (service, year, z, x, y)
+            )
+        """)
+        self._db.execute('CREATE INDEX IF NOT EXISTS tiles_digest ON tiles (digest)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS tiles_last_access ON tiles (last_access)')
+
+        self._total_bytes = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM (SELECT digest, MAX(size) AS size FROM tiles GROUP BY digest)'
+        ).fetchone()[0]
+        self._touched: Dict[TileKey, float] = {}
+        self._images: OrderedDict = OrderedDict()
+        self._pins: Counter = Counter()
+        self._pin_saturated = False # everything evictable is gone; wait for pins to be released
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.evictions = 0
+        self.bytes_written = 0
+
+    # Dunders
+    def __contains__(self, key: TileKey) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT 1 FROM tiles WHERE service=? AND year=? AND z=? AND x=? AND y=?', tuple(key)
+            ).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM tiles').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Paths
+    def _object_path(self, digest: str) -> Path:
+        return self.objects_path / digest[:2] / digest[2:4] / digest
+
+    # Reads
+    def get(self, key: TileKey) -> Optional[bytes]:
+        """Return the raw tile bytes for `key`, or None on a miss."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT digest FROM tiles WHERE service=? AND year=? AND z=? AND x=? AND y=?', tuple(key)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            try:
+                data = self._object_path(row[0]).read_bytes()
+            except FileNotFoundError:
+                # Index points at an object that has gone missing: drop the row
+                self._delete_keys([key])
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._touch(key)
+            return data
+
+    def get_image(self, key: TileKey) -> Optional[Image.Image]:
+        """Return the tile decoded as an RGB image, decoding each tile at most once while it stays in memory."""
+        with self._lock:
+            img = self._images.get(key)
+            if img is not None:
+                self._images.move_to_end(key)
+                self.memory_hits += 1
+                self._touch(key)
+                return img
+
+        data = self.get(key)
+        if data is None:
+            return None
+        img = Image.open(io.BytesIO(data)).convert('RGB')
+        self._remember(key, img)
+        return img
+
+    # Writes
+    def put(self, key: TileKey, data: bytes, image: Optional[Image.Image] = None) -> str:
+        """Store `data` under `key` and return its content hash."""
+        digest = _digest(data)
+        obj_path = self._object_path(digest)
+
+        with self._lock:
+            is_new_object = not obj_path.exists()
+            if is_new_object:
+                obj_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = obj_path.with_name(f'{digest}.{os.getpid()}.{threading.get_ident()}.tmp')
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, obj_path)
+                self._total_bytes += len(data)
+                self.bytes_written += len(data)
+
+            previous = self._db.execute(
+                'SELECT digest FROM tiles WHERE service=? AND year=? AND z=? AND x=? AND y=?', tuple(key)
+            ).fetchone()
+            self._db.execute(
+                'INSERT OR REPLACE INTO tiles (service, year, z, x, y, digest, size, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (*key, digest, len(data), time.time())
+            )
+            if previous is not None and previous[0] != digest:
+                self._drop_orphan(previous[0])
+
+            self._touched.pop(key, None)
+            if image is not None:
+                self._remember(key, image.convert('RGB'))
+            else:
+                self._images.pop(key, None)
+
+            self._evict_if_needed()
+
+        return digest
+
+    # Legacy migration
+    def import_legacy_dir(self, legacy_path: Path, service: str, year: int) -> int:
+        """
+        Import a pre-existing `{x}_{y}_{zoom}.png` tile folder (the old per-`save_dir`
+        cache, which carries no year) under the given service/year. Returns the tile count.
+        """
+        n = 0
+        for p in Path(legacy_path).glob('*_*_*.png'):
+            try:
+                x, y, z = (int(v) for v in p.stem.split('_'))
+            except ValueError:
+                continue
+            self.put(TileKey(service, int(year), z, x, y), p.read_bytes())
+            n += 1
+        return n
+
+    # Pinning
+    @contextmanager
+    def pinned(self, keys: Iterable[TileKey]):
+        """
+        Keep `keys` from being evicted inside the block, e.g. a plan's tiles between
+        fetching and stitching. Pins nest (a key stays pinned until every pin is released).
+        """
+        keys = [TileKey(*k) for k in keys]
+        with self._lock:
+            self._pins.update(keys)
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._pins.subtract(keys)
+                self._pins += Counter() # drop keys whose count reached zero
+                self._pin_saturated = False
+                self._evict_if_needed()
+
+    # Housekeeping
+    def flush(self) -> None:
+        """Persist batched last-access times to the index."""
+        with self._lock:
+            if not self._touched:
+                return
+            self._db.executemany(
+                'UPDATE tiles SET last_access=? WHERE service=? AND year=? AND z=? AND x=? AND y=?',
+                [(t, *k) for k, t in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            self.flush()
+            self._db.close()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'memory_hits': self.memory_hits,
+            'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            'evictions': self.evictions,
+            'bytes_written': self.bytes_written,
+            'total_bytes': self._total_bytes,
+        }
+
+    # Internals
+    def _touch(self, key: TileKey) -> None:
+        self._touched[key] = time.time()
+        if len(self._touched) >= _TOUCH_FLUSH_EVERY:
+            self.flush()
+
+    def _remember(self, key: TileKey, img: Image.Image) -> None:
+        if self.memory_items <= 0:
+            return
+        with self._lock:
+            self._images[key] = img
+            self._images.move_to_end(key)
+            while len(self._images) > self.memory_items:
+                self._images.popitem(last=False)
+
+    def _drop_orphan(self, digest: str) -> None:
+        still_used = self._db.execute('SELECT 1 FROM tiles WHERE digest=? LIMIT 1', (digest,)).fetchone()
+        if still_used:
+            return
+        obj_path = self._object_path(digest)
+        try:
+            size = obj_path.stat().st_size
+            obj_path.unlink()
+            self._total_bytes -= size
+        except FileNotFoundError:
+            pass
+
+    def _delete_keys(self, keys) -> None:
+        digests = set()
+        for key in keys:
+            row = self._db.execute(
+                'SELECT digest FROM tiles WHERE service=? AND year=? AND z=? AND x=? AND y=?', tuple(key)
+            ).fetchone()
+            if row is None:
+                continue
+            digests.add(row[0])
+            self._db.execute('DELETE FROM tiles WHERE service=? AND year=? AND z=? AND x=? AND y=?', tuple(key))
+            self._touched.pop(key, None)
+            self._images.pop(key, None)
+        for digest in digests:
+            self._drop_orphan(digest)
+
+    def _evict_if_needed(self) -> None:
+        if self.max_bytes is None or self._total_bytes <= self.max_bytes or self._pin_saturated:
+            return
+
+        self.flush()
+        target = self.max_bytes * _EVICT_LOW_WATER
+        skipped = 0 # pinned rows at the head of the LRU order
+        while self._total_bytes > target:
+            rows = self._db.execute(
+                'SELECT service, year, z, x, y, size FROM tiles ORDER BY last_access ASC LIMIT 64 OFFSET ?', (skipped,)
+            ).fetchall()
+            if not rows:
+                logger.warning(f'Tile cache is over its bound ({self._total_bytes / 1024**2:.1f} MB) '
+                               f'but the remaining tiles are pinned')
+                self._pin_saturated = True
+                break
+            evictable, excess = [], self._total_bytes - target
+            for *key, size in rows:
+                key = TileKey(*key)
+                if key in self._pins:
+                    skipped += 1
+                elif excess > 0:
+                    evictable.append(key)
+                    excess -= size
+            self._delete_keys(evictable)
+            self.evictions += len(evictable)
+
+        logger.info(f'Tile cache evicted down to {self._total_bytes / 1024**2:.1f} MB')
@@ -0,0 +1,170 @@
+"""
+Planning stage for imagery downloads.
+
+Neighbouring intersections share most of their tiles at z20, so rather than
+downloading a tile grid per location we compute the unique set of
+(year, z, x, y) tiles a whole GeoDataFrame needs, fetch each of them once into
+the `TileCache`, and stitch every mosaic from the cache afterwards.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Optional, Tuple, Callable
+
+import numpy as np
+import mercantile
+import geopandas as gpd
+from shapely.geometry import Point
+from tqdm import tqdm
+
+from .tile_cache import TileCache, TileKey
+from .fetch import AsyncTileFetcher, FetchConfig
+
+logger = logging.getLogger(__name__)
+
+MAX_FETCH_WORKERS_DEFAULT = 32
+
+# -----------------------------------------------------------------------------
+# Plan
+# -----------------------------------------------------------------------------
+@dataclass
+class TilePlan:
+    """The tiles needed by a set of locations, computed once for all years."""
+    zoom: int
+    radius: int
+    offsets: List[Tuple[int, int]]
+    centers: Dict[Hashable, Tuple[int, int]]        # ident -> center tile (x, y)
+    points: Dict[Hashable, Point]                   # ident -> point in EPSG:4326
+    tiles: np.ndarray                               # unique (x, y) tiles, shape (n, 2)
+    skipped: List[Hashable] = field(default_factory=list)
+
+    @property
+    def n_locations(self) -> int:
+        return len(self.centers)
+
+    @property
+    def n_requested(self) -> int:
+        """Tile requests per year if every location fetched its own grid."""
+        return self.n_locations * len(self.offsets)
+
+    @property
+    def n_unique(self) -> int:
+        """Tile requests per year after deduplication."""
+        return int(self.tiles.shape[0])
+
+    @property
+    def dedup_ratio(self) -> float:
+        """How many naive requests each unique tile stands in for (>= 1)."""
+        return (self.n_requested / self.n_unique) if self.n_unique else 1.0
+
+    def keys(self, years: List[int], service: str) -> List[TileKey]:
+        return [
+            TileKey(service, int(year), self.zoom, int(x), int(y))
+            for year in years
+            for x, y in self.tiles
+        ]
+
+    def location_tiles(self, ident: Hashable) -> Dict[Tuple[int, int], Tuple[int, int]]:
+        """Map each (dx, dy) offset of `ident`'s grid to its absolute (x, y) tile."""
+        x0, y0 = self.centers[ident]
+        return {(dx, dy): (x0 + dx, y0 + dy) for dx, dy in self.offsets}
+
+    def stitch_order(self) -> List[Hashable]:
+        """Locations sorted by center tile (row-major) so consecutive mosaics share tiles."""
+        return sorted(self.centers, key=lambda i: (self.centers[i][1], self.centers[i][0]))
+
+    def subset(self, idents: List[Hashable]) -> 'TilePlan':
+        """A plan covering only `idents` (e.g. the locations still missing output)."""
+        centers = {i: self.centers[i] for i in idents if i in self.centers}
+        points = {i: self.points[i] for i in centers}
+        return TilePlan(zoom=self.zoom, radius=self.radius, offsets=self.offsets, centers=centers,
+                        points=points, tiles=_unique_tiles(list(centers.values()), self.offsets))
+
+    def summary(self, n_years: int = 1) -> str:
+        return (
+            f"{self.n_locations} locations x {len(self.offsets)} tiles x {n_years} years: "
+            f"{self.n_requested * n_years} requests -> {self.n_unique * n_years} unique tiles "
+            f"(dedup ratio {self.dedup_ratio:.2f}x)"
+        )
+
+
+def plan_tiles(
+    gdf: gpd.GeoDataFrame,
+    zoom: int,
+    radius: int,
+    offsets: List[Tuple[int, int]],
+    id_col: Optional[str] = 'location_id',
+    geom_col: str = 'geometry',
+) -> TilePlan:
+    """
+    Compute the center tile of every location and the unique set of tiles covering
+    all of their offset grids. `gdf` must already be in EPSG:4326.
+    """
+    idents = gdf[id_col].tolist() if (id_col and id_col in gdf.columns) else gdf.index.tolist()
+    geoms = gdf[geom_col].tolist()
+
+    centers: Dict[Hashable, Tuple[int, int]] = {}
+    points: Dict[Hashable, Point] = {}
+    skipped: List[Hashable] = []
+    for ident, pt in zip(idents, geoms):
+        if not isinstance(pt, Point):
+            skipped.append(ident)
+            continue
+        tile = mercantile.tile(pt.x, pt.y, zoom)
+        centers[ident] = (tile.x, tile.y)
+        points[ident] = pt
+
+    return TilePlan(zoom=zoom, radius=radius, offsets=list(offsets), centers=centers,
+                    points=points, tiles=_unique_tiles(list(centers.values()), offsets), skipped=skipped)
+
+
+def _unique_tiles(centers: List[Tuple[int, int]], offsets: List[Tuple[int, int]]) -> np.ndarray:
+    if not centers:
+        return np.empty((0, 2), dtype=np.int64)
+    center_arr = np.array(centers, dtype=np.int64)   # (n, 2)
+    offset_arr = np.array(offsets, dtype=np.int64)   # (k, 2)
+    all_tiles = (center_arr[:, None, :] + offset_arr[None, :, :]).reshape(-1, 2)
+    return np.unique(all_tiles, axis=0)
+
+
+# -----------------------------------------------------------------------------
+# Fetch
+# -----------------------------------------------------------------------------
+def fetch_planned_tiles(
+    plan: TilePlan,
+    years: List[int],
+    cache: TileCache,
+    base_url_for_year: Callable[[int], str],
+    service: str,
+    max_workers: int = MAX_FETCH_WORKERS_DEFAULT,
+    fetch_config: Optional[FetchConfig] = None,
+    skip_cached: bool = True,
+    track_progress: bool = True,
+) -> Dict[str, int]:
+    """
+    Fetch every planned tile exactly once, writing it into `cache`. Tiles already in
+    the cache are skipped unless `skip_cached` is False. `max_workers` caps in-flight
+    requests unless a full `fetch_config` is given.
+    Returns counts of tiles planned, already cached, fetched and failed.
+    """
+    keys = plan.keys(years, service)
+    missing = [k for k in keys if k not in cache] if skip_cached else keys
+
+    counts = {'planned': len(keys), 'cached': len(keys) - len(missing), 'fetched': 0, 'failed': 0}
+    if not missing:
+        return counts
+
+    base_urls = {year: base_url_for_year(year) for year in years}
+    jobs = ((k, f"{base_urls[k.year]}/tile/{k.z}/{k.y}/{k.x}") for k in missing)
+    fetcher = AsyncTileFetcher(fetch_config or FetchConfig(max_concurrency=max_workers))
+
+    with tqdm(total=len(missing), desc='Fetching unique tiles', disable=(not track_progress)) as pbar:
+        def on_result(key: TileKey, data: bytes) -> None:
+            cache.put(key, data)
+            pbar.update(1)
+
+        fetch_counts = fetcher.fetch_all(jobs, on_result)
+
+    counts['fetched'] = fetch_counts['fetched']
+    counts['failed'] = fetch_counts['failed']
+    counts['retries'] = fetch_counts['retries']
+    return counts
@@ -0,0 +1,195 @@
+"""
+Stage-graph executor for the preprocessing pipeline.
+
+Each step is declared as a `PipelineStage` with the stages it consumes (`inputs`),
+the config sections it reads and the files it writes. The executor:
+    - runs a stage as soon as its inputs are done, so independent stages
+      (e.g. imagery and citydata features) run concurrently
+    - fingerprints each stage (its source plus the modules it declares in `code`,
+      its config sections and its inputs' fingerprints) and skips it when the
+      fingerprint matches the last successful run and its outputs still exist;
+      editing one stage, or code it calls, therefore only re-runs it and what is
+      downstream of it
+    - supports `only` (run just these stages, reusing cached inputs) and
+      `from_stage` (force this stage and everything downstream). Without either,
+      only stages marked `default` run
+
+Fingerprints are kept in `{universe}/.pipeline/state.json`.
+"""
+import json
+import time
+import inspect
+import hashlib
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+STATE_DIRNAME = '.pipeline'
+
+@dataclass
+class PipelineStage:
+    """
+    `func(cfg, *input_values, silent=silent)` runs the stage; its return value (checked
+    against `returns`) is handed to downstream stages. When a stage is skipped as cached,
+    `load(cfg)` rebuilds that value from its outputs; a stage that declares `returns`
+    but no `load` is re-run whenever a consumer runs. `code` lists the modules, packages
+    or functions the stage calls, so editing them invalidates it too. Stages with
+    `default=False` only run when selected (`only` / `from_stage`).
+    """
+    name: str
+    func: Callable
+    inputs: List[str] = field(default_factory=list)
+    config_keys: List[str] = field(default_factory=list)
+    outputs: Optional[Callable[[Dict], List[Path]]] = None
+    load: Optional[Callable[[Dict], Any]] = None
+    returns: Optional[type] = None
+    code: List[Any] = field(default_factory=list)
+    default: bool = True
+
+
+def _object_source(obj: Any) -> bytes:
+    """Source of a function or module; every .py file of a package."""
+    if inspect.ismodule(obj) and hasattr(obj, '__path__'):
+        files = sorted(p for root in obj.__path__ for p in Path(root).rglob('*.py'))
+        return b''.join(p.name.encode() + p.read_bytes() for p in files)
+    try:
+        return inspect.getsource(obj).encode()
+    except (OSError, TypeError):
+        return f"{getattr(obj, '__module__', '')}.{getattr(obj, '__qualname__', obj)}".encode()
+
+
+def _source_digest(func: Callable, code: Sequence[Any] = ()) -> str:
+    h = hashlib.sha256()
+    for obj in [func, *code]:
+        h.update(_object_source(obj))
+    return h.hexdigest()
+
+
+class PipelineGraph:
+    """
+    Usage:
+        graph = PipelineGraph([PipelineStage('locations', load_locations, ...), ...])
+        graph.run(cfg, state_dir, only=['imagery'])
+    """
+    def __init__(self, stages: Sequence[PipelineStage]):
+        self.stages = {s.name: s for s in stages}
+        for stage in stages:
+            missing = [i for i in stage.inputs if i not in self.stages]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage(s): {missing}")
+        self.order = self._toposort()
+
+    def _toposort(self) -> List[str]:
+        order, visiting, done = [], set(), set()
+        def visit(name: str):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle in pipeline stages at '{name}'")
+            visiting.add(name)
+            for dep in self.stages[name].inputs:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def downstream(self, names: Sequence[str]) -> Set[str]:
+        """`names` and every stage that (transitively) consumes them."""
+        out = set(names)
+        for name in self.order:
+            if any(dep in out for dep in self.stages[name].inputs):
+                out.add(name)
+        return out
+
+    def upstream(self, names: Sequence[str]) -> Set[str]:
+        out, stack = set(), list(names)
+        while stack:
+            name = stack.pop()
+            if name not in out:
+                out.add(name)
+                stack.extend(self.stages[name].inputs)
+        return out
+
+    def fingerprints(self, cfg: Dict) -> Dict[str, str]:
+        prints = {}
+        for name in self.order:
+            stage = self.stages[name]
+            payload = {
+                'source': _source_digest(stage.func, stage.code),
+                'config': {k: cfg.get(k) for k in stage.config_keys},
+                'inputs': {i: prints[i] for i in stage.inputs},
+            }
+            prints[name] = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        return prints
+
+    # Execution
+    def run(self, cfg: Dict, state_dir: Path, only: Optional[Sequence[str]] = None, from_stage: Optional[str] = None,
+            force: bool = False, max_workers: int = 4, silent: bool = False) -> Dict[str, Any]:
+        """Run the graph; returns {stage: value} for the stages that were run or loaded."""
+        for name in list(only or []) + ([from_stage] if from_stage else []):
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage '{name}'. Stages: {self.order}")
+
+        state_path = Path(state_dir) / 'state.json'
+        state = json.loads(state_path.read_text()) if state_path.exists() else {}
+        prints = self.fingerprints(cfg)
+
+        defaults = {n for n in self.order if self.stages[n].default}
+        selected = set(only) if only else defaults
+        forced = set(self.order) if force else (self.downstream([from_stage]) if from_stage else set())
+        if from_stage and not only:
+            selected = (self.downstream([from_stage]) & defaults) | {from_stage}
+
+        def is_cached(name: str) -> bool:
+            stage = self.stages[name]
+            outputs_exist = stage.outputs is None or all(Path(p).exists() for p in stage.outputs(cfg))
+            return name not in forced and state.get(name, {}).get('fingerprint') == prints[name] and outputs_exist
+
+        # Upstream of the selection is loaded from cache, or run if its cache is stale
+        needed = self.upstream(selected)
+        will_run = {n for n in needed if not is_cached(n)}
+        for name in reversed(self.order): # a value-returning input with no `load` must run to feed a consumer
+            if name in will_run:
+                for i in self.stages[name].inputs:
+                    if self.stages[i].returns is not None and self.stages[i].load is None:
+                        will_run.add(i)
+
+        values: Dict[str, Any] = {}
+        done: Set[str] = set()
+        pending = [n for n in self.order if n in needed]
+
+        def execute(name: str):
+            stage = self.stages[name]
+            if name not in will_run:
+                if not silent:
+                    print(f'[Pipeline] {name}: cached ({prints[name]})')
+                return (stage.load(cfg) if stage.load else None), None
+            if not silent:
+                print(f'[Pipeline] {name}: running')
+            start = time.time()
+            value = stage.func(cfg, *[values.get(i) for i in stage.inputs], silent=silent)
+            if stage.returns is not None and not isinstance(value, stage.returns):
+                raise TypeError(f"Stage '{name}' returned {type(value).__name__}, expected {stage.returns.__name__}")
+            return value, {'fingerprint': prints[name], 'seconds': round(time.time() - start, 2), 'finished_at': time.time()}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            running = {}
+            while pending or running:
+                for name in [n for n in pending if all(i in done for i in self.stages[n].inputs)]:
+                    pending.remove(name)
+                    running[ex.submit(execute, name)] = name
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    name = running.pop(fut)
+                    values[name], record = fut.result() # re-raises; stages finished so far stay recorded
+                    done.add(name)
+                    if record is not None:
+                        state[name] = record
+                        state_path.parent.mkdir(parents=True, exist_ok=True)
+                        state_path.write_text(json.dumps(state, indent=2))
+
+        return values
@@ -6,7 +6,13 @@ import os
 
 from .data_load.load_lion import load_lion_default # TODO: Switch to load_universe using lionsource
 #from citydata.features_pipeline import  # TODO: Switch to load_universe using lionsource
-from .imagery.download_imagery2 import download_and_stitch_gdf
+from .imagery.download_imagery2 import download_and_stitch_gdf, reproject_to_wgs84, _generate_offset_grid
+from .imagery.tile_plan import plan_tiles
+from .imagery.tile_cache import TileCache
+from .imagery.parallel import run_parallel_imagery, IO_WORKERS_DEFAULT, CHUNK_SIZE_DEFAULT
+from .pipeline import PipelineStage, PipelineGraph, STATE_DIRNAME
+from .data_load import load_lion
+from . import imagery
 
 # -----------------------------
 # Load Config
@@ -28,6 +34,12 @@ def save_locations(locations_gdf:gpd.GeoDataFrame, save_path:Path) -> None:
 
     copy_gdf.to_file(save_path)
 
+def read_saved_locations(save_path:Path) -> gpd.GeoDataFrame:
+    """Inverse of `save_locations`."""
+    locations_gdf = gpd.read_file(save_path)
+    locations_gdf['crossstreets'] = locations_gdf['crossstreets'].str.split(' | ', regex=False)
+    return locations_gdf
+
 # -----------------------------
 # Preprocessing Steps
 # -----------------------------
@@ -60,20 +72,49 @@ def load_and_stitch_imagery(cfg, locations_gdf, silent:bool=False):
     imagery_dir = Path(cfg['universe']['universe_path']) / universe_name / "imagery"
     imagery_dir.mkdir(parents=True, exist_ok=True)
 
-    # TODO: Iterate over locations and cfg['imagery']['years']
-    print("[Step 2] Loading and stitching imagery...")
-    for year in cfg["imagery"]["imagery_years"]:
-        year_dir = imagery_dir / str(year)
-        year_dir.mkdir(parents=True, exist_ok=True)
-        if not silent:
-            print(f"\tProcessing imagery for year {year}...")
+    # One tile cache shared by every year (tiles are keyed by year)
+    tile_cache_path = Path(cfg['imagery'].get('tile_cache_path', imagery_dir / '.tile_cache'))
+    cache_max_gb = cfg['imagery'].get('tile_cache_max_gb')
+    tile_cache = TileCache(tile_cache_path, max_bytes=int(cache_max_gb * 1024**3) if cache_max_gb else None)
+
+    # Plan the unique tiles once; the same plan serves every year
+    imagery_years = cfg["imagery"]["imagery_years"]
+    radius = cfg['imagery'].get('imagery_radius', 1)
+    locations_gdf = reproject_to_wgs84(locations_gdf)
+    tile_plan = plan_tiles(locations_gdf, cfg['imagery']['imagery_zlevel'], radius, _generate_offset_grid(radius))
+    print(f"[Step 2] Tile plan: {tile_plan.summary(n_years=len(imagery_years))}")
 
-        download_and_stitch_gdf(
-            locations_gdf, 
-            year = year, 
-            zoom=cfg['imagery']['imagery_zlevel'], 
-            save_dir = year_dir
-        )
+    print("[Step 2] Loading and stitching imagery...")
+    if cfg['imagery'].get('parallel', False):
+        # Fetch in an I/O pool, stitch/encode in a process pool; resumes from existing PNGs
+        with tile_cache:
+            run_parallel_imagery(
+                tile_plan, imagery_years, imagery_dir, tile_cache,
+                io_workers = cfg['imagery'].get('io_workers', IO_WORKERS_DEFAULT),
+                cpu_workers = cfg['imagery'].get('cpu_workers'),
+                chunk_size = cfg['imagery'].get('chunk_size', CHUNK_SIZE_DEFAULT),
+                track_progress = not silent
+            )
+        return
+
+    with tile_cache:
+        for year in imagery_years:
+            year_dir = imagery_dir / str(year)
+            year_dir.mkdir(parents=True, exist_ok=True)
+            if not silent:
+                print(f"\tProcessing imagery for year {year}...")
+
+            download_and_stitch_gdf(
+                locations_gdf, 
+                year = year, 
+                zoom=cfg['imagery']['imagery_zlevel'], 
+                save_dir = year_dir,
+                radius = radius,
+                cache = tile_cache,
+                plan = tile_plan,
+                skip_existing = cfg['imagery'].get('skip_existing', True),
+                quiet = silent
+            )
 
 
 def load_citydata_features(cfg, silent:bool=False):
@@ -136,20 +177,43 @@ def process_documents_digest(cfg, silent:bool=False):
         print(f"\tSaving digested docs to {out_path}")
 
 
+# -----------------------------
+# Stage Graph
+# -----------------------------
+def _universe_dir(cfg) -> Path:
+    return Path(cfg['universe']['universe_path']) / cfg['universe']['universe_name']
+
+def _locations_path(cfg) -> Path:
+    return _universe_dir(cfg) / cfg['locations']['locations_outfile']
+
+STAGES = [
+    PipelineStage('locations', load_locations, config_keys=['universe', 'locations'],
+                  outputs=lambda cfg: [_locations_path(cfg)], load=lambda cfg: read_saved_locations(_locations_path(cfg)),
+                  returns=gpd.GeoDataFrame, code=[load_lion, save_locations]),
+    PipelineStage('imagery', load_and_stitch_imagery, inputs=['locations'], config_keys=['universe', 'imagery'],
+                  outputs=lambda cfg: [_universe_dir(cfg) / 'imagery'], code=[imagery]),
+    # Not implemented yet (they write nothing): only run when asked for with --only / --from
+    PipelineStage('citydata_features', load_citydata_features, config_keys=['universe', 'citydata'], default=False),
+    PipelineStage('citydata_projects', load_citydata_projects, config_keys=['universe', 'citydata'], default=False),
+    PipelineStage('documents_geolocate', process_documents_geolocate, config_keys=['universe', 'documents'], default=False),
+    PipelineStage('documents_digest', process_documents_digest, inputs=['documents_geolocate'], config_keys=['universe', 'documents'], default=False),
+]
+
+PIPELINE = PipelineGraph(STAGES)
+
 # -----------------------------
 # Main Pipeline Runner
 # -----------------------------
-def run_pipeline(config_path="config.yaml", silent:bool=False):
+def run_pipeline(config_path="config.yaml", silent:bool=False, only=None, from_stage=None, force:bool=False, max_workers:int=4):
     cfg = load_config(config_path)
     print("[Pipeline] Starting preprocessing for universe:", cfg['universe']['universe_name'])
 
     #if cfg['']:  TODO: Some way in the config file to pass in a locations file rathert than loading one.
-    locations_gdf = load_locations(cfg, silent)
-    load_and_stitch_imagery(cfg, locations_gdf, silent)
-    # load_citydata_features(cfg, silent)
-    # load_citydata_projects(cfg, silent)
-    # process_documents_geolocate(cfg, silent)
-    # process_documents_digest(cfg, silent)
+    # Stages whose inputs are ready run concurrently; unchanged stages are skipped (see pipeline.py)
+    PIPELINE.run(
+        cfg, _universe_dir(cfg) / STATE_DIRNAME,
+        only=only, from_stage=from_stage, force=force, max_workers=max_workers, silent=silent
+    )
 
     print("[Pipeline] Preprocessing complete.")
 
@@ -161,6 +225,10 @@ def parse_arguments():
 
     parser.add_argument('config_path', type=str, help="Include a config file. See README for details.")
     parser.add_argument('-s','--silent', default=False, help="Run in silent mode (minimize console output)")
+    parser.add_argument('--only', nargs='+', choices=PIPELINE.order, help="Run only these stages (upstream results are reused from cache)")
+    parser.add_argument('--from', dest='from_stage', choices=PIPELINE.order, help="Re-run this stage and everything downstream of it")
+    parser.add_argument('--force', action='store_true', help="Ignore cached stage results")
+    parser.add_argument('--max-workers', type=int, default=4, help="Stages run concurrently")
 
     args = parser.parse_args()
 
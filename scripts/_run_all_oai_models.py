@@ -20,6 +20,7 @@ class QueryRun:
     model: str
     head: Optional[int]=None
     test: Optional[int]=None
+    batch: bool=False # submit through the Batch API instead of one call per item
 
 QUERY_RUNS = [
     QueryRun( # Dater - Image - 4o
@@ -156,7 +157,7 @@ QUERY_RUNS = [
     # ),
 ]
 
-def run_all_models(qrs: list[QueryRun], quiet:bool=True):
+def run_all_models(qrs: list[QueryRun], quiet:bool=True, batch:bool=False):
     for qr in qrs:
         df = pd.read_csv(SAMPLES_PATH / f'{qr.input_file}.csv')
         if qr.head:
@@ -179,7 +180,12 @@ def run_all_models(qrs: list[QueryRun], quiet:bool=True):
         if not quiet:
             print(f'Running query text: {query.text()}')
         
-        bulk_query_on_df(query, df=df, model=qr.model, outfile=outfile_path)
+        bulk_query_on_df(query, df=df, model=qr.model, outfile=outfile_path, use_batch=batch or qr.batch)
 
 if __name__ == '__main__':
-    run_all_models(QUERY_RUNS, quiet=True)
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='Run every QueryRun over its sample file')
+    parser.add_argument('--batch', action='store_true', help='Use the Batch API for every run')
+    args = parser.parse_args()
+
+    run_all_models(QUERY_RUNS, quiet=True, batch=args.batch)
\ No newline at end of file
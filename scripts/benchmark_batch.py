@@ -1,11 +1,13 @@
 import os, sys
 from pathlib import Path
 import json
+import zlib
 import tqdm
 from google import genai
 import geopandas as gpd
 import argparse
-from typing import List
+import concurrent.futures as cf
+from typing import Iterable, List, Optional, Set, Tuple
 
 from dotenv import load_dotenv
 
@@ -13,12 +15,20 @@ from dotenv import load_dotenv
 from streettransformer.config.constants import DATA_PATH, UNIVERSES_PATH, YEARS
 
 #from streettransformer.locations.location import Location # This creates a Location object that holds and converts all of the data for each location
-from streettransformer.llms.run_gemini_model import run_individual_model # Runs a gemini model 
+from streettransformer.llms.run_gemini_model import run_individual_model, RateLimiter, DEFAULT_LIMITER # Runs a gemini model 
 import streettransformer.llms.models.imagery_describers.gemini_imagery_describers as gemini_imagery_describers
 from streettransformer.comparison.compare import get_image_compare_data, get_compare_data_for_location_id_years, show_images_side_by_side
+from streettransformer.locations.universe import Universe
 
 YEARS = [2016, 2024, 2018, 2022, 2020]
 
+# Usage:
+#   python scripts/benchmark_batch.py caprecon_plus_control -o step1.ndjson -w 8 --rpm 60
+#   python scripts/benchmark_batch.py caprecon_plus_control -o step1.ndjson --shard 0/4     (one of 4 processes)
+#
+# Records are keyed by (location_id, start_year, end_year); keys already in the outfile
+# (or any shard's outfile) without an error are skipped, so a killed run just restarts.
+
 def permute_years(years):
         # create all permutations of comparison years 
         permutations = []
@@ -28,6 +38,16 @@ def permute_years(years):
                     permutations.append((y1, y2))
         return permutations
 
+def parse_shard(value:str) -> Tuple[int, int]:
+    """'i/n' -> (i, n), 0 <= i < n"""
+    try:
+        i, n = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'--shard expects i/n, got {value!r}')
+    if not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f'--shard {value}: need 0 <= i < n')
+    return i, n
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('universe_name', type=str)
@@ -35,13 +55,46 @@ def parse_args():
     parser.add_argument('-m', '--model-name', type=str, default='gemini-2.5-flash')
     parser.add_argument('-n', '--top-n', type=int, default=None)
     parser.add_argument('-y', '--years', type=int, nargs='+', default=YEARS)
+    parser.add_argument('-w', '--workers', type=int, default=8, help='Concurrent model calls')
+    parser.add_argument('--rpm', type=int, default=15, help='Requests per minute, shared by all workers (per process)')
+    parser.add_argument('--shard', type=parse_shard, default=(0, 1), help='i/n: only run locations in shard i of n')
     
     args = parser.parse_args()
     
     return args
 
+# ---- Keys, shards, resume ----
+def record_key(location_id, start_year, end_year) -> Tuple[str, int, int]:
+    return (str(location_id), int(start_year), int(end_year))
+
+def in_shard(location_id, shard:Tuple[int, int]) -> bool:
+    """Stable across processes and runs (not Python's salted hash): a location always lands in the same shard."""
+    i, n = shard
+    return zlib.crc32(str(location_id).encode()) % n == i
+
+def shard_outfile(outfile:Path, shard:Tuple[int, int]) -> Path:
+    i, n = shard
+    return outfile if n == 1 else outfile.with_name(f'{outfile.stem}.shard{i}of{n}{outfile.suffix}')
+
+def completed_keys(paths:Iterable[Path]) -> Set[Tuple[str, int, int]]:
+    """Keys with a non-error record in any of `paths`."""
+    done = set()
+    for path in paths:
+        if not path.exists():
+            continue
+        with path.open('r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError: # e.g. a line cut off when the process was killed
+                    continue
+                if 'error' not in rec:
+                    done.add(record_key(rec['location_id'], rec['start_year'], rec['end_year']))
+    return done
+
 def safe_try_and_export_model(locations_gdf:gpd.GeoDataFrame, l_id:int, start_year:int, end_year:int, 
-                              universe_name:str, model_instructions:str, client, model_name): 
+                              universe_name:str, model_instructions:str, client, model_name, universe:Universe=None,
+                              limiter:RateLimiter=DEFAULT_LIMITER): 
     output = {
         'location_id'   : l_id,
         'start_year'    : start_year,
@@ -54,22 +107,53 @@ def safe_try_and_export_model(locations_gdf:gpd.GeoDataFrame, l_id:int, start_ye
             location_id=l_id,
             start_year=start_year, 
             end_year=end_year, 
-            universe_name=universe_name
+            universe_name=universe_name,
+            universe=universe
         )
         output['start_image_path'] = str(compare_images[0])
         output['end_image_path'] = str(compare_images[1])
 
-        response = run_individual_model(model_instructions, files=compare_images, client=client, model_name=model_name)    
+        response = run_individual_model(model_instructions, files=compare_images, client=client, model_name=model_name, limiter=limiter)
         
         output['response'] = response
 
     except Exception as e:
         output['error'] = str(e)
-    finally:
-        results.append(output)
     
     return output
 
+def run_benchmark(tasks:List[Tuple[int, int, int]], locations_gdf:gpd.GeoDataFrame, universe_name:str, model_instructions:str,
+                  client, model_name:str, universe:Universe, outfile:Optional[Path]=None, workers:int=8,
+                  limiter:RateLimiter=DEFAULT_LIMITER) -> dict:
+    """
+    Run (location_id, start_year, end_year) tasks on a thread pool sharing one RateLimiter and one Universe.
+    Only this thread writes the outfile: one line per finished task, flushed as it lands.
+    """
+    counts = {'done': 0, 'errors': 0}
+    # Workers share `universe`: its lock serialises the Location lookups, and loading the tables
+    # here keeps the first tasks from all queueing behind one thread's read
+    universe.locations, universe.imagery_store, universe.document_index, universe.temporal_features
+    f = outfile.open('a', encoding='utf-8') if outfile else None
+    try:
+        with cf.ThreadPoolExecutor(max_workers=workers) as ex:
+            futures = [
+                ex.submit(safe_try_and_export_model, locations_gdf, l_id, start_year, end_year, universe_name,
+                          model_instructions, client, model_name, universe, limiter)
+                for l_id, start_year, end_year in tasks
+            ]
+            for fut in tqdm.tqdm(cf.as_completed(futures), total=len(futures), disable=(f is None)):
+                output = fut.result()
+                counts['errors' if 'error' in output else 'done'] += 1
+                if f:
+                    f.write(json.dumps(output) + '\n')
+                    f.flush()
+                else:
+                    print(output)
+    finally:
+        if f:
+            f.close()
+    return counts
+
 if __name__ == '__main__':
     args = parse_args()
     universe_name = args.universe_name
@@ -86,31 +170,32 @@ if __name__ == '__main__':
     if args.top_n is not None and isinstance(args.top_n, int): 
         locations_gdf = locations_gdf.head(args.top_n) # For subsetting if necessary
 
-    total_locations = locations_gdf.shape[0]
     years = args.years if len(args.years) > 1 else YEARS
-    year_pairs = permute_years(args.years)
+    year_pairs = permute_years(years)
 
-    # Get comparison 
-    results = []
-    total_compares = locations_gdf.shape[0] * len(year_pairs)
+    # Shared tables (documents, features) are loaded once for all locations and year pairs
+    universe = Universe(universe_name, universe_path)
+
+    # 2) Tasks for this shard, minus the ones already done (by any shard)
+    location_ids = [l_id for l_id in locations_gdf['location_id'].tolist() if in_shard(l_id, args.shard)]
+    tasks = [(l_id, start_year, end_year) for l_id in location_ids for start_year, end_year in year_pairs]
+
+    outfile = None
+    if args.outfile:
+        base_outfile = results_path / args.outfile
+        base_outfile.parent.mkdir(parents=True, exist_ok=True)
+        outfile = shard_outfile(base_outfile, args.shard)
+        done = completed_keys([base_outfile, *base_outfile.parent.glob(f'{base_outfile.stem}.shard*of*{base_outfile.suffix}')])
+        tasks = [t for t in tasks if record_key(*t) not in done]
+        print(f'Shard {args.shard[0]}/{args.shard[1]}: {len(tasks)} to run ({len(done)} done) -> {outfile}')
 
     # Model
     load_dotenv()
     os.getenv('GEMINI_API_KEY')
-    gemini_client = genai.Client=genai.Client()
+    gemini_client = genai.Client()
     model_instructions = gemini_imagery_describers.step1_instructions
+    limiter = RateLimiter(max_calls=args.rpm, period=60.0)
 
-    if args.outfile:
-        outfile =  results_path / args.outfile
-        outfile.parent.mkdir(parents=True, exist_ok=True)
-
-    
-    for start_year, end_year in tqdm.tqdm(year_pairs, total=len(year_pairs), disable=(args.outfile is None)):
-        for l_id in tqdm.tqdm(locations_gdf['location_id'], total=locations_gdf.shape[0], desc=f'{start_year} -> {end_year}', disable=(args.outfile is None)):
-            output = safe_try_and_export_model(locations_gdf, l_id, start_year, end_year, universe_name, model_instructions, gemini_client, args.model_name)
-
-            if args.outfile:
-                with outfile.open('a+', encoding='utf-8') as f:
-                    f.write(json.dumps(output) + '\n')
-            else:
-                print(output)
\ No newline at end of file
+    counts = run_benchmark(tasks, locations_gdf, universe_name, model_instructions, gemini_client, args.model_name,
+                           universe, outfile=outfile, workers=args.workers, limiter=limiter)
+    print(counts)
@@ -4,8 +4,6 @@ from pathlib import Path
 import geopandas as gpd
 import os
 import pandas as pd
-import shutil
-import tqdm
 
 # # get all locations for controls
 # locations_caprecon_gdf = gpd.read_feather(UNIVERSES_PATH / 'caprecon3' / 'locations.feather')
@@ -41,6 +39,8 @@ import tqdm
 
 #UNIVERSES_PATH = Path('src/streetTransformer/data/universes/')
 from streettransformer.config.constants import UNIVERSES_PATH
+from streettransformer.modalities.imagery.store import ImageryStore, STORE_DIRNAME
+from st_preprocessing.data_load.load_universe import build_universe_incremental, imagery_stage
 DISABLE_PROGRESS_BAR = False
 
 
@@ -64,17 +64,20 @@ combined_locations_gdf = gpd.read_parquet(UNIVERSES_PATH / COMBINED_UNIVERSE_NAM
 # Combine imagery
 YEARS = list(range(2006, 2025, 2))
 INPUT_UNIVERSES = [ORIGINAL_UNIVERSE_NAME, ADDITIONAL_UNIVERSE_NAME]
-for year in YEARS:
-    # Set the destination dir and create if necessary
-    dest_dir = UNIVERSES_PATH / COMBINED_UNIVERSE_NAME / 'imagery' / str(year)
-    dest_dir.mkdir(parents=True, exist_ok=True)
-
-    for uni in INPUT_UNIVERSES:
-        source_dir = UNIVERSES_PATH / uni / 'imagery' / str(year)
-
-        total_files = len(os.listdir(source_dir))
-        for file in tqdm.tqdm(source_dir.iterdir(), total=total_files, desc=f'Moving {year}-{uni} images', disable=DISABLE_PROGRESS_BAR):
-            if file.is_file() and file.suffix == '.png':
-                shutil.move(file, dest_dir / file.name)
-
 
+# Universes with a packed imagery store are merged chunk-by-chunk (hardlinked; the inputs are left intact)
+combined_store = ImageryStore(UNIVERSES_PATH / COMBINED_UNIVERSE_NAME / STORE_DIRNAME)
+for uni in INPUT_UNIVERSES:
+    store = ImageryStore.for_universe(UNIVERSES_PATH / uni)
+    if store is not None:
+        n = combined_store.merge_from(store, [str(y) for y in YEARS])
+        print(f'Merged {n} images from the {uni} imagery store')
+
+# Everything else goes through the universe manifests: images merged into the combined store above
+# count as built, loose PNGs the inputs already built for the same location are hardlinked (not
+# moved), and only locations missing from both are fetched. The inputs are never written to.
+stages = [imagery_stage(YEARS, zoom=20, radius=1, quiet=DISABLE_PROGRESS_BAR)]
+build_universe_incremental(
+    UNIVERSES_PATH / COMBINED_UNIVERSE_NAME, combined_locations_gdf, stages,
+    sources=[UNIVERSES_PATH / uni for uni in INPUT_UNIVERSES]
+)
@@ -0,0 +1,293 @@
+# Local stand-in for the OpenAI Chat Completions endpoint, for exercising the LLM runners without spending quota.
+#
+#   python scripts/mock_openai_server.py --port 8766 --rpm 500 --tpm 200000
+#   python scripts/mock_openai_server.py --rpm 600 --tpm 400000 --run-bulk 500     (serve + run the async runner against itself)
+#   python scripts/mock_openai_server.py --run-batch 200 --batch-failure-rate 0.1   (serve + run the Batch API runner)
+#
+# Serves `POST /v1/chat/completions` with a JSON-object reply and `usage`. Enforces requests- and tokens-per-window
+# limits like the real API: `x-ratelimit-*` headers on every response and 429s (with Retry-After) when over.
+# Latency grows with the number of requests in flight, so pushing concurrency too far also shows up as slowness.
+#
+# Also serves the Batch API subset the batch runner uses: `POST /v1/files`, `GET /v1/files/{id}/content`,
+# `POST /v1/batches`, `GET /v1/batches/{id}`. Batches complete after `--batch-delay` seconds, with
+# `--batch-failure-rate` of their requests landing in the error file as 500s.
+import argparse
+import json
+import random
+import threading
+import time
+import tempfile
+import itertools
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+class WindowLimits:
+    """Fixed-window request and token counters (the window is a minute on the real API)."""
+    def __init__(self, rpm: int, tpm: int, window: float):
+        self.rpm, self.tpm, self.window = rpm, tpm, window
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.requests = self.tokens = 0
+        self.inflight = 0
+        self.stats = {'ok': 0, 'throttled': 0}
+
+    def _roll(self, now):
+        if now - self.start >= self.window:
+            self.start, self.requests, self.tokens = now, 0, 0
+
+    def admit(self, tokens: int):
+        """(admitted, headers)"""
+        with self.lock:
+            now = time.monotonic()
+            self._roll(now)
+            ok = self.requests + 1 <= self.rpm and self.tokens + tokens <= self.tpm
+            if ok:
+                self.requests += 1
+                self.tokens += tokens
+                self.stats['ok'] += 1
+            else:
+                self.stats['throttled'] += 1
+            reset = max(0.0, self.window - (now - self.start))
+            headers = {
+                'x-ratelimit-limit-requests': str(self.rpm),
+                'x-ratelimit-limit-tokens': str(self.tpm),
+                'x-ratelimit-remaining-requests': str(max(0, self.rpm - self.requests)),
+                'x-ratelimit-remaining-tokens': str(max(0, self.tpm - self.tokens)),
+                'x-ratelimit-reset-requests': f'{reset:.3f}s',
+                'x-ratelimit-reset-tokens': f'{reset:.3f}s',
+            }
+            if not ok:
+                headers['retry-after'] = f'{reset:.3f}'
+            return ok, headers
+
+
+def estimate_prompt_tokens(body: dict) -> int:
+    tokens = 0
+    for message in body.get('messages', []):
+        content = message.get('content', '')
+        parts = content if isinstance(content, list) else [{'type': 'text', 'text': content}]
+        for part in parts:
+            tokens += len(part.get('text', '')) // 4 if part.get('type') == 'text' else 765
+    return tokens
+
+
+def completion(body: dict, prompt_tokens: int, completion_tokens: int) -> dict:
+    return {
+        'id': f'chatcmpl-mock-{random.getrandbits(48):x}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'mock'),
+        'choices': [{
+            'index': 0,
+            'finish_reason': 'stop',
+            'message': {'role': 'assistant', 'content': json.dumps({'mock': True, 'n_messages': len(body.get('messages', []))})},
+        }],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens},
+    }
+
+
+class BatchStore:
+    """In-memory files and batches; each batch is worked off in a background thread."""
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.files = {}
+        self.batches = {}
+        self._ids = itertools.count()
+
+    def new_id(self, prefix):
+        return f'{prefix}-mock{next(self._ids):06d}'
+
+    def add_file(self, data: bytes, filename: str = 'upload.jsonl', purpose: str = 'batch') -> dict:
+        file_id = self.new_id('file')
+        with self.lock:
+            self.files[file_id] = data
+        return {'id': file_id, 'object': 'file', 'bytes': len(data), 'created_at': int(time.time()),
+                'filename': filename, 'purpose': purpose, 'status': 'processed'}
+
+    def create_batch(self, body: dict) -> dict:
+        batch = {
+            'id': self.new_id('batch'), 'object': 'batch', 'endpoint': body.get('endpoint'),
+            'input_file_id': body['input_file_id'], 'completion_window': body.get('completion_window', '24h'),
+            'status': 'validating', 'created_at': int(time.time()), 'metadata': body.get('metadata'),
+            'output_file_id': None, 'error_file_id': None, 'errors': None,
+            'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+        }
+        with self.lock:
+            self.batches[batch['id']] = batch
+        threading.Thread(target=self._work, args=(batch['id'],), daemon=True).start()
+        return batch
+
+    def _work(self, batch_id):
+        time.sleep(self.args.batch_delay / 2)
+        with self.lock:
+            batch = self.batches[batch_id]
+            batch['status'] = 'in_progress'
+            lines = self.files[batch['input_file_id']].decode().splitlines()
+        time.sleep(self.args.batch_delay / 2)
+
+        outputs, errors = [], []
+        for line in filter(str.strip, lines):
+            req = json.loads(line)
+            rec = {'id': self.new_id('batch_req'), 'custom_id': req['custom_id'], 'error': None}
+            if random.random() < self.args.batch_failure_rate:
+                rec['response'] = {'status_code': 500, 'body': {'error': {'message': 'mock server error'}}}
+                errors.append(rec)
+            else:
+                prompt_tokens = estimate_prompt_tokens(req['body'])
+                rec['response'] = {'status_code': 200, 'request_id': rec['id'],
+                                   'body': completion(req['body'], prompt_tokens, self.args.completion_tokens)}
+                outputs.append(rec)
+
+        as_file = lambda recs: self.add_file(''.join(json.dumps(r) + '\n' for r in recs).encode(), purpose='batch_output')['id']
+        output_file_id = as_file(outputs) if outputs else None
+        error_file_id = as_file(errors) if errors else None
+        with self.lock:
+            batch.update({'status': 'completed', 'completed_at': int(time.time()),
+                          'output_file_id': output_file_id, 'error_file_id': error_file_id,
+                          'request_counts': {'total': len(outputs) + len(errors), 'completed': len(outputs), 'failed': len(errors)}})
+
+
+def make_handler(args, limits: WindowLimits, store: BatchStore):
+    class ChatHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *a):
+            pass
+
+        def _send(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_bytes(self, data: bytes):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            parts = self.path.split('?')[0].strip('/').split('/')  # v1/files/{id}/content, v1/batches/{id}
+            with store.lock:
+                if parts[1:2] == ['files'] and parts[3:] == ['content'] and parts[2] in store.files:
+                    return self._send_bytes(store.files[parts[2]])
+                if parts[1:2] == ['batches'] and len(parts) == 3 and parts[2] in store.batches:
+                    return self._send(200, dict(store.batches[parts[2]]))
+            self._send(404, {'error': {'message': f'unknown path {self.path}'}})
+
+        def _upload(self, raw: bytes):
+            msg = BytesParser(policy=HTTP).parsebytes(
+                b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + raw)
+            fields = {part.get_param('name', header='content-disposition'): part for part in msg.iter_parts()}
+            file_part = fields['file']
+            self._send(200, store.add_file(file_part.get_payload(decode=True), file_part.get_filename() or 'upload.jsonl',
+                                           fields['purpose'].get_payload(decode=True).decode()))
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            path = self.path.split('?')[0].rstrip('/')
+            if path.endswith('/files'):
+                return self._upload(raw)
+            if path.endswith('/batches'):
+                return self._send(200, store.create_batch(json.loads(raw)))
+            if not path.endswith('/chat/completions'):
+                return self._send(404, {'error': {'message': f'unknown path {self.path}'}})
+            body = json.loads(raw or b'{}')
+            prompt_tokens = estimate_prompt_tokens(body)
+            completion_tokens = args.completion_tokens
+
+            ok, headers = limits.admit(prompt_tokens + completion_tokens)
+            if not ok:
+                return self._send(429, {'error': {'message': 'Rate limit reached (mock)', 'type': 'requests', 'code': 'rate_limit_exceeded'}}, headers)
+
+            with limits.lock:
+                limits.inflight += 1
+                inflight = limits.inflight
+            try:
+                time.sleep(args.latency + args.latency_per_inflight * inflight)
+                if random.random() < args.error_rate:
+                    return self._send(500, {'error': {'message': 'mock server error'}}, headers)
+                self._send(200, completion(body, prompt_tokens, completion_tokens), headers)
+            finally:
+                with limits.lock:
+                    limits.inflight -= 1
+
+    return ChatHandler
+
+
+def run_bulk(port: int, n_items: int, max_concurrency: int):
+    from streettransformer.llms.oai3 import WorkItem
+    from streettransformer.llms.async_runner import AsyncBulkRunner, AsyncRunConfig
+
+    schema = [None, {'type': 'object', 'properties': {'mock': {'type': 'boolean'}}}]
+    items = [WorkItem(item_id=str(i), prompt=f'mock prompt {i} ' + 'x' * 2000, json_schema=schema) for i in range(n_items)]
+    out = Path(tempfile.mkdtemp()) / 'out.ndjson'
+
+    runner = AsyncBulkRunner(model='mock', config=AsyncRunConfig(max_concurrency=max_concurrency),
+                             base_url=f'http://127.0.0.1:{port}/v1', api_key='mock', use_cache=False)
+    t0 = time.perf_counter()
+    counts = runner.run(items, out, query_name='mock')
+    dt = time.perf_counter() - t0
+    print(f'{counts} in {dt:.1f}s ({n_items / dt:.1f} req/s)')
+
+
+def run_batch(port: int, n_items: int, poll_interval: float, max_requests: int):
+    from streettransformer.llms.oai3 import WorkItem
+    from streettransformer.llms.batch_runner import OpenAIBatchTransport, run_batch
+
+    schema = [None, {'type': 'object', 'properties': {'mock': {'type': 'boolean'}}}]
+    items = [WorkItem(item_id=str(i), prompt=f'mock prompt {i}', json_schema=schema) for i in range(n_items)]
+    out = Path(tempfile.mkdtemp()) / 'out.ndjson'
+
+    transport = OpenAIBatchTransport(base_url=f'http://127.0.0.1:{port}/v1', api_key='mock')
+    t0 = time.perf_counter()
+    counts = run_batch(items, out, model='mock', query_name='mock', transport=transport,
+                       poll_interval=poll_interval, max_requests=max_requests, use_cache=False)
+    ids = [json.loads(line)['item_id'] for line in out.open()]
+    print(f'{counts} in {time.perf_counter() - t0:.1f}s; {len(set(ids))}/{n_items} items in {out} ({len(ids)} records)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock OpenAI Chat Completions server with rate limits')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--rpm', type=int, default=500, help='Requests per window')
+    parser.add_argument('--tpm', type=int, default=200_000, help='Tokens per window')
+    parser.add_argument('--window', type=float, default=60.0, help='Rate-limit window in seconds (shorten for quick tests)')
+    parser.add_argument('--latency', type=float, default=0.2, help='Base response latency (s)')
+    parser.add_argument('--latency-per-inflight', type=float, default=0.01, help='Extra latency per concurrent request (s)')
+    parser.add_argument('--completion-tokens', type=int, default=50)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of admitted requests answered with a 500')
+    parser.add_argument('--run-bulk', type=int, default=0, help='Serve in the background and run the async runner on N items')
+    parser.add_argument('--max-concurrency', type=int, default=64)
+    parser.add_argument('--batch-delay', type=float, default=2.0, help='Seconds until a submitted batch completes')
+    parser.add_argument('--batch-failure-rate', type=float, default=0.0, help='Fraction of batch requests that fail with a 500')
+    parser.add_argument('--run-batch', type=int, default=0, help='Serve in the background and run the batch runner on N items')
+    parser.add_argument('--batch-max-requests', type=int, default=100, help='Requests per batch file for --run-batch')
+    args = parser.parse_args()
+
+    limits = WindowLimits(args.rpm, args.tpm, args.window)
+    store = BatchStore(args)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(args, limits, store))
+    server.daemon_threads = True
+
+    if args.run_bulk or args.run_batch:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        if args.run_bulk:
+            run_bulk(args.port, args.run_bulk, args.max_concurrency)
+            print(f'server: {limits.stats}')
+        if args.run_batch:
+            run_batch(args.port, args.run_batch, poll_interval=args.batch_delay / 4, max_requests=args.batch_max_requests)
+        server.shutdown()
+    else:
+        print(f'Mock OpenAI server on http://127.0.0.1:{args.port}/v1 (rpm={args.rpm}, tpm={args.tpm}, window={args.window}s)')
+        server.serve_forever()
@@ -0,0 +1,104 @@
+# Local stand-in for the ArcGIS tile endpoint, for exercising the async fetcher without hitting the city's servers.
+#
+#   uv run scripts/tile_server_standin.py --port 8765 --throttle-every 20 --error-rate 0.05
+#   uv run scripts/tile_server_standin.py --port 8765 --run-fetch 2000     (serve + fetch 2000 tiles against itself)
+#
+# Serves `/tile/{z}/{y}/{x}` as a small solid-colour PNG. Can inject latency, 429s (with Retry-After) and 5xx errors.
+import argparse
+import random
+import struct
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import tempfile
+
+
+@lru_cache(maxsize=4096)
+def _solid_png(rgb, size=256) -> bytes:
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    row = b'\x00' + bytes(rgb) * size
+    raw = zlib.compress(row * size)
+    ihdr = struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) + chunk(b'IDAT', raw) + chunk(b'IEND', b'')
+
+
+def make_handler(args):
+    counter = {'n': 0}
+    lock = threading.Lock()
+
+    class TileHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, *a):
+            pass
+
+        def _send(self, status, body=b'', headers=None):
+            self.send_response(status)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parts = self.path.strip('/').split('/')
+            if len(parts) < 4 or parts[-4] != 'tile':
+                return self._send(404)
+            z, y, x = (int(p) for p in parts[-3:])
+
+            with lock:
+                counter['n'] += 1
+                n = counter['n']
+            if args.latency:
+                time.sleep(random.uniform(0, args.latency))
+            if args.throttle_every and n % args.throttle_every == 0:
+                return self._send(429, headers={'Retry-After': str(args.retry_after)})
+            if random.random() < args.error_rate:
+                return self._send(503)
+
+            rgb = ((x * 37) % 256, (y * 59) % 256, (z * 11) % 256)
+            self._send(200, _solid_png(rgb, args.tile_size), {'Content-Type': 'image/png'})
+
+    return TileHandler
+
+
+def run_fetch(port: int, n_tiles: int, concurrency: int):
+    from st_preprocessing.imagery.fetch import AsyncTileFetcher, FetchConfig
+    from st_preprocessing.imagery.tile_cache import TileCache, TileKey
+
+    side = int(n_tiles ** 0.5) + 1
+    keys = [TileKey('standin', 2024, 20, 300000 + i, 385000 + j) for i in range(side) for j in range(side)][:n_tiles]
+    jobs = ((k, f'http://127.0.0.1:{port}/tile/{k.z}/{k.y}/{k.x}') for k in keys)
+
+    with TileCache(Path(tempfile.mkdtemp()) / 'cache') as cache:
+        t0 = time.perf_counter()
+        counts = AsyncTileFetcher(FetchConfig(max_concurrency=concurrency, per_host_rps=10_000, http2=False)).fetch_all(jobs, cache.put)
+        dt = time.perf_counter() - t0
+        print(f'{counts} in {dt:.2f}s ({counts["fetched"] / dt:.0f} tiles/s); cached: {len(cache)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the NYC Orthos tile server.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--tile-size', type=int, default=256)
+    parser.add_argument('--latency', type=float, default=0.0, help='Max random latency per request (s)')
+    parser.add_argument('--throttle-every', type=int, default=0, help='Answer every Nth request with 429')
+    parser.add_argument('--retry-after', type=float, default=0.2)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    parser.add_argument('--run-fetch', type=int, default=0, help='Fetch N tiles against this server, print counts and exit')
+    parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(args))
+    if args.run_fetch:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        run_fetch(args.port, args.run_fetch, args.concurrency)
+        server.shutdown()
+    else:
+        print(f'Serving stand-in tiles on http://127.0.0.1:{args.port}/tile/{{z}}/{{y}}/{{x}}')
+        server.serve_forever()
@@ -1,32 +1,29 @@
 from pathlib import Path
+from typing import Optional
 import sys
 
 import geopandas as gpd
 
 # Local imports
-from ..locations.location import Location
+from ..locations.universe import Universe, get_universe
 
-def get_compare_data_for_location_id_years(locations_gdf: gpd.GeoDataFrame, location_id:int, start_year:int|str, end_year:int|str, universe_name:str):
-    print('here')
+def get_compare_data_for_location_id_years(locations_gdf: gpd.GeoDataFrame, location_id:int, start_year:int|str, end_year:int|str, universe_name:str, universe:Optional[Universe]=None):
+    # Locations come from the (shared) Universe, so its tables are only read once per process
+    universe = universe or get_universe(universe_name)
     row = locations_gdf[locations_gdf['location_id'] == location_id].iloc[0].T.to_dict()
-    
-    print(row)
 
-    temp_location = Location(
+    location = universe.location(
         location_id=row['location_id'],
-        universe_name=universe_name,
         crossstreets=row['crossstreets'],
         centroid=row['geometry']
     )
-    print('now here')
-    
     
     # Comparison
-    comparison = temp_location.compare_years(start_year, end_year)
+    comparison = location.compare_years(start_year, end_year)
     return comparison
 
-def get_image_compare_data(locations_gdf: gpd.GeoDataFrame, location_id:int, start_year:int|str, end_year:int|str, universe_name:str):
-    compare_data = get_compare_data_for_location_id_years(locations_gdf, location_id, start_year, end_year, universe_name)
+def get_image_compare_data(locations_gdf: gpd.GeoDataFrame, location_id:int, start_year:int|str, end_year:int|str, universe_name:str, universe:Optional[Universe]=None):
+    compare_data = get_compare_data_for_location_id_years(locations_gdf, location_id, start_year, end_year, universe_name, universe)
     compare_images_list = [
         Path(compare_data['state']['before']['image']),
         Path(compare_data['state']['after']['image'])
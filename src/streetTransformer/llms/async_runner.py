@@ -0,0 +1,318 @@
+"""
+Async OpenAI runner with token-aware, adaptive concurrency.
+
+`oai3.run_bulk` caps in-flight requests at a fixed `max_inflight` (default 2), which
+leaves most of the account's rate limit unused. This runner instead:
+    - keeps a requests-per-minute and tokens-per-minute budget, seeded and corrected
+      from the `x-ratelimit-*` response headers and each response's `usage`, and
+      waits for the window to reset instead of sending requests that would 429
+    - adapts concurrency AIMD-style: +1 slot per window of successful requests,
+      halved on a 429 (at most once per cooldown), shrunk gently when latency
+      rises above a target
+    - shares the response and payload caches with the threaded runner
+
+Try it against the local mock server:
+    python scripts/mock_openai_server.py --rpm 600 --tpm 400000 --run-bulk 500
+"""
+from __future__ import annotations
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional
+
+from openai import AsyncOpenAI, APIStatusError, APITimeoutError, APIConnectionError, RateLimitError
+from tqdm import tqdm
+
+from .oai3 import WorkItem, DEFAULT_MODEL, TIMEOUT_S, MAX_FILES_PER_ITEM, build_messages, extract_json, render_params
+from .response_cache import ResponseCache, response_key
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Config
+# -----------------------------------------------------------------------------
+@dataclass
+class AsyncRunConfig:
+    initial_concurrency: int = 4
+    min_concurrency: int = 1
+    max_concurrency: int = 64
+    additive_increase: float = 1.0      # slots added per `limit` successes (~ +1 per round trip)
+    decrease_factor: float = 0.5        # multiplicative decrease on a 429
+    decrease_cooldown: float = 2.0      # seconds between decreases (one burst of 429s = one decrease)
+    latency_target: float = 30.0        # seconds; slower responses shrink concurrency by 10%
+    max_retries: int = 6
+    backoff_base: float = 1.0
+    backoff_max: float = 60.0
+    timeout: float = TIMEOUT_S
+    tokens_per_image: int = 765         # a high-detail 1024px image
+    output_tokens_estimate: int = 600
+
+
+# -----------------------------------------------------------------------------
+# Rate-limit budget
+# -----------------------------------------------------------------------------
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """'6m0s' / '1.5s' / '120ms' -> seconds."""
+    if not value:
+        return None
+    parts = _DURATION.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(n) * _UNITS[u] for n, u in parts)
+
+
+class RateBudget:
+    """
+    Requests and tokens left in the current rate-limit windows. Unknown until the first
+    response; afterwards every response's headers overwrite the local estimate.
+    """
+    def __init__(self):
+        self.limit = {'requests': None, 'tokens': None}
+        self.remaining = {'requests': None, 'tokens': None}
+        self.reset_at = {'requests': 0.0, 'tokens': 0.0}
+        self._lock = asyncio.Lock()
+
+    def update(self, headers) -> None:
+        now = time.monotonic()
+        for kind in ('requests', 'tokens'):
+            limit = headers.get(f'x-ratelimit-limit-{kind}')
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+            reset = parse_reset(headers.get(f'x-ratelimit-reset-{kind}'))
+            if limit is not None:
+                self.limit[kind] = int(float(limit))
+            if remaining is not None:
+                self.remaining[kind] = int(float(remaining))
+            if reset is not None:
+                self.reset_at[kind] = now + reset
+
+    async def reserve(self, tokens: int) -> None:
+        """Wait until one request and `tokens` tokens fit in the current windows, then take them."""
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                for kind in ('requests', 'tokens'):
+                    if self.limit[kind] is not None and now >= self.reset_at[kind]:
+                        self.remaining[kind] = self.limit[kind]
+                need = {'requests': 1, 'tokens': min(tokens, self.limit['tokens'] or tokens)}
+                short = [k for k in need if self.remaining[k] is not None and self.remaining[k] < need[k]]
+                if not short:
+                    for kind in need:
+                        if self.remaining[kind] is not None:
+                            self.remaining[kind] -= need[kind]
+                    return
+                wait = max(0.05, min(self.reset_at[k] for k in short) - now)
+            await asyncio.sleep(wait)
+
+
+# -----------------------------------------------------------------------------
+# Adaptive concurrency
+# -----------------------------------------------------------------------------
+class AIMDLimiter:
+    """Concurrency limit that grows additively on success and shrinks multiplicatively on 429s."""
+    def __init__(self, cfg: AsyncRunConfig):
+        self.cfg = cfg
+        self.limit = float(cfg.initial_concurrency)
+        self.inflight = 0
+        self.peak = self.limit
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+
+    async def release(self) -> None:
+        async with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+
+    async def on_success(self, latency: float) -> None:
+        async with self._cond:
+            if latency > self.cfg.latency_target:
+                self.limit = max(self.cfg.min_concurrency, self.limit * 0.9)
+            else:
+                self.limit = min(self.cfg.max_concurrency, self.limit + self.cfg.additive_increase / self.limit)
+            self.peak = max(self.peak, self.limit)
+            self._cond.notify_all()
+
+    async def on_throttle(self) -> None:
+        async with self._cond:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cfg.decrease_cooldown:
+                self.limit = max(self.cfg.min_concurrency, self.limit * self.cfg.decrease_factor)
+                self._last_decrease = now
+
+
+# -----------------------------------------------------------------------------
+# Runner
+# -----------------------------------------------------------------------------
+def _run_blocking(coro):
+    """`asyncio.run`, or on a helper thread when this thread already runs a loop (Jupyter)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        return ex.submit(asyncio.run, coro).result()
+
+
+def estimate_tokens(messages: list[dict[str, Any]], cfg: AsyncRunConfig) -> int:
+    text, images = 0, 0
+    for message in messages:
+        for part in message['content']:
+            if part['type'] == 'text':
+                text += len(part['text'])
+            elif part['type'] == 'image_url':
+                images += 1
+    return text // 4 + images * cfg.tokens_per_image + cfg.output_tokens_estimate
+
+
+class AsyncBulkRunner:
+    """
+    Usage:
+        runner = AsyncBulkRunner(model='gpt-4o', config=AsyncRunConfig(max_concurrency=32))
+        counts = runner.run(items, Path('out.ndjson'))
+    """
+    def __init__(self, model: str = DEFAULT_MODEL, config: Optional[AsyncRunConfig] = None,
+                 base_url: Optional[str] = None, api_key: Optional[str] = None,
+                 cache: Optional[ResponseCache] = None, use_cache: bool = True):
+        self.model = model
+        self.config = config or AsyncRunConfig()
+        self.base_url = base_url
+        self.api_key = api_key
+        self.cache = (cache or ResponseCache()) if use_cache else None
+        self.token_ratio = 1.0 # EWMA of actual / estimated tokens
+        self.counts: Dict[str, int] = {}
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.config.backoff_max, self.config.backoff_base * (2 ** attempt)))
+
+    async def _call(self, client: AsyncOpenAI, budget: RateBudget, limiter: AIMDLimiter,
+                    messages: list[dict[str, Any]], w: WorkItem) -> dict[str, Any]:
+        cfg = self.config
+        estimate = int(estimate_tokens(messages, cfg) * self.token_ratio)
+        for attempt in range(cfg.max_retries + 1):
+            await limiter.acquire() # slot first: a budget reservation is only spent by a request that can go now
+            await budget.reserve(estimate)
+            start, wait = time.monotonic(), None
+            try:
+                raw = await client.chat.completions.with_raw_response.create(
+                    model=self.model,
+                    messages=messages,
+                    timeout=cfg.timeout,
+                    response_format={
+                        "type": "json_schema",
+                        "json_schema": {"name": "output_name", "schema": w.json_schema[1]},
+                    },
+                )
+                budget.update(raw.headers)
+                resp = raw.parse().to_dict()
+                await limiter.on_success(time.monotonic() - start)
+
+                used = (resp.get('usage') or {}).get('total_tokens')
+                if used:
+                    self.token_ratio = 0.8 * self.token_ratio + 0.2 * (used / max(1, estimate / self.token_ratio))
+                return resp
+            except RateLimitError as e:
+                self.counts['throttled'] += 1
+                budget.update(e.response.headers)
+                await limiter.on_throttle()
+                if attempt == cfg.max_retries:
+                    raise
+                wait = parse_reset(e.response.headers.get('retry-after'))
+                wait = wait if wait is not None else self._backoff(attempt)
+            except (APITimeoutError, APIConnectionError, APIStatusError) as e:
+                status = getattr(e, 'status_code', None)
+                if attempt == cfg.max_retries or (status is not None and status < 500 and status != 408):
+                    raise
+                self.counts['retries'] += 1
+                wait = self._backoff(attempt)
+            finally:
+                await limiter.release()
+            await asyncio.sleep(wait) # outside the slot, so backing off doesn't hold concurrency
+
+    async def _process(self, client, budget, limiter, w: WorkItem) -> dict[str, Any]:
+        key = resp = None
+        if self.cache is not None:
+            key = response_key(self.model, w.prompt, w.json_schema, w.files[:MAX_FILES_PER_ITEM], render_params())
+            resp = await asyncio.to_thread(self.cache.get, key)
+        cached = resp is not None
+        if not cached:
+            messages = await asyncio.to_thread(build_messages, w.prompt, w.files) # decode/encode off the loop
+            resp = await self._call(client, budget, limiter, messages, w)
+
+        output = extract_json(resp)
+        if self.cache is not None and not cached:
+            await asyncio.to_thread(self.cache.put, key, resp, self.model)
+        return {"item_id": w.item_id, "model": self.model, "output_text": output, "raw_response": resp, "cached": cached}
+
+    async def _run(self, work: list[WorkItem], out_ndjson: Path, desc: str) -> Dict[str, Any]:
+        cfg = self.config
+        self.counts = {'done': 0, 'errors': 0, 'cached': 0, 'throttled': 0, 'retries': 0}
+        budget, limiter = RateBudget(), AIMDLimiter(cfg)
+        work_iter = iter(work)
+        pbar = tqdm(total=len(work), desc=desc)
+
+        async with AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0) as client:
+            with out_ndjson.open("a", encoding="utf-8") as f:
+                async def worker():
+                    for w in work_iter: # shared iterator; the limiter decides how many actually run
+                        try:
+                            rec = await self._process(client, budget, limiter, w)
+                            self.counts['cached'] += rec['cached']
+                        except Exception as e:
+                            rec = {"item_id": w.item_id, "error": str(e)}
+                            self.counts['errors'] += 1
+                        f.write(json.dumps(rec, ensure_ascii=False) + "\n") # single thread: no lock needed
+                        f.flush()
+                        self.counts['done'] += 1
+                        pbar.update(1)
+                        pbar.set_postfix(concurrency=int(limiter.limit), refresh=False)
+
+                await asyncio.gather(*(worker() for _ in range(cfg.max_concurrency)))
+        pbar.close()
+        return {**self.counts, 'final_concurrency': round(limiter.limit, 1), 'peak_concurrency': round(limiter.peak, 1)}
+
+    def run(self, items: Iterable[WorkItem], out_ndjson: Path, query_name: str = '') -> Dict[str, Any]:
+        """Process every item not already in `out_ndjson` (resumes like `oai3.run_bulk`). Blocking."""
+        out_ndjson.parent.mkdir(parents=True, exist_ok=True)
+        done_ids: set[str] = set()
+        if out_ndjson.exists():
+            with out_ndjson.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                        if "item_id" in rec and "error" not in rec:
+                            done_ids.add(str(rec["item_id"]))
+                    except json.JSONDecodeError:
+                        pass
+
+        work = [w for w in items if w.item_id not in done_ids]
+        if not work:
+            print("Nothing to do; everything is already processed.")
+            return {}
+        return _run_blocking(self._run(work, out_ndjson, desc=f"Processing {query_name}"))
+
+
+def run_bulk_async(items: Iterable[WorkItem], out_ndjson: Path, model: str = DEFAULT_MODEL, query_name: str = '',
+                   config: Optional[AsyncRunConfig] = None, base_url: Optional[str] = None,
+                   use_cache: bool = True) -> Dict[str, Any]:
+    """Drop-in async counterpart of `oai3.run_bulk`."""
+    runner = AsyncBulkRunner(model=model, config=config, base_url=base_url, use_cache=use_cache)
+    counts = runner.run(items, out_ndjson, query_name=query_name)
+    if counts:
+        print(f"[{query_name}] {counts}")
+    return counts
@@ -0,0 +1,333 @@
+"""
+OpenAI Batch API mode for bulk queries.
+
+Instead of one chat-completions call per item, the work is written to JSONL
+request files (split to stay under the API's per-file request and byte limits),
+uploaded and submitted as batches, polled, and the output/error files are
+merged into the same NDJSON records `oai3.run_bulk` writes, keyed by `item_id`.
+Items that failed with a retryable error (429, 5xx, expired or cancelled
+batches, unparseable output) are resubmitted in a new round, up to
+`max_resubmits` times; the rest are written as error records.
+
+Submitted batch ids are kept next to the outfile (`<outfile>.batches.json`), so
+an interrupted run picks up its in-flight batches instead of paying twice.
+
+The HTTP layer is a `BatchTransport`; the default talks to the OpenAI SDK and
+can be pointed at `scripts/mock_openai_server.py` with `base_url`.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import OpenAI
+
+from .oai3 import WorkItem, DEFAULT_MODEL, MAX_FILES_PER_ITEM, build_messages, extract_json, render_params
+from .response_cache import ResponseCache, response_key
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_MAX_REQUESTS = 50_000
+BATCH_MAX_BYTES = 190 * 1024 * 1024   # API limit is 200 MB per input file
+POLL_INTERVAL_S = 30
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# -----------------------------------------------------------------------------
+# Transport
+# -----------------------------------------------------------------------------
+class BatchTransport:
+    """Everything the batch runner needs from the API. Batches are plain dicts (id, status, *_file_id, request_counts)."""
+    def upload(self, path: Path) -> str:
+        raise NotImplementedError
+
+    def create(self, input_file_id: str, metadata: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def download(self, file_id: str) -> bytes:
+        raise NotImplementedError
+
+
+class OpenAIBatchTransport(BatchTransport):
+    """
+    Usage:
+        transport = OpenAIBatchTransport()                                     # api.openai.com
+        transport = OpenAIBatchTransport(base_url='http://127.0.0.1:8766/v1')  # local mock server
+    """
+    def __init__(self, client: Optional[OpenAI] = None, base_url: Optional[str] = None, api_key: Optional[str] = None):
+        self.client = client or OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"), base_url=base_url)
+
+    def upload(self, path: Path) -> str:
+        with open(path, "rb") as f:
+            return self.client.files.create(file=f, purpose="batch").id
+
+    def create(self, input_file_id: str, metadata: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        return self.client.batches.create(
+            input_file_id=input_file_id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+            metadata=metadata,
+        ).to_dict()
+
+    def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        return self.client.batches.retrieve(batch_id).to_dict()
+
+    def download(self, file_id: str) -> bytes:
+        return self.client.files.content(file_id).content
+
+# -----------------------------------------------------------------------------
+# Request files
+# -----------------------------------------------------------------------------
+def batch_request(model: str, w: WorkItem, messages: list[dict[str, Any]]) -> dict[str, Any]:
+    """One JSONL line: the same body `safe_chat_with_retries` sends, tagged with the item id."""
+    return {
+        "custom_id": w.item_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": model,
+            "messages": messages,
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "output_name", "schema": w.json_schema[1]},
+            },
+        },
+    }
+
+
+def _request_lines(model: str, work: List[WorkItem], workers: int, chunk: int = 64) -> Iterator[Tuple[str, bytes]]:
+    """(item_id, encoded line), building messages in parallel a chunk at a time to bound memory."""
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        for i in range(0, len(work), chunk):
+            part = work[i:i + chunk]
+            for w, messages in zip(part, ex.map(lambda w: build_messages(w.prompt, w.files), part)):
+                yield w.item_id, (json.dumps(batch_request(model, w, messages), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def write_request_files(model: str, work: List[WorkItem], work_dir: Path, prefix: str,
+                        max_requests: int = BATCH_MAX_REQUESTS, max_bytes: int = BATCH_MAX_BYTES,
+                        workers: int = 8) -> List[Tuple[Path, List[str]]]:
+    """Write `work` as one or more request files, each under the per-batch limits. Returns [(path, item_ids)]."""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    files: List[Tuple[Path, List[str]]] = []
+    f, size, ids = None, 0, []
+
+    def close():
+        if f is not None:
+            f.close()
+            files.append((path, ids))
+
+    for item_id, line in _request_lines(model, work, workers):
+        if f is None or len(ids) >= max_requests or (ids and size + len(line) > max_bytes):
+            close()
+            path = work_dir / f"{prefix}-{len(files):03d}.jsonl"
+            f, size, ids = path.open("wb"), 0, []
+        f.write(line)
+        size += len(line)
+        ids.append(item_id)
+    close()
+    return files
+
+# -----------------------------------------------------------------------------
+# Results
+# -----------------------------------------------------------------------------
+def _retryable(status: Optional[int]) -> bool:
+    return status is None or status in (408, 429) or status >= 500
+
+
+def parse_result_line(rec: dict[str, Any]) -> Tuple[str, Optional[dict[str, Any]], Optional[str], bool]:
+    """Output/error file line -> (item_id, response or None, error or None, retryable)."""
+    item_id = str(rec.get("custom_id"))
+    response = rec.get("response") or {}
+    status = response.get("status_code")
+    if rec.get("error"):
+        err = rec["error"]
+        return item_id, None, f"{err.get('code')}: {err.get('message')}", _retryable(status)
+    if status != 200:
+        body = response.get("body") or {}
+        message = (body.get("error") or {}).get("message", body)
+        return item_id, None, f"HTTP {status}: {message}", _retryable(status)
+    return item_id, response["body"], None, False
+
+
+class BatchRunState:
+    """Submitted batches for one outfile, persisted as `<outfile>.batches.json`."""
+    def __init__(self, path: Path):
+        self.path = path
+        self.batches: List[Dict[str, Any]] = []
+        if path.exists():
+            self.batches = json.loads(path.read_text())["batches"]
+
+    def pending(self) -> List[Dict[str, Any]]:
+        return [b for b in self.batches if not b.get("merged")]
+
+    def save(self) -> None:
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"batches": self.batches}, indent=1))
+        os.replace(tmp_path, self.path)
+
+# -----------------------------------------------------------------------------
+# Runner
+# -----------------------------------------------------------------------------
+def _done_ids(out_ndjson: Path) -> set[str]:
+    done: set[str] = set()
+    if out_ndjson.exists():
+        with out_ndjson.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    if "item_id" in rec and "error" not in rec:
+                        done.add(str(rec["item_id"]))
+                except json.JSONDecodeError:
+                    pass
+    return done
+
+
+def run_batch(
+    items: Iterable[WorkItem],
+    out_ndjson: Path,
+    model: str = DEFAULT_MODEL,
+    query_name: str = '',
+    transport: Optional[BatchTransport] = None,
+    poll_interval: float = POLL_INTERVAL_S,
+    max_resubmits: int = 2,
+    max_requests: int = BATCH_MAX_REQUESTS,
+    max_bytes: int = BATCH_MAX_BYTES,
+    cache: Optional[ResponseCache] = None,
+    use_cache: bool = True,
+) -> Dict[str, int]:
+    """
+    Batch counterpart of `oai3.run_bulk`: same resume rule (items with a non-error record
+    are skipped), same records, same response cache. Blocks until every batch is done.
+    """
+    out_ndjson = Path(out_ndjson)
+    out_ndjson.parent.mkdir(parents=True, exist_ok=True)
+    work_dir = out_ndjson.with_name(out_ndjson.name + ".batch")
+    state = BatchRunState(out_ndjson.with_name(out_ndjson.name + ".batches.json"))
+    transport = transport or OpenAIBatchTransport()
+    if use_cache and cache is None:
+        cache = ResponseCache()
+    counts = {"done": 0, "cached": 0, "errors": 0, "resubmitted": 0, "batches": 0}
+
+    done_ids = _done_ids(out_ndjson)
+    by_id = {w.item_id: w for w in items if w.item_id not in done_ids}
+    in_flight = {i for b in state.pending() for i in b["item_ids"]}
+    keys: Dict[str, str] = {}
+
+    out = out_ndjson.open("a", encoding="utf-8")
+
+    def write_record(rec: Dict[str, Any]):
+        out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        out.flush()
+        if "error" in rec:
+            counts["errors"] += 1
+        else:
+            counts["done"] += 1
+
+    def key_for(w: WorkItem) -> str:
+        if w.item_id not in keys:
+            keys[w.item_id] = response_key(model, w.prompt, w.json_schema, w.files[:MAX_FILES_PER_ITEM], render_params())
+        return keys[w.item_id]
+
+    def submit(work: List[WorkItem], round_: int):
+        prefix = f"round{round_}-{len(state.batches):04d}"
+        for path, ids in write_request_files(model, work, work_dir, prefix, max_requests, max_bytes):
+            batch = transport.create(transport.upload(path), metadata={"query": query_name, "file": path.name})
+            state.batches.append({"id": batch["id"], "input": str(path), "item_ids": ids, "round": round_})
+            state.save()
+            counts["batches"] += 1
+            print(f"[{query_name}] submitted {batch['id']} ({len(ids)} requests, {path.stat().st_size / 1e6:.1f} MB)")
+
+    def merge(b: Dict[str, Any], batch: Dict[str, Any]) -> List[Tuple[str, str]]:
+        """Write the batch's successes; return [(item_id, error)] for retryable failures."""
+        failures: List[Tuple[str, str]] = []
+        seen: set[str] = set()
+        for file_key in ("output_file_id", "error_file_id"):
+            if not batch.get(file_key):
+                continue
+            for line in transport.download(batch[file_key]).decode("utf-8").splitlines():
+                if not line.strip():
+                    continue
+                item_id, resp, error, retryable = parse_result_line(json.loads(line))
+                seen.add(item_id)
+                if item_id not in by_id:
+                    continue
+                if resp is not None:
+                    try:
+                        output = extract_json(resp)
+                    except (json.JSONDecodeError, KeyError, IndexError, TypeError) as e:
+                        error, retryable = f"unparseable output: {e}", True
+                    else:
+                        if cache is not None:
+                            cache.put(key_for(by_id[item_id]), resp, model=model)
+                        write_record({"item_id": item_id, "model": model, "output_text": output,
+                                      "raw_response": resp, "cached": False, "batch_id": b["id"]})
+                        continue
+                if retryable:
+                    failures.append((item_id, error))
+                else:
+                    write_record({"item_id": item_id, "error": error, "batch_id": b["id"]})
+        # Requests a failed/expired/cancelled batch never got to
+        reason = f"batch {batch['status']}" + (f": {batch['errors']}" if batch.get("errors") else "")
+        failures += [(i, reason) for i in b["item_ids"] if i not in seen and i in by_id]
+        return failures
+
+    try:
+        # Cache hits never need a batch
+        work: List[WorkItem] = []
+        for w in by_id.values():
+            if w.item_id in in_flight:
+                continue
+            resp = cache.get(key_for(w)) if cache is not None else None
+            if resp is not None:
+                write_record({"item_id": w.item_id, "model": model, "output_text": extract_json(resp),
+                              "raw_response": resp, "cached": True})
+                counts["cached"] += 1
+            else:
+                work.append(w)
+
+        if state.pending():
+            print(f"[{query_name}] resuming {len(state.pending())} submitted batches")
+        if work:
+            submit(work, round_=0)
+
+        while state.pending():
+            finished = []
+            for b in state.pending():
+                batch = transport.retrieve(b["id"])
+                if batch["status"] in TERMINAL_STATUSES:
+                    finished.append((b, batch))
+            if not finished:
+                time.sleep(poll_interval)
+                continue
+
+            for b, batch in finished:
+                failures = merge(b, batch)
+                b["merged"] = True
+                state.save()
+                Path(b["input"]).unlink(missing_ok=True) # uploaded and merged: the local copy is dead weight
+
+                next_round = b["round"] + 1
+                retry = [by_id[i] for i, _ in failures]
+                if retry and next_round <= max_resubmits:
+                    counts["resubmitted"] += len(retry)
+                    print(f"[{query_name}] {b['id']} {batch['status']}: resubmitting {len(retry)} failed requests")
+                    submit(retry, round_=next_round)
+                else:
+                    for item_id, error in failures:
+                        write_record({"item_id": item_id, "error": error, "batch_id": b["id"]})
+    finally:
+        out.close()
+    if work_dir.exists() and not any(work_dir.iterdir()):
+        work_dir.rmdir()
+
+    print(f"[{query_name}] {counts}")
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Response cache: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%}), {stats['entries']} entries")
+    return counts
@@ -18,6 +18,8 @@ from datetime import datetime
 from google import genai
 #from google.genai.types import UploadFileResponse  # type: ignore
 
+from .upload_registry import UploadRegistry, get_upload_registry
+
 load_dotenv()
 
 # ---------- Configuration & types ----------
@@ -127,7 +129,7 @@ def upload_file_with_retry(path: Path, attempts: int) -> UploadResult:
         except BaseException as e:  # you can use _is_transient
             attempt += 1
             if attempt >= attempts or not _is_transient(e):
-                return UploadResult(key=_file_key(path), path=str(path), file_name=None, error=None, uri=None, mime_type=None, create_time=None, expiration_time=None)
+                return UploadResult(key=_file_key(path), path=str(path), file_name=None, error=e, uri=None, mime_type=None, create_time=None, expiration_time=None)
                 
 
             delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** (attempt - 1)))
@@ -196,6 +198,7 @@ def bulk_upload(
     outfile: Optional[Path] = None,
     show_progress: bool = True,
     flush_every: int = 0,  # 0 = only on close; set N to flush every N writes
+    registry: Optional[UploadRegistry] = None,  # successful uploads are registered for reuse by model runs
 ) -> list[UploadResult]:
 
     files = list(paths)
@@ -223,6 +226,8 @@ def bulk_upload(
             for fut in iterator:
                 res = fut.result()
                 results.append(res)
+                if registry is not None and res.uri:
+                    registry.record(Path(res.path), res)
 
                 if f:
                     json.dump(
@@ -259,6 +264,8 @@ def parse_args(argv: Sequence[str]) -> argparse.Namespace:
     parser.add_argument("--retries", type=int, default=RETRY_ATTEMPTS_DEFAULT,
                     help=f"retry attempts per file (default: {RETRY_ATTEMPTS_DEFAULT}).")
     parser.add_argument("--quiet", action="store_true", help="Less verbose logging.")
+    parser.add_argument("--no-register", action="store_true",
+                    help="Don't add the uploads to the shared upload registry.")
     return parser.parse_args(argv)
 
 
@@ -314,7 +321,8 @@ def main(argv: Sequence[str]) -> int:
         return 0
 
     t0 = time.perf_counter()
-    results = bulk_upload(files, max_workers=args.workers, retry_attempts=args.retries, outfile=args.outfile)
+    registry = None if args.no_register else get_upload_registry()
+    results = bulk_upload(files, max_workers=args.workers, retry_attempts=args.retries, outfile=args.outfile, registry=registry)
     dt = time.perf_counter() - t0
 
 
@@ -16,7 +16,11 @@ os.getenv('OPENAI_API_KEY')
 from openai import OpenAI, APIStatusError, APITimeoutError, RateLimitError
 from PIL import Image
 import fitz  # PyMuPDF
+import numpy as np
 from ..config.constants import DATA_PATH
+from ..modalities.imagery.store import read_from_store_for_path
+from .response_cache import ResponseCache, response_key
+from .payload_cache import get_payload_cache
 
 from .models.queries import QUERIES, Query
 
@@ -30,6 +34,8 @@ TIMEOUT_S = 120
 MAX_FILES_PER_ITEM = 5         # hard cap to protect tokens
 PDF_PAGES_PER_FILE = 10         # render first N pages per PDF: 0 = all
 PDF_DPI_SCALE = 2.0
+IMAGE_MAX_SIDE = 1600
+IMAGE_DETAIL = "high"
 
 class RateLimiter:
     """
@@ -74,7 +80,7 @@ class WorkItem:
 # -----------------------------
 # Image helpers
 # -----------------------------
-def pil_to_base64_png(img: Image.Image, max_side: int = 1600, quality_hint: int = 85) -> str:
+def pil_to_base64_png(img: Image.Image, max_side: int = IMAGE_MAX_SIDE, quality_hint: int = 85) -> str:
     """
     Downscale to control tokens (vision models see fewer pixels → fewer tokens).
     Returns base64 data URL (PNG).
@@ -108,6 +114,11 @@ def render_pdf_pages_to_images(pdf_path: Path, pages: int = PDF_PAGES_PER_FILE)
 
 def load_file_as_images(path: Path) -> list[Image.Image]:
     if path.suffix.lower() == ".png":
+        if not path.exists():
+            # Universe imagery may have been packed into an imagery store
+            arr = read_from_store_for_path(path)
+            if arr is not None:
+                return [Image.fromarray(np.asarray(arr))]
         return [Image.open(path)]
     if path.suffix.lower() == ".pdf":
         return render_pdf_pages_to_images(path, pages=PDF_PAGES_PER_FILE)
@@ -124,19 +135,20 @@ def build_messages(prompt: str, files: list[tuple[str, Path]]) -> list[dict[str,
     content: list[dict[str, Any]] = [{"type": "text", "text": prompt}]
 
     selected = files[:MAX_FILES_PER_ITEM]
+    payloads = get_payload_cache() # encoded once per (file, page, size), reused across retries and runs
     for label, p in selected:
-        imgs = load_file_as_images(p)
-        if not imgs:
+        if p.suffix.lower() not in (".png", ".pdf"):
+            raise ValueError(f"Unsupported file type: {p}")
+        data_url = payloads.data_url(p, page=0, max_side=IMAGE_MAX_SIDE)
+        if data_url is None: # e.g. a PDF with no pages
             continue
-        img = imgs[0]
-        data_url = pil_to_base64_png(img)
         content.append({
             "type": "text", 
             "text": f"Label: {label}"   # add label inline
         })
         content.append({
             "type": "image_url",
-            "image_url": {"url": data_url, "detail": "high"}
+            "image_url": {"url": data_url, "detail": IMAGE_DETAIL}
         })
 
     return [{"role": "user", "content": content}]
@@ -263,14 +275,36 @@ def extract_json(resp: dict[str, Any]) -> dict[str, Any]:
     raw = resp["choices"][0]["message"]["content"]
     return json.loads(raw)
 
-def process_item(client: OpenAI, model: str, w: WorkItem, limiter: Optional[RateLimiter] = None) -> dict[str, Any]:
-    messages = build_messages(w.prompt, w.files)
-    resp = safe_chat_with_retries(client, model, messages, w.json_schema, limiter=limiter)
+def render_params() -> dict[str, Any]:
+    """Everything besides the prompt and file bytes that changes what the model sees."""
+    return {
+        "max_files": MAX_FILES_PER_ITEM,
+        "pdf_pages": PDF_PAGES_PER_FILE,
+        "max_side": IMAGE_MAX_SIDE,
+        "detail": IMAGE_DETAIL,
+    }
+
+def process_item(client: OpenAI, model: str, w: WorkItem, limiter: Optional[RateLimiter] = None,
+                 cache: Optional[ResponseCache] = None) -> dict[str, Any]:
+    key = resp = None
+    if cache is not None:
+        key = response_key(model, w.prompt, w.json_schema, w.files[:MAX_FILES_PER_ITEM], render_params())
+        resp = cache.get(key)
+
+    cached = resp is not None
+    if not cached:
+        messages = build_messages(w.prompt, w.files)
+        resp = safe_chat_with_retries(client, model, messages, w.json_schema, limiter=limiter)
+
+    output = extract_json(resp)
+    if cache is not None and not cached: # only parseable responses are cached
+        cache.put(key, resp, model=model)
     return {
         "item_id": w.item_id,
         "model": model,
-        "output_text": extract_json(resp),
+        "output_text": output,
         "raw_response": resp,
+        "cached": cached,
     }
 
 
@@ -285,7 +319,13 @@ def run_bulk(
     query_name: str = '',
     rps: float = 2.0,
     max_inflight: int = 2,
+    cache: Optional[ResponseCache] = None,
+    use_cache: bool = True,
 ) -> None:
+    """
+    Responses are looked up in (and added to) a content-addressed `ResponseCache`
+    shared with other runs; pass `use_cache=False` to always call the API.
+    """
     out_ndjson.parent.mkdir(parents=True, exist_ok=True)
 
     done_ids: set[str] = set()
@@ -314,12 +354,14 @@ def run_bulk(
                 f.write(line + "\n")
 
     limiter = RateLimiter(rps=rps, max_concurrent=max_inflight)
+    if use_cache and cache is None:
+        cache = ResponseCache()
 
     # Keep thread pool reasonable vs inflight cap
     pool_workers = min(max_workers, max_inflight * 2)
 
     with cf.ThreadPoolExecutor(max_workers=pool_workers) as ex:
-        futures = {ex.submit(process_item, client, model, w, limiter): w for w in work}
+        futures = {ex.submit(process_item, client, model, w, limiter, cache if use_cache else None): w for w in work}
         for fut in tqdm(cf.as_completed(futures), total=len(work), desc=f"Processing {query_name}"):
             w = futures[fut]
             try:
@@ -328,6 +370,10 @@ def run_bulk(
                 rec = {"item_id": w.item_id, "error": str(e)}
             write_record(rec)
 
+    if use_cache:
+        stats = cache.stats()
+        print(f"Response cache: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%}), {stats['entries']} entries")
+
 def bulk_query_on_df(
     query: Query,
     df: pd.DataFrame,
@@ -338,6 +384,10 @@ def bulk_query_on_df(
     pbar: bool = True,
     rps: float = 2.0,
     max_inflight: int = 2,
+    use_cache: bool = True,
+    use_async: bool = False,
+    max_concurrency: int = 64,
+    use_batch: bool = False,
 ):
     items: list[WorkItem] = []
     for row in df.itertuples(index=False):
@@ -366,6 +416,17 @@ def bulk_query_on_df(
             )
         )
 
+    if use_batch: # Batch API: submitted as JSONL files, results merged into the same outfile
+        from .batch_runner import run_batch
+        run_batch(items, out_ndjson=outfile, model=model, query_name=query.name, use_cache=use_cache)
+        return
+
+    if use_async: # adaptive concurrency driven by the account's rate limits instead of rps/max_inflight
+        from .async_runner import AsyncRunConfig, run_bulk_async
+        run_bulk_async(items, out_ndjson=outfile, model=model, query_name=query.name,
+                       config=AsyncRunConfig(max_concurrency=max_concurrency), use_cache=use_cache)
+        return
+
     run_bulk(
         items,
         out_ndjson=outfile,
@@ -374,6 +435,7 @@ def bulk_query_on_df(
         query_name=query.name,
         rps=rps,
         max_inflight=max_inflight,
+        use_cache=use_cache,
     )
 
 
@@ -394,6 +456,12 @@ if __name__ == "__main__":
                    help="How many pages to render per PDF (default 1). Still capped by total files per item.")
     p.add_argument("--rps", type=float, default=2.0, help="Target requests per second (global).")
     p.add_argument("--max-inflight", type=int, default=2, help="Max simultaneous in-flight API calls.")
+    p.add_argument("--no-cache", action="store_true", help="Don't reuse (or store) responses in the shared response cache.")
+    p.add_argument("--async", dest="use_async", action="store_true",
+                   help="Use the asyncio runner (adapts concurrency to rate-limit headers; ignores --rps/--max-inflight).")
+    p.add_argument("--max-concurrency", type=int, default=64, help="Upper bound on in-flight calls for --async.")
+    p.add_argument("--batch", dest="use_batch", action="store_true",
+                   help="Submit through the Batch API (cheaper, completes within 24h; resumable).")
     args = p.parse_args()
 
     df = pd.read_csv(args.input)
@@ -416,6 +484,10 @@ if __name__ == "__main__":
         pdf_pages_per_file=pdf_pages_per_file,
         rps=args.rps,
         max_inflight=args.max_inflight,
+        use_cache=not args.no_cache,
+        use_async=args.use_async,
+        max_concurrency=args.max_concurrency,
+        use_batch=args.use_batch,
     )
 
 
@@ -0,0 +1,200 @@
+"""
+Cache of encoded image payloads for vision requests.
+
+Turning a file into an image part (decode, LANCZOS downscale, PNG encode with
+`optimize=True`, or rasterize a PDF page) costs far more than the request itself
+and used to be repeated on every retry and every run. The encoded bytes are
+stored once per (file sha256, page, max_side, format) under
+`runtime/cache/llm_payloads/`, and recent data URLs are also kept in memory.
+
+Warm the cache for a sample CSV (same `file_labels` column as `oai3.bulk_query_on_df`):
+    python -m streettransformer.llms.payload_cache samples.csv --workers 8
+"""
+import os
+import base64
+import hashlib
+import argparse
+import threading
+from io import BytesIO
+from pathlib import Path
+from functools import lru_cache
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from ..config.constants import DATA_PATH
+from ..modalities.imagery.store import read_from_store_for_path
+from .response_cache import file_sha256
+
+PAYLOAD_CACHE_PATH = DATA_PATH / 'runtime' / 'cache' / 'llm_payloads'
+MAX_SIDE_DEFAULT = 1600
+FORMAT_DEFAULT = 'png'
+PDF_ZOOM = 2.0
+MIME = {'png': 'image/png', 'jpeg': 'image/jpeg'}
+
+# -----------------------------------------------------------------------------
+# Render + encode
+# -----------------------------------------------------------------------------
+def render_page(path: Path, page: int = 0) -> Optional[Image.Image]:
+    """One image from a PNG (or its imagery-store copy) or one rasterized PDF page (None if the PDF has no such page)."""
+    path = Path(path)
+    if path.suffix.lower() == '.png':
+        if not path.exists():
+            arr = read_from_store_for_path(path)
+            if arr is not None:
+                return Image.fromarray(np.asarray(arr))
+        return Image.open(path)
+    if path.suffix.lower() == '.pdf':
+        import fitz  # PyMuPDF
+        with fitz.open(path) as doc:
+            if page >= len(doc):
+                return None
+            pix = doc.load_page(page).get_pixmap(matrix=fitz.Matrix(PDF_ZOOM, PDF_ZOOM), alpha=False)
+            return Image.frombytes('RGB', [pix.width, pix.height], pix.samples)
+    raise ValueError(f'Unsupported file type: {path}')
+
+
+def encode_image(img: Image.Image, max_side: int = MAX_SIDE_DEFAULT, fmt: str = FORMAT_DEFAULT) -> bytes:
+    """Downscale so the longest side is <= max_side, then encode (PNG optimized, or JPEG)."""
+    w, h = img.size
+    scale = min(1.0, max_side / max(w, h))
+    if scale < 1.0:
+        img = img.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
+    buf = BytesIO()
+    if fmt == 'jpeg':
+        img.convert('RGB').save(buf, format='JPEG', quality=85)
+    else:
+        img.save(buf, format='PNG', optimize=True)
+    return buf.getvalue()
+
+
+def to_data_url(data: bytes, fmt: str = FORMAT_DEFAULT) -> str:
+    return f"data:{MIME[fmt]};base64,{base64.b64encode(data).decode('utf-8')}"
+
+# -----------------------------------------------------------------------------
+# Cache
+# -----------------------------------------------------------------------------
+class PayloadCache:
+    """
+    Usage:
+        cache = PayloadCache()
+        url = cache.data_url(Path('imagery/2016/123.png'))          # encoded once, then read back
+        url = cache.data_url(Path('doc.pdf'), page=0, fmt='jpeg')
+    """
+    def __init__(self, root: Path = PAYLOAD_CACHE_PATH, memory_items: int = 256):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.memory_items = memory_items
+        self._memory: 'OrderedDict[str, str]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path: Path, page: int = 0, max_side: int = MAX_SIDE_DEFAULT, fmt: str = FORMAT_DEFAULT) -> str:
+        """Keyed on content: file bytes, or the stored pixels of a PNG packed into an imagery store."""
+        return hashlib.sha256(f'{file_sha256(path)}|{page}|{max_side}|{fmt}'.encode()).hexdigest()
+
+    def _path(self, key: str, fmt: str) -> Path:
+        return self.root / key[:2] / f'{key}.{fmt}'
+
+    def payload(self, path: Path, page: int = 0, max_side: int = MAX_SIDE_DEFAULT, fmt: str = FORMAT_DEFAULT) -> Optional[bytes]:
+        """Encoded bytes for one page of `path`, from disk if already built (None for a missing PDF page)."""
+        out_path = self._path(self.key(path, page, max_side, fmt), fmt)
+        if out_path.exists():
+            with self._lock:
+                self.hits += 1
+            return out_path.read_bytes()
+
+        img = render_page(path, page)
+        if img is None:
+            return None
+        data = encode_image(img, max_side=max_side, fmt=fmt)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = out_path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, out_path)
+        with self._lock:
+            self.misses += 1
+        return data
+
+    def data_url(self, path: Path, page: int = 0, max_side: int = MAX_SIDE_DEFAULT, fmt: str = FORMAT_DEFAULT) -> Optional[str]:
+        key = self.key(path, page, max_side, fmt)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+        data = self.payload(path, page, max_side, fmt)
+        if data is None:
+            return None
+        url = to_data_url(data, fmt)
+        with self._lock:
+            self._memory[key] = url
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+        return url
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+@lru_cache(maxsize=4)
+def get_payload_cache(root: Path = PAYLOAD_CACHE_PATH) -> PayloadCache:
+    """Process-wide PayloadCache per root."""
+    return PayloadCache(root)
+
+# -----------------------------------------------------------------------------
+# Warm-up
+# -----------------------------------------------------------------------------
+def parse_file_labels(file_labels: str) -> List[Tuple[str, Path]]:
+    """'label:path;label:path' -> [(label, path)] (the `file_labels` format used by oai3)."""
+    pairs = []
+    for pair in str(file_labels).split(';'):
+        if ':' not in pair:
+            continue
+        label, path_str = pair.split(':', 1)
+        p = Path(path_str.strip())
+        pairs.append((label.strip(), p if p.exists() else DATA_PATH / p))
+    return pairs
+
+
+def _warm_one(args) -> Optional[str]:
+    path, page, max_side, fmt, root = args
+    try:
+        get_payload_cache(root).payload(path, page, max_side, fmt)
+        return None
+    except Exception as e:
+        return f'{path}: {e}'
+
+
+def warm_payloads(paths: Iterable[Path], max_side: int = MAX_SIDE_DEFAULT, fmt: str = FORMAT_DEFAULT,
+                  workers: Optional[int] = None, root: Path = PAYLOAD_CACHE_PATH) -> List[str]:
+    """Encode every (first page of every) path across processes; returns the errors."""
+    from tqdm import tqdm
+    jobs = [(Path(p), 0, max_side, fmt, root) for p in dict.fromkeys(paths)]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        results = list(tqdm(ex.map(_warm_one, jobs, chunksize=8), total=len(jobs), desc='Encoding payloads'))
+    return [r for r in results if r]
+
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description='Precompute encoded image payloads for a sample CSV')
+    parser.add_argument('input', type=Path, help='CSV with a `file_labels` column (label:path;label:path)')
+    parser.add_argument('--max-side', type=int, default=MAX_SIDE_DEFAULT)
+    parser.add_argument('--format', choices=list(MIME), default=FORMAT_DEFAULT)
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Processes (default: number of CPUs)')
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input)
+    paths = [p for fl in df['file_labels'].dropna() for _, p in parse_file_labels(fl) if p.suffix.lower() in ('.png', '.pdf')]
+    errors = warm_payloads(paths, max_side=args.max_side, fmt=args.format, workers=args.workers)
+    print(f'Encoded {len(set(paths)) - len(errors)} payloads ({len(errors)} errors)')
+    for err in errors[:20]:
+        print(f'\t{err}')
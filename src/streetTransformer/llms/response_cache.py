@@ -0,0 +1,121 @@
+"""
+Content-addressed cache of LLM responses, shared by every runner.
+
+A response is keyed by what the model actually saw: the model name, the prompt
+text, the JSON schema, the bytes of every attached file (with its label) and the
+render params (pages per PDF, image size, ...). Item ids and output files are not
+part of the key, so re-running a query under a new id scheme, into a new outfile,
+or from another script reuses responses already paid for.
+
+Backed by one sqlite file (WAL mode, safe across threads and processes).
+"""
+import json
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from functools import lru_cache
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..config.constants import DATA_PATH
+from ..modalities.imagery.store import read_from_store_for_path
+
+RESPONSE_CACHE_PATH = DATA_PATH / 'runtime' / 'cache' / 'llm_responses.sqlite'
+
+@lru_cache(maxsize=4096)
+def _file_sha256(path: str, mtime_ns: int, size: int) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_sha256(path: Path) -> str:
+    """
+    sha256 of a file's bytes (memoized on path + mtime + size). A PNG packed into an
+    imagery store is hashed from its stored pixels, so a re-packed image gets a new key.
+    """
+    path = Path(path)
+    if not path.exists():
+        arr = read_from_store_for_path(path)
+        if arr is None:
+            return 'missing:' + str(path)
+        h = hashlib.sha256(f'{arr.shape}|{arr.dtype}|'.encode())
+        h.update(np.ascontiguousarray(arr).data)
+        return 'store:' + h.hexdigest()
+    stat = path.stat()
+    return _file_sha256(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def response_key(model: str, prompt: str, json_schema: Any, files: Sequence[Tuple[str, Path]],
+                 render_params: Optional[Dict[str, Any]] = None) -> str:
+    payload = {
+        'model': model,
+        'prompt': prompt,
+        'schema': json_schema,
+        'files': [[label, file_sha256(p)] for label, p in files],
+        'render': render_params or {},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Usage:
+        cache = ResponseCache()                       # default: runtime/cache/llm_responses.sqlite
+        key = response_key(model, prompt, schema, files, render_params)
+        resp = cache.get(key)
+        if resp is None:
+            resp = call_model(...)
+            cache.put(key, resp, model=model)
+        print(cache.stats())
+    """
+    def __init__(self, path: Path = RESPONSE_CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at REAL DEFAULT (strftime('%s', 'now')))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, response: Dict[str, Any], model: str = '') -> None:
+        data = json.dumps(response, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO responses (key, model, response) VALUES (?, ?, ?)', (key, model, data))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0, 'entries': len(self)}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -12,6 +12,8 @@ from typing import List, Optional, Any, Union, Dict, Tuple
 import json
 import concurrent.futures as cf
 
+from .upload_registry import UploadRegistry, get_upload_registry
+
 FLUSH_EVERY = 10
 
 import os
@@ -31,11 +33,15 @@ def setup_config(sys_prompt:str, temp:float=.9, top_p:float=.2, response_mime_ty
     return config
 
 # Make a single-shot request (text-only or multimodal w/ file)
-def setup_contents(files:List[Path], client, user_prompt:str='Documents: '):
+def setup_contents(files:List[Path], client, user_prompt:str='Documents: ', registry:Optional[UploadRegistry]=None):
+    """With a `registry`, files already uploaded (same contents, not expired) are referenced instead of re-uploaded."""
     contents = [user_prompt]
     for input_item in files:
         if isinstance(input_item, Path):
             if input_item.exists(): 
+                if registry is not None:
+                    contents.append(registry.part(input_item, client))
+                    continue
                 uploaded = client.files.upload(file=input_item)
                 if uploaded:
                     contents.append(uploaded)
@@ -140,13 +146,19 @@ def run_individual_model(
     initial_backoff: float = 1.0,
     max_backoff: float = 30.0,
     jitter: bool = True,
+    registry: Optional[UploadRegistry] = None,
+    use_registry: bool = True,
 ):
     """
     Calls Gemini with an RPM limiter (default 15/min) and exponential backoff.
+    Images are uploaded through the shared `UploadRegistry` (reused across calls and
+    runs until they expire); pass `use_registry=False` to upload on every call.
     Returns the response text.
     """
     config = setup_config(system_prompt)
-    contents = setup_contents(files=files, client=client)
+    if use_registry and registry is None:
+        registry = get_upload_registry()
+    contents = setup_contents(files=files, client=client, registry=registry if use_registry else None)
 
     # Gate this call so we do not exceed 15 RPM.
     limiter.acquire()
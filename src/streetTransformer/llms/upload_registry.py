@@ -0,0 +1,160 @@
+"""
+Registry of files uploaded to the Gemini Files API, so an image is uploaded once
+per content and reused until it expires.
+
+Uploads are keyed by the file's sha256 (plus the path it came from, for
+reference): a changed file gets a new key and is uploaded again, an unchanged
+one is served from the registry until shortly before its `expiration_time`
+(uploads live 48h). `bulk_upload` results can be imported too, so a pre-upload
+of a whole imagery folder is picked up by later model runs.
+
+Backed by one sqlite file (WAL mode, safe across threads and processes).
+"""
+import json
+import sqlite3
+import threading
+from types import SimpleNamespace
+from pathlib import Path
+from functools import lru_cache
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+
+from ..config.constants import DATA_PATH
+from .response_cache import file_sha256
+
+UPLOAD_REGISTRY_PATH = DATA_PATH / 'runtime' / 'cache' / 'gemini_uploads.sqlite'
+EXPIRY_MARGIN_S = 3600 # don't hand out a URI that expires within the hour
+
+def _timestamp(value: Any) -> Optional[float]:
+    """datetime / ISO string / epoch -> epoch seconds."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class UploadRegistry:
+    """
+    Usage:
+        registry = UploadRegistry()                     # default: runtime/cache/gemini_uploads.sqlite
+        part = registry.part(Path('imagery/2016/123.png'), client)   # uploads only if new, changed or expired
+        registry.import_results(bulk_upload(paths))
+        print(registry.stats())
+    """
+    def __init__(self, path: Path = UPLOAD_REGISTRY_PATH, expiry_margin: float = EXPIRY_MARGIN_S):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.expiry_margin = expiry_margin
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            " sha256 TEXT PRIMARY KEY, path TEXT, file_name TEXT, uri TEXT, mime_type TEXT,"
+            " create_time REAL, expiration_time REAL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.uploads = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM uploads').fetchone()[0]
+
+    def _valid(self, row: Optional[Dict[str, Any]], now: Optional[float] = None) -> bool:
+        if row is None or not row['uri']:
+            return False
+        expires = row['expiration_time']
+        return expires is None or expires - self.expiry_margin > (now or datetime.now(timezone.utc).timestamp())
+
+    def get(self, path: Path) -> Optional[Dict[str, Any]]:
+        """The registered upload for the file's current contents, if it hasn't expired."""
+        with self._lock:
+            cur = self._conn.execute(
+                'SELECT sha256, path, file_name, uri, mime_type, create_time, expiration_time FROM uploads WHERE sha256 = ?',
+                (file_sha256(path),))
+            row = cur.fetchone()
+        row = dict(zip([c[0] for c in cur.description], row)) if row else None
+        return row if self._valid(row) else None
+
+    def record(self, path: Path, uploaded: Any, sha256: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Register a `types.File` or `UploadResult` for `path`; returns the stored row."""
+        uri = getattr(uploaded, 'uri', None)
+        if not uri:
+            return None
+        row = {
+            'sha256': sha256 or file_sha256(path),
+            'path': str(path),
+            'file_name': getattr(uploaded, 'name', None) or getattr(uploaded, 'file_name', None),
+            'uri': uri,
+            'mime_type': getattr(uploaded, 'mime_type', None),
+            'create_time': _timestamp(getattr(uploaded, 'create_time', None)),
+            'expiration_time': _timestamp(getattr(uploaded, 'expiration_time', None)),
+        }
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?)', tuple(row.values()))
+            self._conn.commit()
+        return row
+
+    def ensure(self, path: Path, client) -> Dict[str, Any]:
+        """Registered upload for `path`, uploading it first if it's new, changed or expired."""
+        path = Path(path)
+        sha256 = file_sha256(path)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(sha256, threading.Lock())
+        with key_lock: # concurrent requests for the same image upload it once
+            row = self.get(path)
+            if row is not None:
+                with self._lock:
+                    self.hits += 1
+                return row
+            row = self.record(path, client.files.upload(file=path), sha256=sha256)
+            with self._lock:
+                self.uploads += 1
+            return row
+
+    def part(self, path: Path, client):
+        """`types.Part` referencing the uploaded file, for a `contents` list."""
+        from google.genai import types
+        row = self.ensure(path, client)
+        if row is None:
+            raise RuntimeError(f'Upload of {path} returned no URI')
+        return types.Part.from_uri(file_uri=row['uri'], mime_type=row['mime_type'])
+
+    def import_results(self, results: Iterable[Any]) -> int:
+        """
+        Register `bulk_upload` output: `UploadResult`s or the dicts it writes to its NDJSON.
+        Files are hashed now, so import before they change.
+        """
+        n = 0
+        for res in results:
+            if isinstance(res, dict):
+                res = SimpleNamespace(**res)
+            path = Path(res.path)
+            if getattr(res, 'uri', None) and path.exists():
+                self.record(path, res)
+                n += 1
+        return n
+
+    def import_ndjson(self, ndjson_path: Path) -> int:
+        with open(ndjson_path, 'r', encoding='utf-8') as f:
+            return self.import_results(json.loads(line) for line in f if line.strip())
+
+    def stats(self) -> Dict[str, Any]:
+        return {'hits': self.hits, 'uploads': self.uploads, 'entries': len(self)}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+@lru_cache(maxsize=4)
+def get_upload_registry(path: Path = UPLOAD_REGISTRY_PATH) -> UploadRegistry:
+    """Process-wide UploadRegistry per path."""
+    return UploadRegistry(path)
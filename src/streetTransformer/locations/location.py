@@ -1,13 +1,16 @@
-from shapely.geometry import Point, box
+from shapely.geometry import Point
 from typing import Optional, List, Dict, Tuple
 from pathlib import Path
-import os, sys
+import sys
 import json
 from dataclasses import dataclass, asdict
+from functools import cached_property
 import logging
 
+import numpy as np
 import geopandas as gpd
 import pandas as pd
+from PIL import Image
 
 from ..config.constants import UNIVERSES_PATH, YEARS
 
@@ -29,6 +32,12 @@ def _read_filtered_json(path:Path, location_id):
 
 from shapely.geometry import Point
 from .location_geometry import LocationGeometry
+from ..modalities.imagery.store import ImageryStore
+from ..modalities.documents.index import load_document_index
+from ..modalities.citydata.temporal import TemporalFeatureStore
+from ..modalities.citydata.feature_store import (
+    is_partitioned, feature_file_path, list_features, read_feature, read_location_features
+)
 
 @dataclass
 class Location: 
@@ -38,7 +47,9 @@ class Location:
                  crossstreets:List[str], 
                  centroid:Point, 
                  years:List[int|str]=YEARS, 
-                 universe_path:Optional[Path]=None):
+                 universe_path:Optional[Path]=None,
+                 imagery_store:Optional[ImageryStore]=None,
+                 universe=None):
         self.centroid:Point         = centroid       
         self.location_id:int        = location_id
         self.universe_name:str      = universe_name
@@ -49,31 +60,63 @@ class Location:
         abs_universe_path = universe_path or _generate_universe_path(self.universe_name, UNIVERSES_PATH)
         #self.universe_path:Path = abs_universe_path.relative_to(PROJECT_PATH)
         self.universe_path = abs_universe_path
+
+        # Shared universe-level tables (see universe.Universe); None reads files directly
+        self.universe = universe
+
+        # Packed imagery (imagery_store/), if the universe has one
+        if imagery_store is None:
+            imagery_store = universe.imagery_store if universe is not None else ImageryStore.for_universe(self.universe_path)
+        self.imagery_store = imagery_store
     
         # Geometry - ensure centroid is 4326 somehow
         self.geometry = LocationGeometry(location_id=location_id, centroid=(centroid.x, centroid.y)) or None
-        
-        # Load Imagery
-        self.imagery_paths:Dict[str, Optional[Path]] = self.load_imagery(self.years) or None
 
-        # Load Documents
+        # Imagery, documents and citydata are loaded lazily (see the properties below)
+        self._feature_cache: Dict[Tuple[str, str], gpd.GeoDataFrame] = {}
+
+        # Results Placeholder
+        self.results = {}
+
+    # Lazy attributes: computed on first access, then cached on the instance
+    @cached_property
+    def imagery_paths(self) -> Dict[str, Optional[Path]]:
+        return self.load_imagery(self.years) or None
+
+    @cached_property
+    def documents(self) -> gpd.GeoDataFrame|None:
         try:
-            self.documents:gpd.GeoDataFrame = self.load_documents()
+            return self.load_documents()
         except Exception as e:
-            self.documents:gpd.GeoDataFrame = None
+            return None
 
-        # Load citydata Projects
-        self.citydata_projects = self.load_citydata_projects()
-        
-        
-        # Load citydata Features
+    @cached_property
+    def citydata_projects(self):
+        return self.load_citydata_projects()
+
+    @cached_property
+    def citydata_features(self) -> Dict[str, Dict[str, gpd.GeoDataFrame]]|None:
         try:
-            self.citydata_features = self.load_citydata_features() or None
+            return self.load_citydata_features() or None
         except Exception as e:
-            self.citydata_features = None
+            return None
 
-        # Results Placeholder
-        self.results = {}
+    @cached_property
+    def temporal_features(self) -> Optional[TemporalFeatureStore]:
+        if self.universe is not None:
+            return self.universe.temporal_features
+        return TemporalFeatureStore.for_universe(self.universe_path)
+
+    @cached_property
+    def citydata_features_summary(self) -> pd.DataFrame:
+        features = self.citydata_features or {}
+        return pd.DataFrame({
+            year: {
+                feat_name: feats.shape[0]
+                for feat_name, feats in features[year].items()
+            }
+            for year in features.keys()
+        })
     
     # Dunders
     def __repr__(self):
@@ -95,74 +138,105 @@ class Location:
     
     # Input Functions
     def load_imagery(self, years, imagery_path:Optional[Path]=None) -> Dict[str, Optional[Path]]:
+        """
+        {year: image path or None}. Paths inside the universe are relative to it
+        (`imagery/{year}/{location_id}.png`), paths outside it are absolute.
+        """
+        # The store packs the universe's own imagery/ tree, so it only answers for that
+        use_store = self.imagery_store is not None and imagery_path is None
         if imagery_path is None:
             imagery_path = self.universe_path / 'imagery'
+        imagery_path = Path(imagery_path)
 
-        if not imagery_path.exists():
+        if not use_store and not imagery_path.exists():
             raise FileNotFoundError(f'{imagery_path} not found!')
 
-        potential_paths = {year : imagery_path / year / f'{self.location_id}.png' for year in years}
-        final_paths = {
-            str(y): (path if path.exists() else None) 
-            for y, path in potential_paths.items() 
-        }
+        # With a store, availability comes from its index (no per-file stat); PNGs not
+        # packed yet are still found on disk. The PNG path is returned either way, so
+        # consumers can resolve it via the store.
+        final_paths = {}
+        for y in years:
+            path = imagery_path / str(y) / f'{self.location_id}.png'
+            found = (use_store and (y, self.location_id) in self.imagery_store) or path.exists()
+            final_paths[str(y)] = self._relative_to_universe(path) if found else None
+        return final_paths
 
-        # Make relative to universe_path
-        relative_paths = {
-            y: (path.relative_to(self.universe_path) if path is not None else None)
-            for y, path in final_paths.items()
-        }
-        return relative_paths
+    def _relative_to_universe(self, path:Path) -> Path:
+        try:
+            return path.relative_to(self.universe_path)
+        except ValueError:
+            return path
     
+    def get_image(self, year:str|int) -> Optional[np.ndarray]:
+        """Pixels for `year` as an (h, w, 3) array: from the imagery store if it has them, else the PNG."""
+        if self.imagery_store is not None:
+            arr = self.imagery_store.get(year, self.location_id)
+            if arr is not None:
+                return arr
+        rel_path = self.load_imagery([str(year)]).get(str(year))
+        if rel_path is None:
+            return None
+        with Image.open(self.universe_path / rel_path) as img:
+            return np.asarray(img.convert('RGB'))
+
     def load_documents(self, years:List[str]=YEARS, documents_gdf_path:Optional[Path]=None) -> gpd.GeoDataFrame|None:
-        if documents_gdf_path is None:
-            documents_gdf_path = self.universe_path / 'documents.parquet'
-        
-        if not documents_gdf_path.exists():
-            raise Warning(f'"{documents_gdf_path}" not found!')
-        
+        # Documents are projected to EPSG:2263 once per universe and looked up by bbox (see DocumentIndex)
+        if documents_gdf_path is None and self.universe is not None:
+            document_index = self.universe.document_index
+            if document_index is None:
+                raise Warning(f'"{self.universe_path / "documents.parquet"}" not found!')
         else:
-            # load the geocoded documents
-            #documents_gdf = gpd.read_file(documents_gdf_path)
-            documents_gdf = gpd.read_parquet(documents_gdf_path)
-
-            # Create buffer
-            # bbox_p = Point(self.geometry.centroid_p).buffer(1000)
+            if documents_gdf_path is None:
+                documents_gdf_path = self.universe_path / 'documents.parquet'
+            if not documents_gdf_path.exists():
+                raise Warning(f'"{documents_gdf_path}" not found!')
+            document_index = load_document_index(documents_gdf_path)
 
-            # Create a bounding box
-            documents_gdf_p = documents_gdf.to_crs(self.geometry.proj_crs)
-            bbox_p = box(*self.geometry.bounds_proj)
+        # Documents intersecting the location's bounding box, clipped to it
+        documents_gdf_clipped_p = document_index.query(self.geometry.bounds_proj)
 
-            # Clip by bounding box
-            documents_gdf_clipped_p = documents_gdf_p.clip(bbox_p)
-
-            # Filter to years
-            # documents_gdf_clipped_filtered_p = documents_gdf_clipped_p[documents_gdf_clipped_p['year'].isin(years)]
-            return documents_gdf_clipped_p
+        # Filter to years
+        # documents_gdf_clipped_filtered_p = documents_gdf_clipped_p[documents_gdf_clipped_p['year'].isin(years)]
+        return documents_gdf_clipped_p
     
-    def load_citydata_features(self):
+    def load_citydata_features(self, years:Optional[List[str]]=None, feature_names:Optional[List[str]]=None):
+        """{year: {feature_name: rows for this location}}. Only the requested years/features are read."""
         features_path = self.universe_path / 'features'
+        years = [str(y) for y in (years or self.years)]
+
+        # Partitioned store without a shared universe: one pruned read per feature type
+        if self.universe is None and is_partitioned(features_path):
+            features = read_location_features(features_path, self.location_id, years, feature_names)
+            for year, feats in features.items():
+                for name, rows in feats.items():
+                    self._feature_cache[(year, name)] = rows
+            return features
+
         features = {}
-        for year in self.years:
-            features[year] = {}
-            fts_year_path = features_path / year 
-            fts_files = os.listdir(fts_year_path)
-            
-            for file in fts_files:
-                features_file = gpd.read_parquet(fts_year_path / file)
-                features_file_in_location = features_file[features_file['location_id'] == self.location_id]
-                features[year][Path(file).stem] = features_file_in_location
-
-        # Generate summary
-        self.citydata_features_summary = pd.DataFrame({
-            year: {
-                feat_name: feats.shape[0]
-                for feat_name, feats in features[year].items()
-            }
-            for year in features.keys()
-        })
-        
+        for year in years:
+            if feature_names:
+                names = feature_names
+            elif self.universe is not None:
+                names = self.universe.feature_names(year)
+            else:
+                names = list_features(features_path, year)
+            features[year] = {name: self.load_citydata_feature(year, name) for name in names}
         return features
+
+    def load_citydata_feature(self, year:str|int, feature_name:str) -> gpd.GeoDataFrame:
+        """Rows of one feature file for this location (cached per (year, feature))."""
+        key = (str(year), feature_name)
+        if key not in self._feature_cache and self.universe is not None:
+            self._feature_cache[key] = self.universe.feature_rows(key[0], feature_name, self.location_id)
+        if key not in self._feature_cache:
+            features_path = self.universe_path / 'features'
+            if is_partitioned(features_path):
+                rows = read_feature(features_path, feature_name, location_ids=[self.location_id], years=[key[0]])
+                self._feature_cache[key] = rows.drop(columns='year')
+            else:
+                features_file = gpd.read_parquet(feature_file_path(features_path, key[0], feature_name))
+                self._feature_cache[key] = features_file[features_file['location_id'] == self.location_id]
+        return self._feature_cache[key]
     
     def load_citydata_projects(self):
         return {}
@@ -217,9 +291,9 @@ class Location:
         if (year1 not in self.years) or (year2 not in self.years):
             raise ValueError('Years: {year1, year2} not valid')
         
-        # Images
-        image1_path = self.imagery_paths[year1]
-        image2_path = self.imagery_paths[year2]
+        # Images (only the two years, not the whole imagery_paths dict)
+        image_paths = self.load_imagery([year1, year2])
+        image1_path, image2_path = image_paths[year1], image_paths[year2]
 
         # Documents
         document_paths = self.documents['relative_paths'] # Can't really filter these
@@ -231,8 +305,16 @@ class Location:
         # Features
         FEATURE_SUBSETS = ['traffic_calming']
         FEATURE_COLS = ['treatment', 'install_date']
-        features1 = {feat: self.citydata_features[year1][feat][FEATURE_COLS].to_dict() for feat in FEATURE_SUBSETS}
-        features2 = {feat: self.citydata_features[year2][feat][FEATURE_COLS].to_dict() for feat in FEATURE_SUBSETS}
+        feature_changes = None
+        if self.temporal_features is not None:
+            # Point-in-time lookups on the interval store (no parquet reads)
+            date1, date2 = f'{year1}-01-01', f'{year2}-01-01'
+            features1 = {feat: self.temporal_features.active_at(self.location_id, date1, [feat])[FEATURE_COLS].to_dict() for feat in FEATURE_SUBSETS}
+            features2 = {feat: self.temporal_features.active_at(self.location_id, date2, [feat])[FEATURE_COLS].to_dict() for feat in FEATURE_SUBSETS}
+            feature_changes = self.temporal_features.changes_between(self.location_id, date1, date2, FEATURE_SUBSETS)
+        else:
+            features1 = {feat: self.load_citydata_feature(year1, feat)[FEATURE_COLS].to_dict() for feat in FEATURE_SUBSETS}
+            features2 = {feat: self.load_citydata_feature(year2, feat)[FEATURE_COLS].to_dict() for feat in FEATURE_SUBSETS}
 
         compare_data =  {
             'location_id': self.location_id, 
@@ -251,6 +333,7 @@ class Location:
             'change': {
                 'documents' : document_paths,
                 'projects'  : project_data,
+                'features'  : feature_changes,
             }
         }
         
@@ -4,6 +4,7 @@ from pydantic import BaseModel, Field, field_validator, field_serializer
 import sqlite3
 #from sqlmodel import SQLModel, Field
 import mercantile
+import numpy as np
 from pyproj import Transformer
 
 def _centered_range(n:int) -> List[int]:
@@ -44,6 +45,28 @@ def get_projected_bounds_from_geometric_bounds(bbox:List[float], output_crs):
     
     return [minx, miny, maxx, maxy]
 
+def tile_grid_bounds_proj(lons, lats, zlevel:int=20, tile_width:int=3, output_crs:str='EPSG:2263') -> np.ndarray:
+    """
+    Vectorized `LocationGeometry.bounds_proj` for many centroids: the projected bounds
+    of each tile grid as an (n, 4) array of [minx, miny, maxx, maxy].
+    """
+    lons, lats = np.asarray(lons, dtype=float), np.asarray(lats, dtype=float)
+    n_tiles = 2 ** zlevel
+    lat_r = np.radians(lats)
+    tx = np.floor((lons + 180.0) / 360.0 * n_tiles)
+    ty = np.floor((1.0 - np.log(np.tan(lat_r) + 1.0 / np.cos(lat_r)) / np.pi) / 2.0 * n_tiles)
+
+    half = tile_width // 2
+    west = (tx - half) / n_tiles * 360.0 - 180.0
+    east = (tx + half + 1) / n_tiles * 360.0 - 180.0
+    north = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (ty - half) / n_tiles))))
+    south = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (ty + half + 1) / n_tiles))))
+
+    transformer = Transformer.from_crs("EPSG:4326", output_crs, always_xy=True)
+    minx, miny = transformer.transform(west, south)
+    maxx, maxy = transformer.transform(east, north)
+    return np.column_stack([minx, miny, maxx, maxy])
+
 # TODO: Crop_location
 # def crop_location(row):
 #     # using bounds assumes they are square in this projection, which they aren't necessarily
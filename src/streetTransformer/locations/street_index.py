@@ -0,0 +1,116 @@
+"""
+Street adjacency index: which streets cross which, as integer arrays.
+
+Street names are sorted and numbered, so ids order like names and a typeahead
+prefix is a `searchsorted` range over the sorted names (what a trie would give
+us, without the nodes). Adjacency ("these two streets meet at some location")
+is CSR: the neighbours of street `i` are `indices[indptr[i]:indptr[i+1]]`,
+sorted, so narrowing a selection is `np.intersect1d` over small int arrays.
+
+The index is persisted as one .npz (next to the universe's locations) and
+rebuilt only when the locations file is newer.
+"""
+import os
+from pathlib import Path
+from functools import reduce
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+STREET_INDEX_FILENAME = 'street_index.npz'
+
+class StreetIndex:
+    """
+    Usage:
+        index = StreetIndex.load_or_build(universe_path / 'locations' / 'street_index.npz', locations_gdf)
+        index.complete('BROAD')                         # names starting with 'BROAD'
+        index.valid_with(['BROADWAY', 'W 4 ST'])        # streets crossing all of them
+    """
+    def __init__(self, names: np.ndarray, indptr: np.ndarray, indices: np.ndarray):
+        self.names = np.asarray(names, dtype=str)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __repr__(self):
+        return f"StreetIndex({len(self)} streets, {len(self.indices) // 2} crossings)"
+
+    # Build
+    @classmethod
+    def from_edges(cls, location_ids: Sequence, streets: Sequence[str]) -> 'StreetIndex':
+        """From a flat (location_id, street) table: streets at the same location are adjacent."""
+        edges = pd.DataFrame({'location_id': np.asarray(location_ids), 'street': np.asarray(streets, dtype=object)})
+        edges = edges.dropna().drop_duplicates()
+        names, street_ids = np.unique(edges['street'].astype(str).to_numpy(), return_inverse=True)
+        edges['street_id'] = street_ids
+
+        pairs = edges.merge(edges, on='location_id')[['street_id_x', 'street_id_y']].to_numpy()
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        pairs = np.unique(pairs, axis=0) # sorted by (street, neighbour)
+
+        indptr = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs[:, 0], minlength=len(names)), out=indptr[1:])
+        return cls(names, indptr, pairs[:, 1])
+
+    @classmethod
+    def from_crossstreets(cls, location_ids: Sequence, crossstreets: Iterable[Sequence[str]]) -> 'StreetIndex':
+        """From one list of street names per location (the `crossstreets` column)."""
+        crossstreets = [list(c) if c is not None else [] for c in crossstreets]
+        lengths = [len(c) for c in crossstreets]
+        return cls.from_edges(np.repeat(np.asarray(location_ids), lengths), [s for c in crossstreets for s in c])
+
+    # IO
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.stem + '.tmp.npz')
+        np.savez(tmp_path, names=self.names, indptr=self.indptr, indices=self.indices)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'StreetIndex':
+        with np.load(path) as data:
+            return cls(data['names'], data['indptr'], data['indices'])
+
+    @classmethod
+    def load_or_build(cls, path: Path, locations_gdf: pd.DataFrame, source_path: Optional[Path] = None) -> 'StreetIndex':
+        """Load the persisted index, or build and save it if missing or older than `source_path`."""
+        path = Path(path)
+        fresh = path.exists() and (source_path is None or not Path(source_path).exists()
+                                   or path.stat().st_mtime >= Path(source_path).stat().st_mtime)
+        if fresh:
+            return cls.load(path)
+        index = cls.from_crossstreets(locations_gdf['location_id'], locations_gdf['crossstreets'])
+        index.save(path)
+        return index
+
+    # Lookups
+    def ids(self, names: Sequence[str]) -> np.ndarray:
+        """Street ids for `names` (unknown names are dropped)."""
+        names = np.asarray(list(names), dtype=str)
+        pos = np.searchsorted(self.names, names)
+        found = pos < len(self.names)
+        found[found] = self.names[pos[found]] == names[found]
+        return pos[found]
+
+    def neighbors(self, street_id: int) -> np.ndarray:
+        return self.indices[self.indptr[street_id]:self.indptr[street_id + 1]]
+
+    def complete(self, prefix: str, limit: Optional[int] = None) -> np.ndarray:
+        """Names starting with `prefix`, in order."""
+        lo = np.searchsorted(self.names, prefix, side='left')
+        hi = np.searchsorted(self.names, prefix + '\U0010ffff', side='left')
+        return self.names[lo:hi if limit is None else min(hi, lo + limit)]
+
+    def valid_ids_with(self, selected_ids: Sequence[int]) -> np.ndarray:
+        """Ids of streets adjacent to every selected street (excluding the selection)."""
+        if len(selected_ids) == 0:
+            return np.arange(len(self.names))
+        common = reduce(np.intersect1d, (self.neighbors(i) for i in selected_ids))
+        return np.setdiff1d(common, selected_ids, assume_unique=True)
+
+    def valid_with(self, selected: Sequence[str]) -> List[str]:
+        return self.names[self.valid_ids_with(self.ids(selected))].tolist()
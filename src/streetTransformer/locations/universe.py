@@ -0,0 +1,165 @@
+from pathlib import Path
+from typing import Optional, List, Dict, Tuple
+from functools import cached_property, lru_cache, wraps
+from collections import OrderedDict
+import threading
+import logging
+
+import numpy as np
+import geopandas as gpd
+import shapely
+from shapely.geometry import Point
+
+from ..config.constants import UNIVERSES_PATH, YEARS
+from ..modalities.imagery.store import ImageryStore
+from ..modalities.documents.index import DocumentIndex
+from ..modalities.citydata.feature_store import feature_file_path, list_features
+from ..modalities.citydata.temporal import TemporalFeatureStore
+from .location import Location, _generate_universe_path
+from .location_geometry import tile_grid_bounds_proj
+
+logger = logging.getLogger(__name__)
+
+LOCATIONS_FILES = ['locations/locations_raw.parquet', 'locations.parquet', 'locations.feather']
+LOCATION_VIEWS_MAX = 1024 # Location views kept alive (each holds its own lazily loaded rows)
+
+def _locked_cached_property(func):
+    """cached_property whose first load runs once under the instance's `_lock`, even with concurrent first access."""
+    name = func.__name__
+    @wraps(func)
+    def getter(self):
+        with self._lock:
+            if name not in self.__dict__:
+                self.__dict__[name] = func(self)
+            return self.__dict__[name]
+    return cached_property(getter)
+
+
+class Universe:
+    """
+    Shared data for every Location of a universe.
+
+    Universe-level tables (locations, the document index, feature files) are read once, kept in
+    memory and indexed by `location_id`; `location()` hands out Location views that pull
+    their rows from here instead of re-reading the files. Safe to share across threads:
+    table loads and the Location LRU go through one lock.
+
+    Usage:
+        universe = Universe('caprecon_control5k')
+        loc = universe.location(12345)
+        compare = loc.compare_years(2016, 2024)
+    """
+    def __init__(self, universe_name:str, universe_path:Optional[Path]=None, years:List[int|str]=YEARS,
+                 max_locations:int=LOCATION_VIEWS_MAX):
+        self.universe_name = universe_name
+        self.universe_path = Path(universe_path or _generate_universe_path(universe_name, UNIVERSES_PATH))
+        self.years = [str(y) for y in years]
+
+        self._features: Dict[Tuple[str, str], Tuple[gpd.GeoDataFrame, Dict[int, np.ndarray]]] = {}
+        self.max_locations = max_locations
+        self._locations: 'OrderedDict[int, Location]' = OrderedDict() # LRU
+        self._lock = threading.RLock() # reentrant: location() loads `locations` while holding it
+
+    def __repr__(self):
+        return f"Universe({self.universe_name}, path={self.universe_path})"
+
+    # Tables
+    @_locked_cached_property
+    def locations(self) -> gpd.GeoDataFrame:
+        """All locations in EPSG:4326, indexed by location_id."""
+        for rel_path in LOCATIONS_FILES:
+            path = self.universe_path / rel_path
+            if path.exists():
+                gdf = gpd.read_feather(path) if path.suffix == '.feather' else gpd.read_parquet(path)
+                return gdf.to_crs('EPSG:4326').set_index('location_id', drop=False)
+        raise FileNotFoundError(f'No locations file in {self.universe_path}')
+
+    @_locked_cached_property
+    def imagery_store(self) -> Optional[ImageryStore]:
+        return ImageryStore.for_universe(self.universe_path)
+
+    @_locked_cached_property
+    def document_index(self) -> Optional[DocumentIndex]:
+        """Spatial index over documents.parquet (projected once to EPSG:2263)."""
+        path = self.universe_path / 'documents.parquet'
+        if not path.exists():
+            return None
+        return DocumentIndex.open(path)
+
+    @property
+    def documents(self) -> Optional[gpd.GeoDataFrame]:
+        """documents.parquet in EPSG:2263."""
+        return None if self.document_index is None else self.document_index.documents
+
+    def documents_for_locations(self, location_ids:Optional[List[int]]=None, clip:bool=False) -> gpd.GeoDataFrame:
+        """
+        Document hits for many locations in one vectorized query: one row per
+        (location_id, document) whose geometry intersects the location's tile-grid bbox.
+        """
+        if self.document_index is None:
+            raise FileNotFoundError(f'{self.universe_path / "documents.parquet"} not found!')
+        locations = self.locations if location_ids is None else self.locations.loc[location_ids]
+        bounds = tile_grid_bounds_proj(locations.geometry.x.to_numpy(), locations.geometry.y.to_numpy())
+        hits = self.document_index.query_many(bounds, locations.index.to_numpy())
+        if clip:
+            boxes = shapely.box(*bounds.T)
+            row_of = {l_id: i for i, l_id in enumerate(locations.index)}
+            hits['geometry'] = shapely.intersection(hits.geometry.values, boxes[hits['location_id'].map(row_of).to_numpy()])
+        return hits
+
+    @_locked_cached_property
+    def temporal_features(self) -> Optional[TemporalFeatureStore]:
+        """Feature validity intervals (features/intervals.parquet), if built."""
+        return TemporalFeatureStore.for_universe(self.universe_path)
+
+    def feature_names(self, year:str|int) -> List[str]:
+        return list_features(self.universe_path / 'features', year)
+
+    def _feature_table(self, year:str|int, feature_name:str) -> Tuple[gpd.GeoDataFrame, Dict[int, np.ndarray]]:
+        key = (str(year), feature_name)
+        with self._lock:
+            if key not in self._features:
+                table = gpd.read_parquet(feature_file_path(self.universe_path / 'features', key[0], feature_name))
+                table = table.reset_index(drop=True)
+                self._features[key] = (table, table.groupby('location_id').indices)
+            return self._features[key]
+
+    def feature_rows(self, year:str|int, feature_name:str, location_id:int) -> gpd.GeoDataFrame:
+        """Rows of one feature file for one location (an index lookup after the first read)."""
+        table, positions = self._feature_table(year, feature_name)
+        return table.iloc[positions.get(location_id, np.empty(0, dtype=np.int64))]
+
+    # Locations
+    def location(self, location_id:int, crossstreets:Optional[List[str]]=None,
+                 centroid:Optional[Point]=None) -> Location:
+        """A Location view backed by this universe's tables (the most recent `max_locations` are cached)."""
+        with self._lock: # check, insert, evict and return as one step: no other thread evicts in between
+            if location_id in self._locations:
+                self._locations.move_to_end(location_id)
+            else:
+                if crossstreets is None or centroid is None:
+                    row = self.locations.loc[location_id]
+                    crossstreets = row['crossstreets'] if crossstreets is None else crossstreets
+                    centroid = row['geometry'] if centroid is None else centroid
+                self._locations[location_id] = Location(
+                    location_id=location_id,
+                    universe_name=self.universe_name,
+                    crossstreets=crossstreets,
+                    centroid=centroid,
+                    years=self.years,
+                    universe_path=self.universe_path,
+                    universe=self,
+                )
+                while len(self._locations) > self.max_locations:
+                    self._locations.popitem(last=False)
+            return self._locations[location_id]
+
+    def iter_locations(self, location_ids:Optional[List[int]]=None):
+        for location_id in (self.locations.index if location_ids is None else location_ids):
+            yield self.location(location_id)
+
+
+@lru_cache(maxsize=8)
+def get_universe(universe_name:str, universe_path:Optional[Path]=None) -> Universe:
+    """Process-wide Universe per name, so repeated calls share loaded tables."""
+    return Universe(universe_name, universe_path)
@@ -0,0 +1,114 @@
+"""
+Partitioned features store for a universe.
+
+`features_pipeline` writes each (feature, year) snapshot as a Hive-style
+partition, sorted by `location_id` and split into small row groups:
+
+    {universe}/features/feature={feature}/year={year}/part-0.parquet
+
+Parquet keeps min/max statistics per row group, so a read filtered on
+`location_id` only decodes the few row groups that can contain it (and the
+`feature=`/`year=` directories prune whole files). The older flat layout,
+`features/{year}/{feature}.parquet`, is still readable.
+"""
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import geopandas as gpd
+
+ROW_GROUP_SIZE = 1024 # rows per row group; small groups = finer pruning on location_id
+
+# -----------------------------------------------------------------------------
+# Layout
+# -----------------------------------------------------------------------------
+def is_partitioned(features_root: Path) -> bool:
+    return Path(features_root).is_dir() and any(Path(features_root).glob('feature=*'))
+
+
+def partition_path(features_root: Path, year: int | str, feature: str) -> Path:
+    return Path(features_root) / f'feature={feature}' / f'year={year}' / 'part-0.parquet'
+
+
+def feature_file_path(features_root: Path, year: int | str, feature: str) -> Path:
+    """The file holding one (year, feature) snapshot, in whichever layout the store uses."""
+    if is_partitioned(features_root):
+        return partition_path(features_root, year, feature)
+    return Path(features_root) / str(year) / f'{feature}.parquet'
+
+
+def list_features(features_root: Path, year: Optional[int | str] = None) -> List[str]:
+    """Feature names in the store (optionally only those with a snapshot for `year`)."""
+    features_root = Path(features_root)
+    if is_partitioned(features_root):
+        return sorted(
+            p.name.split('=', 1)[1] for p in features_root.glob('feature=*')
+            if year is None or (p / f'year={year}').is_dir()
+        )
+    if year is None:
+        return sorted({f.stem for f in features_root.glob('*/*.parquet')})
+    return sorted(Path(f).stem for f in os.listdir(features_root / str(year)))
+
+
+# -----------------------------------------------------------------------------
+# Write
+# -----------------------------------------------------------------------------
+def write_feature_partition(gdf: gpd.GeoDataFrame, features_root: Path, year: int | str, feature: str,
+                            row_group_size: int = ROW_GROUP_SIZE) -> Path:
+    """Write one (year, feature) snapshot, sorted by location_id, replacing any previous one."""
+    out_path = partition_path(features_root, year, feature)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    gdf = gdf.drop(columns=[c for c in ['feature', 'year'] if c in gdf.columns]) # partition keys
+    gdf = gdf.sort_values('location_id', kind='stable').reset_index(drop=True)
+
+    # Hidden name: dataset reads of the partition directory skip dot-files, even mid-write
+    tmp_path = out_path.with_name(f'.{out_path.name}.tmp')
+    gdf.to_parquet(tmp_path, index=False, row_group_size=row_group_size, write_statistics=True)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+# -----------------------------------------------------------------------------
+# Read
+# -----------------------------------------------------------------------------
+def read_feature(features_root: Path, feature: str, location_ids: Optional[List[int]] = None,
+                 years: Optional[List[int | str]] = None, columns: Optional[List[str]] = None) -> gpd.GeoDataFrame:
+    """
+    Rows of one feature across years, with a `year` column. Filters on `location_ids`
+    and `years` are pushed down to the parquet reader (row-group / partition pruning).
+    """
+    filters = []
+    if location_ids is not None:
+        filters.append(('location_id', 'in', [int(l) for l in location_ids]))
+    if years is not None:
+        filters.append(('year', 'in', [int(y) for y in years]))
+
+    gdf = gpd.read_parquet(Path(features_root) / f'feature={feature}', columns=columns, filters=filters or None)
+    if 'year' in gdf.columns:
+        gdf['year'] = gdf['year'].astype(int)
+    return gdf
+
+
+def read_location_features(features_root: Path, location_id: int, years: List[int | str],
+                           features: Optional[List[str]] = None) -> Dict[str, Dict[str, gpd.GeoDataFrame]]:
+    """
+    {year: {feature: rows}} for one location: one pruned read per feature type
+    (partitioned layout) instead of a full scan of every file.
+    """
+    features = features or list_features(features_root)
+    out: Dict[str, Dict[str, gpd.GeoDataFrame]] = {str(y): {} for y in years}
+    for feature in features:
+        if is_partitioned(features_root):
+            gdf = read_feature(features_root, feature, location_ids=[location_id], years=years)
+            by_year = dict(tuple(gdf.groupby('year'))) if len(gdf) else {}
+            for y in years:
+                rows = by_year.get(int(y), gdf.iloc[0:0])
+                out[str(y)][feature] = rows.drop(columns='year')
+        else:
+            for y in years:
+                path = feature_file_path(features_root, y, feature)
+                if path.exists():
+                    gdf = gpd.read_parquet(path)
+                    out[str(y)][feature] = gdf[gdf['location_id'] == location_id]
+    return out
@@ -0,0 +1,131 @@
+"""
+Temporal feature store: every feature near a location as a validity interval.
+
+`features_pipeline` writes `features/intervals.parquet` with one row per
+(location_id, feature row) and `valid_from` / `valid_to` columns, where a row is
+active on (valid_from, valid_to) - like the yearly snapshots, a feature installed
+on a date is not active on it yet - and NaT means unbounded. The store keeps it as
+flat NumPy arrays grouped by location (CSR: `offsets[i]:offsets[i+1]` are the
+intervals of `location_ids[i]`, sorted by valid_from), so a point-in-time or
+change query is a binary search plus a mask over a handful of rows.
+"""
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+INTERVALS_FILENAME = 'intervals.parquet'
+
+_MIN = np.iinfo(np.int64).min
+_MAX = np.iinfo(np.int64).max
+
+def _to_ns(dates) -> np.ndarray:
+    dates = dates if isinstance(dates, (list, tuple, np.ndarray, pd.Index, pd.Series)) else [dates]
+    return np.array([pd.Timestamp(d).as_unit('ns').value for d in dates], dtype=np.int64)
+
+
+def _col_to_ns(col: pd.Series, fill: int) -> np.ndarray:
+    arr = pd.to_datetime(col).to_numpy('datetime64[ns]')
+    out = arr.view(np.int64).copy()
+    out[np.isnat(arr)] = fill
+    return out
+
+
+class TemporalFeatureStore:
+    """
+    A row is active strictly inside (valid_from, valid_to), so `active_at` and
+    `active_matrix` agree with each other and with the yearly snapshots.
+
+    Usage:
+        store = TemporalFeatureStore.from_parquet(universe_path / 'features' / 'intervals.parquet')
+        store.active_at(12345, '2018-01-01')                     # rows active on that date
+        store.changes_between(12345, '2016-01-01', '2024-01-01') # install/remove events
+        store.active_matrix(12345, [f'{y}-01-01' for y in YEARS]) # feature x date counts
+    """
+    def __init__(self, intervals: pd.DataFrame):
+        intervals = intervals.sort_values(['location_id', 'valid_from'], kind='stable').reset_index(drop=True)
+        self.attributes = intervals.drop(columns=['valid_from', 'valid_to'])
+
+        loc = intervals['location_id'].to_numpy(np.int64)
+        self.location_ids, starts = np.unique(loc, return_index=True)
+        self.offsets = np.append(starts, len(loc)).astype(np.int64)
+
+        self.valid_from = _col_to_ns(intervals['valid_from'], _MIN)
+        self.valid_to = _col_to_ns(intervals['valid_to'], _MAX)
+        self.feature_names, self.feature_codes = np.unique(intervals['feature'].astype(str).to_numpy(), return_inverse=True)
+
+    def __len__(self) -> int:
+        return len(self.valid_from)
+
+    def __repr__(self):
+        return f"TemporalFeatureStore({len(self)} intervals, {len(self.location_ids)} locations, features={list(self.feature_names)})"
+
+    # IO
+    @classmethod
+    def from_parquet(cls, path: Path) -> 'TemporalFeatureStore':
+        return cls(pd.read_parquet(path))
+
+    @classmethod
+    def for_universe(cls, universe_path: Path) -> Optional['TemporalFeatureStore']:
+        path = Path(universe_path) / 'features' / INTERVALS_FILENAME
+        return cls.from_parquet(path) if path.exists() else None
+
+    # Lookups
+    def _rows(self, location_id: int, features: Optional[Sequence[str]] = None) -> np.ndarray:
+        i = np.searchsorted(self.location_ids, location_id)
+        if i == len(self.location_ids) or self.location_ids[i] != location_id:
+            return np.empty(0, dtype=np.int64)
+        rows = np.arange(self.offsets[i], self.offsets[i + 1])
+        if features is not None:
+            codes = np.flatnonzero(np.isin(self.feature_names, list(features)))
+            rows = rows[np.isin(self.feature_codes[rows], codes)]
+        return rows
+
+    def active_at(self, location_id: int, date, features: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Feature rows active at `location_id` on `date` (valid_from < date < valid_to)."""
+        rows = self._rows(location_id, features)
+        d = _to_ns(date)[0]
+        active = rows[(self.valid_from[rows] < d) & (d < self.valid_to[rows])]
+        return self.attributes.iloc[active]
+
+    def changes_between(self, location_id: int, start, end, features: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Install / remove events at `location_id` in [start, end), sorted by date."""
+        rows = self._rows(location_id, features)
+        d0, d1 = _to_ns(start)[0], _to_ns(end)[0]
+        installs = rows[(d0 <= self.valid_from[rows]) & (self.valid_from[rows] < d1)]
+        removals = rows[(d0 <= self.valid_to[rows]) & (self.valid_to[rows] < d1)]
+
+        hit = np.concatenate([installs, removals])
+        dates = np.concatenate([self.valid_from[installs], self.valid_to[removals]])
+        order = np.argsort(dates, kind='stable')
+
+        events = self.attributes.iloc[hit[order]].copy()
+        events.insert(0, 'date', pd.to_datetime(dates[order]))
+        events.insert(1, 'event', np.repeat(['install', 'remove'], [len(installs), len(removals)])[order])
+        return events
+
+    def active_matrix(self, location_id: int, dates: Sequence, features: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Counts of active rows per feature (index) and date (columns), in one broadcast."""
+        rows = self._rows(location_id, features)
+        d = _to_ns(dates)
+        active = (self.valid_from[rows, None] < d) & (d < self.valid_to[rows, None])   # (n_rows, n_dates)
+        names = list(features) if features is not None else list(self.feature_names)
+        counts = np.zeros((len(self.feature_names), len(d)), dtype=np.int64)
+        np.add.at(counts, self.feature_codes[rows], active.astype(np.int64))
+        matrix = pd.DataFrame(counts, index=self.feature_names, columns=list(dates))
+        return matrix.reindex(names, fill_value=0)
+
+
+def build_intervals_table(joined_by_feature: Dict[str, pd.DataFrame], keep_cols: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Stack per-feature location joins (with valid_from / valid_to) into the intervals table.
+    Geometry is dropped; `keep_cols` (if found) are kept as attributes.
+    """
+    frames = []
+    for feature, joined in joined_by_feature.items():
+        cols = ['location_id', 'valid_from', 'valid_to'] + [c for c in (keep_cols or []) if c in joined.columns]
+        frame = pd.DataFrame(joined[cols]).reset_index(drop=True)
+        frame.insert(1, 'feature', feature)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
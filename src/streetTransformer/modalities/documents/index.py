@@ -0,0 +1,86 @@
+"""
+Spatial index over a universe's geocoded documents.
+
+`documents.parquet` is projected to EPSG:2263 once and the result is persisted
+next to it (`.documents_2263.parquet`, rebuilt when the source changes), so
+opening the index is a GeoParquet read plus an STRtree build, with no
+reprojection. Per-location lookups are bbox queries against the tree, and
+`query_many` resolves the hits of many locations in one vectorized call.
+"""
+import os
+import logging
+from pathlib import Path
+from functools import lru_cache
+from typing import Optional, Sequence
+
+import numpy as np
+import geopandas as gpd
+import shapely
+from shapely.geometry import box
+
+logger = logging.getLogger(__name__)
+
+PROJ_CRS = 'EPSG:2263'
+
+class DocumentIndex:
+    """
+    Usage:
+        index = DocumentIndex.open(universe_path / 'documents.parquet')
+        docs = index.query(location.geometry.bounds_proj)          # like .to_crs(2263).clip(bbox)
+        hits = index.query_many(bounds_array, location_ids)        # one row per (location, document)
+    """
+    def __init__(self, documents_p: gpd.GeoDataFrame):
+        self.documents = documents_p.reset_index(drop=True)
+        self.tree = shapely.STRtree(self.documents.geometry.values)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @classmethod
+    def open(cls, documents_path: Path, rebuild: bool = False) -> 'DocumentIndex':
+        """Open the index for `documents_path`, (re)building the projected copy if it is stale."""
+        documents_path = Path(documents_path)
+        projected_path = documents_path.with_name(f'.{documents_path.stem}_{PROJ_CRS.split(":")[1]}.parquet')
+
+        stale = (
+            rebuild
+            or not projected_path.exists()
+            or projected_path.stat().st_mtime < documents_path.stat().st_mtime
+        )
+        if stale:
+            documents_p = gpd.read_parquet(documents_path).to_crs(PROJ_CRS)
+            tmp_path = projected_path.with_suffix('.tmp.parquet')
+            documents_p.to_parquet(tmp_path, write_covering_bbox=True)
+            os.replace(tmp_path, projected_path)
+            logger.info(f'Projected {len(documents_p)} documents to {PROJ_CRS} -> {projected_path}')
+        else:
+            documents_p = gpd.read_parquet(projected_path)
+        return cls(documents_p)
+
+    # Queries
+    def query(self, bounds: Sequence[float], clip: bool = True) -> gpd.GeoDataFrame:
+        """Documents intersecting `bounds` (minx, miny, maxx, maxy in EPSG:2263)."""
+        bbox = box(*bounds)
+        hits = self.documents.iloc[np.sort(self.tree.query(bbox, predicate='intersects'))]
+        return hits.clip(bbox) if clip else hits
+
+    def query_many(self, bounds: np.ndarray, location_ids: Optional[Sequence] = None) -> gpd.GeoDataFrame:
+        """
+        Documents intersecting each of many bboxes, as one frame with a `location_id`
+        column (the row number of `bounds` if `location_ids` is not given).
+        Geometries are not clipped.
+        """
+        bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        boxes = shapely.box(bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3])
+        loc_idx, doc_idx = self.tree.query(boxes, predicate='intersects')
+
+        hits = self.documents.iloc[doc_idx].reset_index(drop=True)
+        ids = np.arange(len(bounds)) if location_ids is None else np.asarray(location_ids)
+        hits.insert(0, 'location_id', ids[loc_idx])
+        return hits
+
+
+@lru_cache(maxsize=8)
+def load_document_index(documents_path: Path) -> DocumentIndex:
+    """Process-wide DocumentIndex per documents file."""
+    return DocumentIndex.open(documents_path)
@@ -0,0 +1,348 @@
+"""
+Consolidated imagery store for a universe.
+
+Instead of one `imagery/{year}/{location_id}.png` per location-year, mosaics are
+packed into a handful of uint8 `.npy` chunks per year and read back through
+memory maps, so looking up an image is an index lookup plus a slice (no stat,
+open or PNG decode per file). Layout:
+
+    {universe}/imagery_store/
+        {year}/index.parquet          location_id -> (chunk, slot)
+        {year}/chunk_00000.npy        (n, h, w, c) uint8
+        ...
+
+`build_imagery_store` packs an existing `imagery/` tree (incrementally), and
+`ImageryStore.export_pngs` writes PNGs back out.
+"""
+import io
+import os
+import shutil
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+STORE_DIRNAME = 'imagery_store'
+INDEX_FILENAME = 'index.parquet'
+CHUNK_SIZE_DEFAULT = 512 # images per chunk (~880 MB at 768px RGB)
+
+# -----------------------------------------------------------------------------
+# Store
+# -----------------------------------------------------------------------------
+class ImageryStore:
+    """
+    Read (and append to) a chunked imagery store.
+
+    Usage:
+        store = ImageryStore(universe_path / 'imagery_store')
+        arr = store.get(2024, 12345)        # (h, w, 3) read-only view, or None
+        img = store.get_image(2024, 12345)  # PIL.Image
+    """
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._indexes: Dict[str, Dict[int, Tuple[int, int]]] = {}
+        self._chunks: Dict[Tuple[str, int], np.ndarray] = {}
+
+    @classmethod
+    def for_universe(cls, universe_path: Path) -> Optional['ImageryStore']:
+        """The store of a universe, or None if it has not been built."""
+        root = Path(universe_path) / STORE_DIRNAME
+        return cls(root) if root.is_dir() else None
+
+    # Dunders
+    def __contains__(self, year_location: Tuple[int | str, int]) -> bool:
+        year, location_id = year_location
+        return int(location_id) in self.index(year)
+
+    def __repr__(self):
+        return f"ImageryStore({self.root}, years={self.years})"
+
+    # Index
+    @property
+    def years(self) -> List[str]:
+        if not self.root.is_dir():
+            return []
+        return sorted(p.name for p in self.root.iterdir() if (p / INDEX_FILENAME).exists())
+
+    def index(self, year: int | str) -> Dict[int, Tuple[int, int]]:
+        """location_id -> (chunk, slot) for `year` (empty if the year is not stored)."""
+        year = str(year)
+        if year not in self._indexes:
+            path = self.root / year / INDEX_FILENAME
+            if path.exists():
+                df = pd.read_parquet(path)
+                self._indexes[year] = dict(zip(
+                    df['location_id'].astype(int), zip(df['chunk'].astype(int), df['slot'].astype(int))
+                ))
+            else:
+                self._indexes[year] = {}
+        return self._indexes[year]
+
+    def location_ids(self, year: int | str) -> List[int]:
+        return sorted(self.index(year))
+
+    def _chunk_path(self, year: str, chunk: int) -> Path:
+        return self.root / year / f'chunk_{chunk:05d}.npy'
+
+    def _next_chunk(self, year: str) -> int:
+        # Chunks on disk but not in the index (e.g. from an interrupted append) are never reused
+        on_disk = [int(p.stem.split('_')[1]) for p in (self.root / year).glob('chunk_?????.npy')]
+        return max(on_disk + [c for c, _ in self.index(year).values()], default=-1) + 1
+
+    def _chunk(self, year: str, chunk: int) -> np.ndarray:
+        arr = self._chunks.get((year, chunk))
+        if arr is None:
+            arr = np.load(self._chunk_path(year, chunk), mmap_mode='r')
+            self._chunks[(year, chunk)] = arr
+        return arr
+
+    # Reads
+    def get(self, year: int | str, location_id: int) -> Optional[np.ndarray]:
+        """Memory-mapped (h, w, c) view of a mosaic; copy it before modifying."""
+        year = str(year)
+        loc = self.index(year).get(int(location_id))
+        if loc is None:
+            return None
+        chunk, slot = loc
+        return self._chunk(year, chunk)[slot]
+
+    def get_image(self, year: int | str, location_id: int) -> Optional[Image.Image]:
+        arr = self.get(year, location_id)
+        return None if arr is None else Image.fromarray(np.asarray(arr))
+
+    def get_png_bytes(self, year: int | str, location_id: int) -> Optional[bytes]:
+        img = self.get_image(year, location_id)
+        if img is None:
+            return None
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+        return buf.getvalue()
+
+    # Writes
+    def append(self, year: int | str, images: Iterable[Tuple[int, np.ndarray]],
+               chunk_size: int = CHUNK_SIZE_DEFAULT) -> int:
+        """
+        Add (location_id, array) pairs for `year` as new chunks. Images of different
+        shapes go to different chunks. Existing location_ids are replaced in the index.
+        Returns the number of images written.
+        """
+        year = str(year)
+        year_dir = self.root / year
+        year_dir.mkdir(parents=True, exist_ok=True)
+        index = dict(self.index(year))
+        next_chunk = self._next_chunk(year)
+
+        pending: Dict[tuple, List[Tuple[int, np.ndarray]]] = {}
+        n_written = 0
+
+        def write_chunk(items: List[Tuple[int, np.ndarray]]) -> None:
+            nonlocal next_chunk
+            path = self._chunk_path(year, next_chunk)
+            tmp_path = path.with_suffix('.tmp.npy')
+            np.save(tmp_path, np.stack([arr for _, arr in items]))
+            os.replace(tmp_path, path)
+            for slot, (location_id, _) in enumerate(items):
+                index[int(location_id)] = (next_chunk, slot)
+            next_chunk += 1
+
+        for location_id, arr in images:
+            arr = np.asarray(arr, dtype=np.uint8)
+            bucket = pending.setdefault(arr.shape, [])
+            bucket.append((location_id, arr))
+            n_written += 1
+            if len(bucket) >= chunk_size:
+                write_chunk(bucket)
+                pending[arr.shape] = []
+
+        for bucket in pending.values():
+            if bucket:
+                write_chunk(bucket)
+
+        self._write_index(year, index)
+        return n_written
+
+    def _write_index(self, year: str, index: Dict[int, Tuple[int, int]]) -> None:
+        df = pd.DataFrame(
+            [(loc, chunk, slot) for loc, (chunk, slot) in sorted(index.items())],
+            columns=['location_id', 'chunk', 'slot']
+        )
+        path = self.root / year / INDEX_FILENAME
+        tmp_path = path.with_suffix('.tmp.parquet')
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self._indexes[year] = index
+
+    def merge_from(self, other: 'ImageryStore', years: Optional[List[str]] = None) -> int:
+        """
+        Add every chunk of `other` to this store (renumbered). Chunks are hardlinked
+        where possible (copied across filesystems); `other` is left untouched.
+        Location_ids present in both keep `other`'s image. Returns images merged.
+        """
+        n = 0
+        for year in (years or other.years):
+            year = str(year)
+            other_index = other.index(year)
+            if not other_index:
+                continue
+            year_dir = self.root / year
+            year_dir.mkdir(parents=True, exist_ok=True)
+            index = dict(self.index(year))
+            next_chunk = self._next_chunk(year)
+
+            renumber = {}
+            for chunk in sorted({c for c, _ in other_index.values()}):
+                renumber[chunk] = next_chunk
+                _link_or_copy(other._chunk_path(year, chunk), self._chunk_path(year, next_chunk))
+                next_chunk += 1
+            for location_id, (chunk, slot) in other_index.items():
+                index[location_id] = (renumber[chunk], slot)
+            n += len(other_index)
+
+            self._write_index(year, index)
+        return n
+
+    # Export
+    def export_pngs(self, out_dir: Path, years: Optional[List[str]] = None,
+                    location_ids: Optional[Iterable[int]] = None, max_workers: int = 8) -> int:
+        """Write `{out_dir}/{year}/{location_id}.png` for stored images. Returns files written."""
+        jobs = []
+        for year in (years or self.years):
+            year = str(year)
+            (Path(out_dir) / year).mkdir(parents=True, exist_ok=True)
+            ids = self.location_ids(year) if location_ids is None else [i for i in location_ids if (year, i) in self]
+            jobs += [(year, i) for i in ids]
+
+        def export(job):
+            year, location_id = job
+            self.get_image(year, location_id).save(Path(out_dir) / year / f'{location_id}.png')
+
+        with ThreadPoolExecutor(max_workers=max_workers) as ex: # PNG encoding releases the GIL
+            list(ex.map(export, jobs))
+        return len(jobs)
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    # Chunks are never modified once written, so sharing the inode is safe
+    tmp_path = dst.with_suffix('.tmp.npy')
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+# -----------------------------------------------------------------------------
+# Building
+# -----------------------------------------------------------------------------
+def _decode_png(path: Path) -> Tuple[int, Optional[np.ndarray]]:
+    try:
+        with Image.open(path) as img:
+            return int(path.stem), np.asarray(img.convert('RGB'))
+    except Exception as e:
+        logger.warning(f'{path}: {e}')
+        return int(path.stem), None
+
+
+def _decode_pngs(paths: List[Path], max_workers: int) -> Iterable[Tuple[int, np.ndarray]]:
+    """Decode `paths` in order, one batch of `4 * max_workers` at a time rather than all up front."""
+    batch = max_workers * 4
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        for i in range(0, len(paths), batch):
+            for loc, arr in ex.map(_decode_png, paths[i:i + batch]):
+                if arr is not None:
+                    yield loc, arr
+
+
+def build_imagery_store(
+    imagery_dir: Path,
+    store_root: Optional[Path] = None,
+    years: Optional[List[int | str]] = None,
+    chunk_size: int = CHUNK_SIZE_DEFAULT,
+    max_workers: int = 8,
+    rebuild: bool = False,
+) -> ImageryStore:
+    """
+    Pack `imagery_dir/{year}/{location_id}.png` into an ImageryStore (default:
+    a sibling `imagery_store/`). Incremental unless `rebuild`: only PNGs whose
+    location_id is not yet stored for that year are decoded and appended.
+    """
+    imagery_dir = Path(imagery_dir)
+    store = ImageryStore(store_root or imagery_dir.parent / STORE_DIRNAME)
+    if years is None:
+        years = sorted(p.name for p in imagery_dir.iterdir() if p.is_dir() and p.name.isdigit())
+
+    for year in years:
+        year = str(year)
+        if rebuild and (store.root / year).exists():
+            for p in (store.root / year).iterdir():
+                p.unlink()
+            store._indexes.pop(year, None)
+
+        have = store.index(year)
+        paths = sorted(
+            (p for p in (imagery_dir / year).glob('*.png') if p.stem.isdigit() and int(p.stem) not in have),
+            key=lambda p: int(p.stem)
+        )
+        if not paths:
+            continue
+
+        n = store.append(year, _decode_pngs(paths, max_workers), chunk_size=chunk_size)
+        logger.info(f'Imagery store ({year}): {n} images added, {len(store.index(year))} total')
+
+    return store
+
+
+def read_from_store_for_path(image_path: Path) -> Optional[np.ndarray]:
+    """
+    Resolve a universe image path (`{universe}/imagery/{year}/{location_id}.png`) against
+    the universe's imagery store. Lets code that passes PNG paths around keep working
+    after the PNGs have been packed away.
+    """
+    image_path = Path(image_path)
+    try:
+        year, location_id = image_path.parent.name, int(image_path.stem)
+        universe_path = image_path.parents[2]
+    except (ValueError, IndexError):
+        return None
+    store = _store_for_universe(universe_path)
+    return None if store is None else store.get(year, location_id)
+
+
+_open_stores: Dict[Path, Optional[ImageryStore]] = {}
+
+def _store_for_universe(universe_path: Path) -> Optional[ImageryStore]:
+    universe_path = Path(universe_path).resolve()
+    if universe_path not in _open_stores:
+        _open_stores[universe_path] = ImageryStore.for_universe(universe_path)
+    return _open_stores[universe_path]
+
+
+# -----------------------------------------------------------------------------
+# CLI
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    import argparse
+    from ...config.constants import UNIVERSES_PATH
+
+    parser = argparse.ArgumentParser(description='Pack a universe\'s PNG imagery into an imagery store, or export it back.')
+    parser.add_argument('universe_name')
+    parser.add_argument('--export', type=Path, default=None, help='Write PNGs from the store to this directory instead')
+    parser.add_argument('--years', nargs='*', default=None)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE_DEFAULT)
+    parser.add_argument('--rebuild', action='store_true')
+    args = parser.parse_args()
+
+    universe_path = UNIVERSES_PATH / args.universe_name
+    if args.export:
+        n = ImageryStore(universe_path / STORE_DIRNAME).export_pngs(args.export, args.years)
+        print(f'Exported {n} PNGs to {args.export}')
+    else:
+        store = build_imagery_store(universe_path / 'imagery', years=args.years,
+                                    chunk_size=args.chunk_size, rebuild=args.rebuild)
+        print(store)